@@ -2,5 +2,108 @@
 
 MONGO_URL = "mongodb://localhost:27017/"
 MONGO_DB = "ds4100"
-COLLECTIONS = ['films', 'actors', 'films_agg']
+COLLECTIONS = ['films', 'actors', 'films_agg', 'films_agg_state', 'crawl_frontier', 'dead_letters']
 YEAR_TOLERANCE = 2
+# Hosts kept in the HTTP connection pool (IMDb and Box Office Mojo) and idle connections kept per host,
+# sized to the number of consumers fetching pages
+HTTP_POOL_HOSTS = 4
+HTTP_POOL_SIZE = 10
+# Most items waiting in each collect_data todo and save queue (and fetches waiting in the 'concurrent' mode
+# CrawlEngine), a full queue makes the stage feeding it wait
+QUEUE_CAPACITY = 10000
+# (min, max) consumer threads per collect_data stage - a stage gets a worker for every CONSUMER_SCALE_DEPTH items
+# waiting in its input queue and loses one when the queue is empty, checked every CONSUMER_SCALE_INTERVAL seconds
+CONSUMER_WORKERS = {'find': (1, 8), 'scrape': (1, 8), 'actor': (1, 32), 'save_film': (1, 2), 'save_actor': (1, 4)}
+CONSUMER_SCALE_DEPTH = 50
+CONSUMER_SCALE_INTERVAL = 5
+# Seconds an idle consumer waits for an item before checking whether it was stopped
+CONSUMER_IDLE_TIMEOUT = 1
+# Whether Films and Actors drop their parsed pages as soon as their fields are scraped (False keeps them until they
+# are saved) and items of each queue measured to estimate its memory (an item still holding its pages takes a while to
+# measure)
+RELEASE_PAGES = True
+MEMORY_SAMPLE_SIZE = 2
+# Processes scraping fields out of fetched Film and Actor pages (0 to parse in the fetching threads, None for one
+# per core)
+PARSE_PROCESSES = 0
+# Local port serving the crawl's metrics as Prometheus text on /metrics and JSON on /metrics.json (None to not serve
+# them), file a JSON snapshot is written to every METRICS_SNAPSHOT_INTERVAL seconds (None to not write it) and
+# upper bounds in seconds of the latency histogram buckets
+METRICS_PORT = 9108
+METRICS_SNAPSHOT_FILE = 'metrics.json'
+METRICS_SNAPSHOT_INTERVAL = 30
+METRICS_LATENCY_BUCKETS = [0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0]
+# Ids read per round trip while collect_data loads the films and people already in MongoDB
+STARTUP_BATCH_SIZE = 10000
+# Seconds between checkpoints of the crawl's pending items and Box Office Mojo position (a restart redoes at most
+# this much work)
+FRONTIER_CHECKPOINT_INTERVAL = 10
+# Tries a collect_data stage gets at an item that raises, seconds before the first retry (doubles every retry) and
+# most seconds between retries - an item still failing is kept in the dead_letters collection until replayed with
+# run_replay_dead_letters.py
+RETRY_MAX_ATTEMPTS = 5
+RETRY_DELAY = 2.0
+RETRY_MAX_DELAY = 300.0
+# Films and actors saved per MongoDB write, seconds a saved document waits at most for its batch to fill and whether
+# a saved document replaces the one with the same id (True) or is inserted next to it (False)
+SAVE_BATCH_SIZE = 500
+SAVE_FLUSH_INTERVAL = 2
+SAVE_UPSERT = False
+# Seconds before a batch that failed to save is tried again (doubles while it keeps failing, up to
+# SAVE_RETRY_MAX_DELAY) and retries close makes before giving up on what is left
+SAVE_RETRY_DELAY = 1.0
+SAVE_RETRY_MAX_DELAY = 60.0
+SAVE_CLOSE_RETRIES = 5
+# What happens to saved films and actors: 'discard' (they are in MongoDB already), 'log' (appended as JSON lines to
+# OUTPUT_LOG_DIR/films.jsonl and actors.jsonl) or 'aggregate' (discarded, films_agg is computed with AGGREGATION_MODE
+# once the crawl is over)
+OUTPUT_SINK = 'discard'
+OUTPUT_LOG_DIR = 'crawl_output'
+# How SetQueues remember seen ids: 'exact' (interned strings), 'hashed' (64-bit hashes) or 'bloom' (hashes behind
+# a Bloom filter sized for SEEN_SET_BLOOM_CAPACITY ids at SEEN_SET_BLOOM_ERROR_RATE false positives)
+SEEN_SET_BACKEND = 'exact'
+SEEN_SET_BLOOM_CAPACITY = 5000000
+SEEN_SET_BLOOM_ERROR_RATE = 0.01
+# How collect_data crawls: 'threads' (one consumer thread per stage) or 'concurrent' (CrawlEngine)
+CRAWL_MODE = 'threads'
+# Threads waiting on page fetches and threads parsing fetched pages in 'concurrent' mode
+# (at least one parse thread per PARSE_PROCESSES process, a thread waits on the process parsing its page)
+CRAWL_FETCHERS = 200
+CRAWL_PARSERS = 4
+# Most fetches running against a single host at once in 'concurrent' mode
+CRAWL_HOST_CONCURRENCY = 32
+# (connect, read) timeout in seconds for every page fetch
+HTTP_TIMEOUT = (10, 30)
+# Requests per second per host: starting rate, bounds, about how much it climbs each second while the host
+# answers quickly and without errors, and what it is multiplied by when the host is slow, errors or throttles
+HTTP_RATE_START = 5.0
+HTTP_RATE_MIN = 0.5
+HTTP_RATE_MAX = 100.0
+HTTP_RATE_STEP = 0.5
+HTTP_RATE_BACKOFF = 0.5
+# Seconds a response can take before the host counts as slow
+HTTP_SLOW_LATENCY = 5.0
+# Retries of a throttled (429/503) fetch and seconds to wait before the first when there is no Retry-After (doubles)
+HTTP_MAX_RETRIES = 8
+HTTP_RETRY_DELAY = 2.0
+# Seconds a url answered with a client error (404...) is answered from memory instead of fetched again
+HTTP_FAILURE_TTL = 60 * 60
+# Most failed urls remembered at once, the oldest are forgotten first
+HTTP_FAILURE_MAX = 10000
+# Directory fetched pages are cached in (None to always fetch) and its disk budget in bytes
+HTTP_CACHE_DIR = 'http_cache'
+HTTP_CACHE_SIZE = 2 * 1024 ** 3
+# (url regex, seconds a cached page stays fresh) - first match wins, urls matching none aren't cached
+HTTP_CACHE_TTLS = [
+    (r'boxofficemojo\.com/movies/alphabetical', 24 * 60 * 60),
+    (r'imdb\.com/find', 7 * 24 * 60 * 60),
+    (r'boxofficemojo\.com/movies/\?id=', 7 * 24 * 60 * 60),
+    (r'imdb\.com/(title|name)/', 30 * 24 * 60 * 60)
+]
+# How films_agg is computed: 'objects' (Film.set_aggregate_fields), 'parallel' (objects on a process pool),
+# 'vectorized', 'verify' (vectorized compared with objects read without the FilmStore) or 'incremental' (only films
+# changed since the last run)
+AGGREGATION_MODE = 'objects'
+# Processes used by 'parallel' aggregation (None for one per core) and films handed to a process at a time
+AGGREGATION_WORKERS = None
+AGGREGATION_PARTITION_SIZE = 1000
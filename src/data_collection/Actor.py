@@ -1,14 +1,21 @@
 """ Class for an Actor (also Director) """
 import datetime
 import Film
-import requests
 from bs4 import BeautifulSoup
+from FilmTimeline import FilmTimeline
+from config.GLOBALS import RELEASE_PAGES
+from utils.fetch import fetch, count_avoided
+from utils.soup import make_soup, release_soup
 from utils.print_colors import OKGREEN, ENDC, FAIL, WARNING
 
 
 class Actor:
     # Class wide instance of a dictionary used to point to all Actor instances
     all_actors = dict()
+    # Class wide FilmStore read instead of all_actors during aggregation
+    store = None
+    # Shared Film returned when a film can't be found
+    default_film = None
 
     def __init__(self, imdb_id, director):
         # If there was a critical failure
@@ -27,6 +34,8 @@ class Actor:
         self.birthday = None
         # List of IMDb film ID's that they've appeared in (needs to be sorted)  !important
         self.films = []
+        # Prefix-sum index over the sorted films, built on the first aggregate lookup
+        self.timeline = None
 
     def handle_error(self, field):
         """
@@ -78,35 +87,61 @@ class Actor:
         """
         Calls each set function
         :mutate: Every field - see inner functions
+        :mutate imdb_page: released once the fields are set if RELEASE_PAGES
         :return: Nothing
         """
-        funcs = [self.set_imdb_page, self.set_name, self.set_birthday, self.set_films]
+        # The page is already handed in by the concurrent crawl
+        funcs = [self.set_imdb_page] if self.imdb_page is None else []
+        funcs += [self.set_name, self.set_birthday, self.set_films]
         for f in funcs:
             print "{0}Calling {1} for {2}...{3}".format(OKGREEN, str(f), self.id, ENDC)
             f()
+        # Only the plain fields are needed past this point
+        if RELEASE_PAGES:
+            self.purge()
 
-    def set_imdb_page(self):
+    def get_imdb_url(self):
+        """
+        Gets the IMDb page for the actor
+        :return: string url
+        """
+        return "http://www.imdb.com/name/{0}/?ref_=fn_al_tt_1".format(self.id)
+
+    def set_imdb_page(self, page=None):
         """
         Sets the self.imdb_page field
+        :param page: response for the IMDb page (fetched if not given)
         :mutate imdb_page: updates this field
         :return: BS'd imdb page
         """
-        page = requests.get("http://www.imdb.com/name/{0}/?ref_=fn_al_tt_1".format(self.id))
+        if page is None:
+            page = fetch(self.get_imdb_url())
         if page.status_code >= 400:
             self.imdb_page = self.handle_error('imdb_page')
         else:
-            self.imdb_page = BeautifulSoup(page.content, "html.parser")
+            self.imdb_page = make_soup(page.content)
+        return self.imdb_page
+
+    def get_imdb_page(self):
+        """
+        Gets the IMDb page, fetching it at most once even if it failed (a failed page is an empty soup)
+        :mutate imdb_page: if the page hasn't been fetched yet
+        :return: BS'd imdb page
+        """
+        if self.imdb_page is None:
+            self.set_imdb_page()
+        elif not self.imdb_page.contents:
+            count_avoided()
         return self.imdb_page
 
     def set_name(self):
         """
         Scrapes the actor name from the IMDb page
         :mutate name: updates this field
-        :mutate imdb_page: if the field isn't already filled
+        :mutate imdb_page: if the page hasn't been fetched yet
         :return: string
         """
-        if not self.imdb_page:
-            self.set_imdb_page()
+        self.get_imdb_page()
         try:
             self.name = self.imdb_page.find('span', {'itemprop': 'name'}).text.strip()
         except:
@@ -117,11 +152,10 @@ class Actor:
         """
         Scrapes the actor birthday from the IMDb page
         :mutate birthday: updates this field
-        :mutate imdb_page: if the field isn't already filled
+        :mutate imdb_page: if the page hasn't been fetched yet
         :return: datetime
         """
-        if not self.imdb_page:
-            self.set_imdb_page()
+        self.get_imdb_page()
         try:
             birthdate = self.imdb_page.find('time', {'itemprop': 'birthDate'})['datetime'].strip()
             # If only the year is available, set month and day to 1-1
@@ -135,12 +169,11 @@ class Actor:
         """
         Scrapes the film id's from the actor's IMDb page
         :mutate actors: updates this field
-        :mutate imdb_page: if the field isn't already filled
+        :mutate imdb_page: if the page hasn't been fetched yet
         :return: [string]
         """
         self.FILMS_SORTED = False
-        if not self.imdb_page:
-            self.set_imdb_page()
+        self.get_imdb_page()
         try:
             film_ids = []
             if not self.DIRECTOR:
@@ -194,13 +227,15 @@ class Actor:
         self.name = fields.get('name', self.get_default_value('name'))
         self.birthday = fields.get('birthday', self.get_default_value('birthday'))
         self.films = fields.get('films', self.get_default_value('films'))
+        self.FILMS_SORTED = False
 
     def purge(self):
         """
         Removes imdb_page field to free up space
-        :mutate imdb_page: sets to None
+        :mutate imdb_page: releases and sets to None
         :return: Nothing
         """
+        release_soup(self.imdb_page)
         self.imdb_page = None
 
 
@@ -210,13 +245,15 @@ class Actor:
         """
         Gets a Film instance using a film_id
         :param film_id: string id of a film
-        :return: a Film
+        :return: a Film (a FilmRecord when reading from the store)
         """
-        default = Film.Film('NonsenseFilmId', 'No Title', '3000')
+        if Film.Film.store:
+            return Film.Film.store.get_film(film_id)
         if Film.Film.all_films.get(film_id, None):
             return Film.Film.all_films[film_id]
-        else:
-            return default
+        if not Actor.default_film:
+            Actor.default_film = Film.Film('NonsenseFilmId', 'No Title', '3000')
+        return Actor.default_film
 
     def sort_films(self):
         """
@@ -226,6 +263,20 @@ class Actor:
         """
         self.FILMS_SORTED = True
         self.films = sorted(self.films, key=lambda f_id: self.get_film(f_id).get_release_date())
+        self.timeline = None
+
+    def get_timeline(self):
+        """
+        Gets the prefix-sum index over the sorted films
+        :mutate films: sorts the array if needed
+        :mutate timeline: builds it if needed
+        :return: FilmTimeline
+        """
+        if not self.FILMS_SORTED or self.timeline is None:
+            if not self.FILMS_SORTED:
+                self.sort_films()
+            self.timeline = FilmTimeline(self.films, self.get_film)
+        return self.timeline
 
     def get_film_average_before(self, func, stop):
         """
@@ -287,81 +338,84 @@ class Actor:
         :param f_id:
         :return: the number of appearances before a movie
         """
-        if not self.FILMS_SORTED:
-            self.sort_films()
-        try:
-            return self.films.index(f_id)
-        except:
-            return 0
+        return self.get_timeline().appearances_before(f_id)
 
     def get_avg_film_revenue_before(self, f_id):
         """
         Gets the average revenue before a film
         :param f_id: the id for the film to stop at
         :mutate films: sorts if needed
+        :mutate timeline: builds if needed
         :return: int
         """
-        return self.get_film_average_before(lambda fid: self.get_film(fid).get_revenue(), f_id)
+        return self.get_timeline().average_before("revenue", f_id)
 
     def get_max_film_revenue_before(self, f_id):
         """
         Gets the max revenue before a film
         :param f_id: the id for the film to stop at
         :mutate films: sorts if needed
+        :mutate timeline: builds if needed
         :return: int
         """
-        return self.get_film_max_before(lambda fid: self.get_film(fid).get_revenue(), f_id)
+        return self.get_timeline().max_before("revenue", f_id)
 
     def get_avg_film_stars_before(self, f_id):
         """
         Gets the average stars before a film
         :param f_id: the id for the film to stop at
         :mutate films: sorts if needed
+        :mutate timeline: builds if needed
         :return: int
         """
-        return self.get_film_average_before(lambda fid: self.get_film(fid).get_stars(), f_id)
+        return self.get_timeline().average_before("stars", f_id)
 
     def get_max_film_stars_before(self, f_id):
         """
         Gets the max stars before a film
         :param f_id: the id for the film to stop at
         :mutate films: sorts if needed
+        :mutate timeline: builds if needed
         :return: int
         """
-        return self.get_film_max_before(lambda fid: self.get_film(fid).get_stars(), f_id)
+        return self.get_timeline().max_before("stars", f_id)
 
     def get_avg_film_metascore_before(self, f_id):
         """
         Gets the average metascore before a film
         :param f_id: the id for the film to stop at
         :mutate films: sorts if needed
+        :mutate timeline: builds if needed
         :return: int
         """
-        return self.get_film_average_before(lambda fid: self.get_film(fid).get_metascore(), f_id)
+        return self.get_timeline().average_before("metascore", f_id)
 
     def get_max_film_metascore_before(self, f_id):
         """
         Gets the max metascore before a film
         :param f_id: the id for the film to stop at
         :mutate films: sorts if needed
+        :mutate timeline: builds if needed
         :return: int
         """
-        return self.get_film_max_before(lambda fid: self.get_film(fid).get_metascore(), f_id)
+        return self.get_timeline().max_before("metascore", f_id)
 
     def get_avg_film_votes_before(self, f_id):
         """
         Gets the average votes before a film
         :param f_id: the id for the film to stop at
         :mutate films: sorts if needed
+        :mutate timeline: builds if needed
         :return: int
         """
-        return self.get_film_average_before(lambda fid: self.get_film(fid).get_num_votes(), f_id)
+        return self.get_timeline().average_before("votes", f_id)
 
     def get_max_film_votes_before(self, f_id):
         """
         Gets the max votes before a film
         :param f_id: the id for the film to stop at
         :mutate films: sorts if needed
+        :mutate timeline: builds if needed
         :return: int
         """
-        return self.get_film_max_before(lambda fid: self.get_film(fid).get_num_votes(), f_id)
+        return self.get_timeline().max_before("votes", f_id)
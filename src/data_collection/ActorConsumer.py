@@ -1,8 +1,11 @@
 """ Takes Actor ID's output from ScrapeIMDbConsumer, scrapes 'em and adds to output Queue """
 from QueueConsumer import QueueConsumer
+from utils.fetch import fetch
+import parse_pool
 
 
 class ActorConsumer(QueueConsumer):
+    stage = 'actor'
 
     def consume(self):
         """
@@ -11,9 +14,12 @@ class ActorConsumer(QueueConsumer):
         :param output_q: queue of output items
         :return: Nothing
         """
-        actor_todo = self.input_q.get()
-        self.input_q.task_done()
-        actor_todo.set_non_aggregate_fields()
+        actor_todo = self.get_input()
+        if parse_pool.pool:
+            # The page is fetched here and parsed on the parse processes
+            parse_pool.scrape_actor(actor_todo, fetch(actor_todo.get_imdb_url()))
+        else:
+            actor_todo.set_non_aggregate_fields()
         if actor_todo.DIRECTOR:
             self.output_q.put(actor_todo, "director-{0}".format(actor_todo.id))
         else:
@@ -0,0 +1,167 @@
+""" Buffers writes to a collection and sends them in batches - one round trip per batch instead of per document """
+from pymongo import InsertOne, ReplaceOne
+from pymongo.errors import BulkWriteError, PyMongoError
+from threading import Thread, Condition, Event
+from time import time, sleep
+from config.GLOBALS import SAVE_BATCH_SIZE, SAVE_FLUSH_INTERVAL, SAVE_UPSERT, SAVE_RETRY_DELAY, SAVE_RETRY_MAX_DELAY, \
+    SAVE_CLOSE_RETRIES
+from utils.print_colors import FAIL, WARNING, ENDC
+
+# Write error codes a retry can't fix (duplicate key, document failed validation)
+PERMANENT_ERRORS = {11000, 121}
+
+
+class BatchWriter:
+    def __init__(self, collection, keys, batch_size=SAVE_BATCH_SIZE, flush_interval=SAVE_FLUSH_INTERVAL,
+                 upsert=SAVE_UPSERT):
+        # Collection the documents are written to
+        self.collection = collection
+        # Fields identifying a document, an upsert replaces the document with the same values
+        self.keys = keys
+        # Writes buffered before a bulk write, seconds a write waits at most and whether add upserts or inserts
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.upsert = upsert
+        # Write requests waiting to be sent and bulk writes being sent (flush waits on requests_lock for them)
+        self.requests = []
+        self.writing = 0
+        self.requests_lock = Condition()
+        # Documents written and documents that failed to be for good
+        self.written = 0
+        self.failed = 0
+        # Writes that failed in a row and when the buffer (failed writes first) is tried again
+        self.failures = 0
+        self.retry_at = 0
+        # Set to stop the thread flushing every flush_interval
+        self.stopping = Event()
+        self.thread = None
+
+    def add(self, doc):
+        """
+        Buffers a document to insert (or upsert)
+        :param doc: dict to save
+        :mutate requests: adds the write
+        :return: Nothing
+        """
+        if self.upsert:
+            self.add_request(ReplaceOne(dict((k, doc.get(k)) for k in self.keys), doc, upsert=True))
+        else:
+            self.add_request(InsertOne(doc))
+
+    def add_request(self, request):
+        """
+        Buffers a write, sending the buffer once it holds batch_size writes
+        :param request: pymongo write (InsertOne, UpdateOne...)
+        :mutate requests: adds the write
+        :return: Nothing
+        """
+        with self.requests_lock:
+            self.requests.append(request)
+            full = len(self.requests) >= self.batch_size
+        if full:
+            self.flush()
+
+    def write(self, requests):
+        """
+        Sends writes in one unordered bulk write, so a bad document doesn't stop the rest
+        :param requests: [pymongo write]
+        :mutate written: adds the documents written
+        :mutate failed: adds the documents rejected for good
+        :return: [pymongo write] the writes to try again (the server was unreachable or failed them)
+        """
+        retry = []
+        try:
+            details = self.collection.bulk_write(requests, ordered=False).bulk_api_result
+        except BulkWriteError as e:
+            details = e.details
+            retry = [requests[error['index']] for error in details['writeErrors']
+                     if error.get('code') not in PERMANENT_ERRORS]
+            print "{0}Failed to save {1} of {2} documents to {3} ({4} to retry): {5}{6}".format(
+                FAIL, len(details['writeErrors']), len(requests), self.collection.name, len(retry),
+                details['writeErrors'][0]['errmsg'] if details['writeErrors'] else '', ENDC)
+        except PyMongoError as e:
+            print "{0}Failed to save {1} documents to {2}, retrying: {3}{4}".format(
+                FAIL, len(requests), self.collection.name, str(e), ENDC)
+            details = {'nInserted': 0, 'nUpserted': 0, 'nMatched': 0}
+            retry = requests
+        count = details['nInserted'] + details['nUpserted'] + details['nMatched']
+        with self.requests_lock:
+            self.written += count
+            self.failed += len(requests) - count - len(retry)
+        return retry
+
+    def flush(self):
+        """
+        Sends every buffered write, unless writes failed lately and their retry isn't due yet
+        :mutate requests: empties it (keeps the writes that failed to be retried, first)
+        :return: Boolean True if every write buffered before the call is written
+        """
+        with self.requests_lock:
+            # A bulk write another thread is sending puts its writes back if it fails, so it is waited for
+            while self.writing:
+                self.requests_lock.wait()
+            if not self.requests:
+                return True
+            if self.retry_at > time():
+                return False
+            requests, self.requests = self.requests, []
+            self.writing += 1
+        retry = requests
+        try:
+            retry = self.write(requests)
+        finally:
+            with self.requests_lock:
+                self.writing -= 1
+                if retry:
+                    self.requests = retry + self.requests
+                    self.failures += 1
+                    self.retry_at = time() + min(SAVE_RETRY_MAX_DELAY, SAVE_RETRY_DELAY * 2 ** (self.failures - 1))
+                else:
+                    self.failures = 0
+                    self.retry_at = 0
+                self.requests_lock.notify_all()
+        return not retry
+
+    def pending(self):
+        """
+        Returns the number of writes waiting to be sent
+        :return: int
+        """
+        with self.requests_lock:
+            return len(self.requests)
+
+    def flush_loop(self):
+        """
+        Flushes every flush_interval seconds until stopped, so documents don't wait on a slow stage for a full batch
+        :return: Nothing
+        """
+        while not self.stopping.wait(self.flush_interval):
+            self.flush()
+
+    def start(self):
+        """
+        Starts the thread flushing every flush_interval
+        :mutate thread: starts and adds a thread
+        :return: Nothing
+        """
+        self.thread = Thread(target=self.flush_loop)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def close(self):
+        """
+        Stops the flushing thread and writes what is left, retrying SAVE_CLOSE_RETRIES times if it fails
+        :mutate stopping: set
+        :mutate requests: empties it (keeps what still couldn't be written)
+        :return: Boolean True if everything was written
+        """
+        self.stopping.set()
+        if self.thread:
+            self.thread.join()
+        for attempt in range(SAVE_CLOSE_RETRIES):
+            if self.flush():
+                return True
+            print "{0}{1} documents left to save to {2}, retrying...{3}".format(
+                WARNING, self.pending(), self.collection.name, ENDC)
+            sleep(max(0, self.retry_at - time()))
+        return self.flush()
@@ -0,0 +1,101 @@
+""" Runs a stage's QueueConsumers as a pool - more workers while its input queue backs up, fewer once it's idle """
+from threading import Thread, Lock, Event
+from config.GLOBALS import CONSUMER_SCALE_DEPTH, CONSUMER_SCALE_INTERVAL
+
+
+class ConsumerPool:
+    def __init__(self, name, input_q, make_consumer, min_workers, max_workers):
+        # Stage name for the status line
+        self.name = name
+        # SetQueue the stage's consumers take items from, its depth drives the scaling
+        self.input_q = input_q
+        # Function returning a new (not started) QueueConsumer for the stage
+        self.make_consumer = make_consumer
+        # A stage always keeps at least one worker
+        self.min_workers = max(1, min_workers)
+        self.max_workers = max(self.min_workers, max_workers)
+        # Running consumers
+        self.consumers = []
+        self.consumers_lock = Lock()
+        # Set to stop scaling
+        self.stopping = Event()
+        self.thread = None
+
+    def add_worker(self):
+        """
+        Starts one more consumer (must hold consumers_lock)
+        :mutate consumers: adds the consumer
+        :return: Nothing
+        """
+        c = self.make_consumer()
+        c.start()
+        self.consumers.append(c)
+
+    def remove_worker(self):
+        """
+        Stops the newest consumer, it exits once it's done with its current item (must hold consumers_lock)
+        :mutate consumers: removes the consumer
+        :return: Nothing
+        """
+        self.consumers.pop().stop()
+
+    def scale(self):
+        """
+        Adds a worker for every CONSUMER_SCALE_DEPTH items waiting, removes one when nothing is waiting
+        :mutate consumers: adds or removes consumers within min_workers and max_workers
+        :return: Nothing
+        """
+        with self.consumers_lock:
+            depth = self.input_q.qsize()
+            wanted = min(self.max_workers, max(self.min_workers, -(-depth // CONSUMER_SCALE_DEPTH)))
+            if wanted > len(self.consumers):
+                for i in range(wanted - len(self.consumers)):
+                    self.add_worker()
+            elif not depth and len(self.consumers) > self.min_workers:
+                self.remove_worker()
+
+    def scale_loop(self):
+        """
+        Scales the pool every CONSUMER_SCALE_INTERVAL seconds until stopped
+        :return: Nothing
+        """
+        while not self.stopping.wait(CONSUMER_SCALE_INTERVAL):
+            self.scale()
+
+    def start(self):
+        """
+        Starts min_workers consumers and the thread scaling them
+        :mutate consumers: adds the consumers
+        :mutate thread: starts and adds a thread
+        :return: Nothing
+        """
+        with self.consumers_lock:
+            for i in range(self.min_workers):
+                self.add_worker()
+        self.thread = Thread(target=self.scale_loop, args=())
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stops scaling and every consumer, waiting for their threads to finish their current item and exit
+        :mutate stopping: set
+        :mutate consumers: removes every consumer
+        :return: Nothing
+        """
+        self.stopping.set()
+        if self.thread:
+            self.thread.join()
+        with self.consumers_lock:
+            stopped = list(self.consumers)
+            while self.consumers:
+                self.remove_worker()
+        for c in stopped:
+            c.join()
+
+    def size(self):
+        """
+        Returns the number of running consumers
+        :return: int
+        """
+        return len(self.consumers)
@@ -0,0 +1,174 @@
+""" Runs many page fetches at once - fetch threads wait on the network, parse threads run the callbacks """
+from Queue import Queue
+from threading import Thread, Lock, Event, BoundedSemaphore, Condition, local
+from time import time
+from urlparse import urlparse
+from utils import metrics
+from utils.fetch import fetch, FailedResponse
+from utils.print_colors import FAIL, ENDC
+
+
+class CrawlEngine:
+    def __init__(self, fetchers, parsers, host_concurrency, maxsize=0):
+        # Number of fetch threads, parse threads and fetches allowed against one host at once
+        self.fetchers = fetchers
+        self.parsers = parsers
+        self.host_concurrency = host_concurrency
+        # (url, callback) waiting to be fetched - submits from outside the engine wait while maxsize are (0 for no
+        # limit), callbacks don't so a parse thread never waits on a fetcher waiting on it (their fetches only come
+        # from pages already let in, outside submits wait for them to be fetched too)
+        self.fetch_q = Queue()
+        self.maxsize = maxsize
+        self.room = Condition()
+        # Set on the engine's own threads
+        self.local = local()
+        # (callback, response) waiting to be parsed, a fetcher waits with its page while it is full so at most
+        # fetchers + parsers pages wait besides one per fetcher and one per parse thread
+        self.parse_q = Queue(fetchers + parsers)
+        # Semaphore per host bounding the fetches running against it
+        self.host_slots = dict()
+        self.host_lock = Lock()
+        # Fetches submitted whose callback hasn't finished yet
+        self.pending = 0
+        self.pending_lock = Lock()
+        self.finished = Event()
+        self.finished.set()
+        self.threads = []
+
+    def get_host_slot(self, url):
+        """
+        Gets the semaphore bounding fetches against a url's host
+        :param url: page to get
+        :mutate host_slots: adds a semaphore for new hosts
+        :return: BoundedSemaphore
+        """
+        host = urlparse(url).netloc
+        with self.host_lock:
+            if host not in self.host_slots:
+                self.host_slots[host] = BoundedSemaphore(self.host_concurrency)
+            return self.host_slots[host]
+
+    def submit(self, url, callback):
+        """
+        Schedules a fetch - callback(response) is called on a parse thread once it is done, waits for room if maxsize
+        fetches are waiting and it isn't called from a callback
+        :param url: page to get
+        :param callback: function taking a requests.Response (FailedResponse if the fetch raised)
+        :mutate pending: counts the fetch
+        :return: Nothing
+        """
+        with self.pending_lock:
+            self.pending += 1
+            self.finished.clear()
+        if self.maxsize and not getattr(self.local, 'engine', False):
+            with self.room:
+                while self.fetch_q.qsize() >= self.maxsize:
+                    # Waiting in steps keeps the main thread responsive to Ctrl-C
+                    self.room.wait(1)
+        self.fetch_q.put((url, callback))
+
+    def hold(self):
+        """
+        Counts work the engine will be handed later (an item waiting for a retry), so join waits for it
+        :mutate pending: counts it (task_done uncounts it)
+        :return: Nothing
+        """
+        with self.pending_lock:
+            self.pending += 1
+            self.finished.clear()
+
+    def task_done(self):
+        """
+        Marks a callback as finished
+        :mutate pending: uncounts the fetch
+        :mutate finished: set once nothing is pending
+        :return: Nothing
+        """
+        with self.pending_lock:
+            self.pending -= 1
+            if not self.pending:
+                self.finished.set()
+
+    def fetch_loop(self):
+        """
+        Fetches pages until stopped, holding a slot for the host while waiting on it
+        :return: Nothing
+        """
+        while True:
+            task = self.fetch_q.get()
+            with self.room:
+                self.room.notify()
+            if task is None:
+                return
+            url, callback = task
+            try:
+                with self.get_host_slot(url):
+                    response = fetch(url)
+            except Exception as e:
+                print "{0}Fetch failed for {1}: {2}{3}".format(FAIL, url, str(e), ENDC)
+                response = FailedResponse(url, e)
+            self.parse_q.put((callback, response))
+
+    def parse_loop(self):
+        """
+        Calls callbacks on fetched pages until stopped
+        :return: Nothing
+        """
+        self.local.engine = True
+        while True:
+            task = self.parse_q.get()
+            if task is None:
+                return
+            callback, response = task
+            start = time()
+            try:
+                callback(response)
+            except Exception as e:
+                print "{0}Callback failed for {1}: {2}{3}".format(FAIL, response.url, str(e), ENDC)
+                metrics.inc('stage_errors_total', {'stage': 'crawl'})
+            finally:
+                metrics.observe('stage_seconds', {'stage': 'crawl'}, time() - start)
+                metrics.inc('stage_items_total', {'stage': 'crawl'})
+                self.task_done()
+
+    def start(self):
+        """
+        Starts the fetch and parse threads
+        :mutate threads: adds every started thread
+        :return: Nothing
+        """
+        loops = [self.fetch_loop] * self.fetchers + [self.parse_loop] * self.parsers
+        for loop in loops:
+            t = Thread(target=loop)
+            t.daemon = True
+            t.start()
+            self.threads.append(t)
+
+    def join(self, timeout):
+        """
+        Waits until every submitted fetch and the fetches its callbacks submitted are done
+        :param timeout: seconds to wait at most (waiting in steps keeps the main thread responsive to Ctrl-C)
+        :return: Boolean True if everything is done
+        """
+        return self.finished.wait(timeout)
+
+    def stop(self):
+        """
+        Stops the fetch and parse threads once they're done with what was queued before, waiting for them to exit
+        :mutate threads: removes every thread
+        :return: Nothing
+        """
+        for i in range(self.fetchers):
+            self.fetch_q.put(None)
+        for i in range(self.parsers):
+            self.parse_q.put(None)
+        for t in self.threads:
+            t.join()
+        self.threads = []
+
+    def qsize(self):
+        """
+        Returns approx. number of fetches waiting and pages waiting to be parsed
+        :return: (int, int)
+        """
+        return self.fetch_q.qsize(), self.parse_q.qsize()
@@ -0,0 +1,64 @@
+""" Keeps the items a stage kept failing on in MongoDB, with their error, until they are replayed """
+from datetime import datetime
+from pymongo.errors import PyMongoError
+from utils.print_colors import FAIL, ENDC
+
+
+class DeadLetters:
+    def __init__(self, collection, stages):
+        # Collection holding one document per item given up on
+        self.collection = collection
+        # {stage name: (function item -> key, function item -> dict, function dict -> item)}, as for the Frontier
+        self.stages = stages
+
+    def get_id(self, stage, item):
+        """
+        Gets the _id an item is kept under
+        :param stage: stage name
+        :param item: Film or Actor
+        :return: string like films:tt0111161
+        """
+        return "{0}:{1}".format(stage, self.stages[stage][0](item))
+
+    def add(self, stage, item, error, trace, attempts):
+        """
+        Keeps an item a stage gave up on (replacing what was kept of it by an earlier crawl)
+        :param stage: stage name
+        :param item: Film or Actor
+        :param error: the last exception raised on it
+        :param trace: formatted traceback of the exception
+        :param attempts: times the stage tried it
+        :mutate collection: saves the item
+        :return: Nothing
+        """
+        doc_id = self.get_id(stage, item)
+        doc = {'_id': doc_id, 'stage': stage, 'item': self.stages[stage][1](item), 'error': repr(error),
+               'traceback': trace, 'attempts': attempts, 'failed_at': datetime.utcnow()}
+        try:
+            self.collection.replace_one({'_id': doc_id}, doc, upsert=True)
+        except PyMongoError as e:
+            print "{0}Failed to keep {1} as a dead letter: {2}{3}".format(FAIL, doc_id, str(e), ENDC)
+
+    def replay(self, frontier):
+        """
+        Moves every item kept to the frontier, so the next crawl resumes them on the stage that gave up on them
+        :param frontier: Frontier of the crawl (loaded, its changes are checkpointed here)
+        :mutate collection: removes the items moved
+        :return: int number of items moved
+        """
+        replayed = []
+        for doc in self.collection.find({}):
+            if doc.get('stage') in self.stages:
+                frontier.add(doc['stage'], self.stages[doc['stage']][2](doc['item']))
+                replayed.append(doc['_id'])
+        # Removed once the frontier has them, a failed checkpoint leaves them here to be replayed again
+        if frontier.checkpoint() and replayed:
+            self.collection.delete_many({'_id': {'$in': replayed}})
+        return len(replayed)
+
+    def count(self):
+        """
+        Returns the number of items kept
+        :return: int
+        """
+        return self.collection.count_documents({})
@@ -1,9 +1,11 @@
 """ Class for a Film """
 import Actor
 import datetime
-import requests
 from bs4 import BeautifulSoup
-from config.GLOBALS import YEAR_TOLERANCE
+from config.GLOBALS import YEAR_TOLERANCE, RELEASE_PAGES
+from imdb_title import extract_title_tags
+from utils.fetch import fetch, fetch_all, count_avoided
+from utils.soup import make_soup, release_soup
 from utils.print_colors import OKGREEN, ENDC, FAIL, WARNING
 
 
@@ -11,6 +13,10 @@ class Film:
 
     # Class wide instance of a dictionary used to point to all Film instances
     all_films = dict()
+    # Class wide FilmStore read instead of all_films during aggregation
+    store = None
+    # Shared Actors (keyed by DIRECTOR) returned when an actor can't be found
+    default_actors = dict()
 
     def __init__(self, mojo_id, mojo_title, mojo_year):
         # If anything critical fails during the scrape process
@@ -25,8 +31,12 @@ class Film:
         self.id = ''
         # HTML of the IMDb page                                             !important
         self.imdb_page = None
+        # Tags the setters read from imdb_page, found in one walk on first use
+        self.title_tags = None
         # HTML of the Box Office Mojo Page                                  !important
         self.mojo_page = None
+        # HTML of the IMDb full credits page (fetched by set_actors if not set)
+        self.credits_page = None
         # The number of stars the film had outta 10
         self.stars = 0.0
         # The metascore outta 100
@@ -169,9 +179,56 @@ class Film:
             "max_director_film_votes": {"value": 0, "important": False}
         }
     
-    def set_imdb_id(self):
+    def get_imdb_search_url(self):
+        """
+        Gets the IMDb search page for the Box Office Mojo title
+        :return: string url
+        """
+        return "http://www.imdb.com/find?ref_=nv_sr_fn&q={0}&s=all".format(self.mojo_title)
+
+    def get_imdb_url(self):
+        """
+        Gets the IMDb page for the film
+        :return: string url
+        """
+        return "http://www.imdb.com/title/{0}/?ref_=fn_al_tt_1".format(self.id)
+
+    def get_mojo_url(self):
+        """
+        Gets the Box Office Mojo page for the film
+        :return: string url
+        """
+        return "http://www.boxofficemojo.com/movies/?id={0}.htm".format(self.mojo_id)
+
+    def get_imdb_credits_url(self):
+        """
+        Gets the IMDb full credits page for the film
+        :return: string url
+        """
+        return 'http://www.imdb.com/title/{0}/fullcredits'.format(self.id)
+
+    def get_page_urls(self):
+        """
+        Gets the pages set_non_aggregate_fields reads
+        :return: {'imdb': url, 'mojo': url, 'credits': url}
+        """
+        return {'imdb': self.get_imdb_url(), 'mojo': self.get_mojo_url(), 'credits': self.get_imdb_credits_url()}
+
+    def set_pages(self, pages):
+        """
+        Sets the pages from fetched responses so set_non_aggregate_fields doesn't fetch them
+        :param pages: {'imdb': response, 'mojo': response, 'credits': response} (or some of them)
+        :mutate imdb_page, mojo_page, credits_page: updates the fields of the pages given
+        :return: Nothing
+        """
+        setters = {'imdb': self.set_imdb_page, 'mojo': self.set_mojo_page, 'credits': self.set_credits_page}
+        for name, page in pages.items():
+            setters[name](page)
+
+    def set_imdb_id(self, results=None):
         """
         Tries to search IMDb and find a matching film
+        :param results: response for the search page (fetched if not given)
         :mutate imdb_id: sets this field in the Film
         :return: String imdb_id
         """
@@ -192,13 +249,13 @@ class Film:
                     return True
             return False
 
-        query = "http://www.imdb.com/find?ref_=nv_sr_fn&q={0}&s=all".format(self.mojo_title)
-        results = requests.get(query)
+        if results is None:
+            results = fetch(self.get_imdb_search_url())
         # If the page cannot be found or IMDb broke
         if results.status_code >= 400:
             self.id = self.handle_error('id')
             return self.id
-        html = BeautifulSoup(results.content, 'html.parser')
+        html = make_soup(results.content)
         sections = html.find_all('div', {'class': 'findSection'})
         for s in sections:
             header = s.find('h3', {'class': 'findSectionHeader'})
@@ -219,52 +276,102 @@ class Film:
         """
         Calls each set function
         :mutate: Every field - see inner functions
+        :mutate imdb_page, mojo_page, credits_page: released once the fields are set if RELEASE_PAGES
         :return: Nothing
         """
-        funcs = [self.set_imdb_page, self.set_mojo_page, self.set_stars, self.set_metascore, self.set_num_votes,
+        # Pages already handed in (by the concurrent crawl) aren't fetched again, the others are fetched at once
+        urls = self.get_page_urls()
+        pages = [('imdb', self.imdb_page), ('mojo', self.mojo_page), ('credits', self.credits_page)]
+        missing = dict((name, urls[name]) for name, page in pages if page is None)
+        if missing:
+            print "{0}Fetching {1} for {2}...{3}".format(OKGREEN, ", ".join(sorted(missing)), self.mojo_title, ENDC)
+            self.set_pages(fetch_all(missing))
+        funcs = [self.set_stars, self.set_metascore, self.set_num_votes,
                  self.set_length, self.set_mpaa, self.set_budget, self.set_release_date, self.set_month, self.set_day,
                  self.set_weekday, self.set_director, self.set_actors, self.set_revenue]
         for f in funcs:
             print "{0}Calling {1} for {2}...{3}".format(OKGREEN, str(f), self.mojo_title, ENDC)
             f()
+        # Only the plain fields are needed past this point
+        if RELEASE_PAGES:
+            self.purge()
 
-    def set_imdb_page(self):
+    def set_imdb_page(self, page=None):
         """
         Sets the self.imdb_page field
+        :param page: response for the IMDb page (fetched if not given)
         :mutate imdb_page: updates this field
         :return: BS'd imdb page
         """
-        page = requests.get("http://www.imdb.com/title/{0}/?ref_=fn_al_tt_1".format(self.id))
+        if page is None:
+            page = fetch(self.get_imdb_url())
         if page.status_code >= 400:
             self.imdb_page = self.handle_error('imdb_page')
         else:
-            self.imdb_page = BeautifulSoup(page.content, "html.parser")
+            self.imdb_page = make_soup(page.content)
+        self.title_tags = None
         return self.imdb_page
 
-    def set_mojo_page(self):
+    def get_imdb_page(self):
+        """
+        Gets the IMDb page, fetching it at most once even if it failed (a failed page is an empty soup)
+        :mutate imdb_page: if the page hasn't been fetched yet
+        :return: BS'd imdb page
+        """
+        if self.imdb_page is None:
+            self.set_imdb_page()
+        elif not self.imdb_page.contents:
+            count_avoided()
+        return self.imdb_page
+
+    def get_title_tag(self, field):
+        """
+        Gets the tag a field is scraped from on the IMDb page
+        :param field: a key of imdb_title.TITLE_TAGS
+        :mutate title_tags: walks imdb_page for every field's tag on first use
+        :return: bs4 Tag or None if the page doesn't have one
+        """
+        if self.title_tags is None:
+            self.title_tags = extract_title_tags(self.imdb_page)
+        return self.title_tags.get(field)
+
+    def set_mojo_page(self, page=None):
         """
         Sets the self.mojo_page field
+        :param page: response for the Box Office Mojo page (fetched if not given)
         :mutate mojo_page: updates this field
         :return: BS'd mojo page
         """
-        page = requests.get("http://www.boxofficemojo.com/movies/?id={0}.htm".format(self.mojo_id))
+        if page is None:
+            page = fetch(self.get_mojo_url())
         if page.status_code >= 400:
             self.mojo_page = self.handle_error('mojo_page')
         else:
             self.mojo_page = BeautifulSoup(page.content, "html.parser")
         return self.mojo_page
 
+    def get_mojo_page(self):
+        """
+        Gets the Box Office Mojo page, fetching it at most once even if it failed (a failed page is an empty soup)
+        :mutate mojo_page: if the page hasn't been fetched yet
+        :return: BS'd mojo page
+        """
+        if self.mojo_page is None:
+            self.set_mojo_page()
+        elif not self.mojo_page.contents:
+            count_avoided()
+        return self.mojo_page
+
     def set_stars(self):
         """
         Scrapes the star rating from the IMDb page
         :mutate stars: updates this field
-        :mutate imdb_page: if the field isn't already filled
+        :mutate imdb_page: if the page hasn't been fetched yet
         :return: float the number of stars outta 10
         """
-        if not self.imdb_page:
-            self.set_imdb_page()
+        self.get_imdb_page()
         try:
-            self.stars = float(self.imdb_page.find('span', {'itemprop': 'ratingValue'}).text.strip())
+            self.stars = float(self.get_title_tag('stars').text.strip())
         except:
             self.stars = self.handle_error('stars')
         return self.stars
@@ -273,13 +380,12 @@ class Film:
         """
         Scrapes the metascore rating from the IMDb page
         :mutate metascore: updates this field
-        :mutate imdb_page: if the field isn't already filled
+        :mutate imdb_page: if the page hasn't been fetched yet
         :return: int a number from 0-100
         """
-        if not self.imdb_page:
-            self.set_imdb_page()
+        self.get_imdb_page()
         try:
-            self.metascore = int(self.imdb_page.find('div', {'class': 'metacriticScore'}).text.strip())
+            self.metascore = int(self.get_title_tag('metascore').text.strip())
         except:
             self.metascore = self.handle_error('metascore')
         return self.metascore
@@ -288,13 +394,12 @@ class Film:
         """
         Scrapes the number of user votes from the IMDb page
         :mutate num_votes: updates this field
-        :mutate imdb_page: if the field isn't already filled
+        :mutate imdb_page: if the page hasn't been fetched yet
         :return: int
         """
-        if not self.imdb_page:
-            self.set_imdb_page()
+        self.get_imdb_page()
         try:
-            self.num_votes = int(self.imdb_page.find('span', {'itemprop': 'ratingCount'}).text.replace(',', '').strip())
+            self.num_votes = int(self.get_title_tag('num_votes').text.replace(',', '').strip())
         except:
             self.num_votes = self.handle_error('num_votes')
         return self.num_votes
@@ -303,13 +408,12 @@ class Film:
         """
         Scrapes the length of the film in minutes from the IMDb page
         :mutate length: updates this field
-        :mutate imdb_page: if the field isn't already filled
+        :mutate imdb_page: if the page hasn't been fetched yet
         :return: int
         """
-        if not self.imdb_page:
-            self.set_imdb_page()
+        self.get_imdb_page()
         try:
-            self.length = int(self.imdb_page.find('time', {'itemprop': 'duration'})['datetime'].replace('PT', '').replace('M', '').strip())
+            self.length = int(self.get_title_tag('length')['datetime'].replace('PT', '').replace('M', '').strip())
         except:
             self.length = self.handle_error('length')
         return self.length
@@ -318,13 +422,12 @@ class Film:
         """
         Scrapes the mpaa rating from the IMDb page
         :mutate mpaa: updates this field
-        :mutate imdb_page: if the field isn't already filled
+        :mutate imdb_page: if the page hasn't been fetched yet
         :return: string
         """
-        if not self.imdb_page:
-            self.set_imdb_page()
+        self.get_imdb_page()
         try:
-            self.mpaa = self.imdb_page.find('meta', {'itemprop': 'contentRating'})['content'].strip()
+            self.mpaa = self.get_title_tag('mpaa')['content'].strip()
         except:
             self.mpaa = self.handle_error('mpaa')
         return self.mpaa
@@ -333,13 +436,12 @@ class Film:
         """
         Scrapes the film approx budget from the IMDb page
         :mutate budget: updates this field
-        :mutate imdb_page: if the field isn't already filled
+        :mutate imdb_page: if the page hasn't been fetched yet
         :return: int
         """
-        if not self.imdb_page:
-            self.set_imdb_page()
+        self.get_imdb_page()
         try:
-            txt_blocks = self.imdb_page.find('div', {'id': 'titleDetails'}).find_all('div', {'class': 'txt-block'})
+            txt_blocks = self.get_title_tag('budget').find_all('div', {'class': 'txt-block'})
             for tb in txt_blocks:
                 h4 = tb.find('h4')
                 if h4 and 'Budget' in h4.text:
@@ -356,13 +458,12 @@ class Film:
         """
         Scrapes the release date from the IMDb page
         :mutate release_date: updates this field
-        :mutate imdb_page: if the field isn't already filled
+        :mutate imdb_page: if the page hasn't been fetched yet
         :return: datetime
         """
-        if not self.imdb_page:
-            self.set_imdb_page()
+        self.get_imdb_page()
         try:
-            self.release_date = datetime.datetime.strptime(self.imdb_page.find('meta', {'itemprop': 'datePublished'})['content'].strip(), "%Y-%m-%d")
+            self.release_date = datetime.datetime.strptime(self.get_title_tag('release_date')['content'].strip(), "%Y-%m-%d")
         except:
             self.release_date = self.handle_error('release_date')
         return self.release_date
@@ -371,12 +472,11 @@ class Film:
         """
         gets the month that the film was released
         :mutate month: updates this field
-        :mutate imdb_page: if the field isn't already filled
+        :mutate imdb_page: if the page hasn't been fetched yet
         :mutate release_date: if the field isn't already filled
         :return: int 0-12
         """
-        if not self.imdb_page:
-            self.set_imdb_page()
+        self.get_imdb_page()
         if not self.release_date:
             self.set_release_date()
         try:
@@ -389,12 +489,11 @@ class Film:
         """
         gets the day of month that the film was released
         :mutate day: updates this field
-        :mutate imdb_page: if the field isn't already filled
+        :mutate imdb_page: if the page hasn't been fetched yet
         :mutate release_date: if the field isn't already filled
         :return: int 0-31
         """
-        if not self.imdb_page:
-            self.set_imdb_page()
+        self.get_imdb_page()
         if not self.release_date:
             self.set_release_date()
         try:
@@ -407,12 +506,11 @@ class Film:
         """
         gets the day of the week that the film was released
         :mutate weekday: updates this field
-        :mutate imdb_page: if the field isn't already filled
+        :mutate imdb_page: if the page hasn't been fetched yet
         :mutate release_date: if the field isn't already filled
         :return: int 0-7
         """
-        if not self.imdb_page:
-            self.set_imdb_page()
+        self.get_imdb_page()
         if not self.release_date:
             self.set_release_date()
         try:
@@ -426,13 +524,12 @@ class Film:
         """
         Scrapes the director id from the IMDb page
         :mutate director: updates this field
-        :mutate imdb_page: if the field isn't already filled
+        :mutate imdb_page: if the page hasn't been fetched yet
         :return: string
         """
-        if not self.imdb_page:
-            self.set_imdb_page()
+        self.get_imdb_page()
         try:
-            director_span = self.imdb_page.find('span', {'itemprop': 'director'})
+            director_span = self.get_title_tag('director')
             if director_span:
                 director_link = director_span.find('a')['href']
                 self.director = director_link.replace('/name/', '').replace('?ref_=tt_ov_dr', '').split('/')[0]
@@ -442,28 +539,41 @@ class Film:
             self.director = self.handle_error('director')
         return self.director
 
-    def get_imdb_credits_page(self):
+    def get_imdb_credits_page(self, credits=None):
         """
         Gets the full actor page from IMDb
+        :param credits: response for the full credits page (fetched if not given)
         :return: BS'd HTML
         """
-        credits = requests.get('http://www.imdb.com/title/{0}/fullcredits'.format(self.id))
+        if credits is None:
+            credits = fetch(self.get_imdb_credits_url())
         if credits.status_code >= 400:
             return BeautifulSoup("", "html.parser")
-        return BeautifulSoup(credits.content, "html.parser")
+        return make_soup(credits.content)
+
+    def set_credits_page(self, credits=None):
+        """
+        Sets the self.credits_page field
+        :param credits: response for the full credits page (fetched if not given)
+        :mutate credits_page: updates this field
+        :return: BS'd full credits page
+        """
+        self.credits_page = self.get_imdb_credits_page(credits)
+        return self.credits_page
 
     def set_actors(self):
         """
         Scrapes the actor id's from the IMDb page
         :mutate actors: updates this field
-        :mutate imdb_page: if the field isn't already filled
+        :mutate imdb_page: if the page hasn't been fetched yet
         :return: [string]
         """
-        if not self.imdb_page:
-            self.set_imdb_page()
+        self.get_imdb_page()
         try:
             actor_ids = []
-            credit_page = self.get_imdb_credits_page()
+            if self.credits_page is None:
+                self.set_credits_page()
+            credit_page = self.credits_page
             actor_rows = credit_page.find_all('td', {'itemprop': 'actor'})
             if actor_rows:
                 for ar in actor_rows:
@@ -481,11 +591,10 @@ class Film:
         """
         Scrapes the film approx revenue from the Box Office Mojo page
         :mutate revenue: updates this field
-        :mutate mojo_page: if the field isn't already filled
+        :mutate mojo_page: if the page hasn't been fetched yet
         :return: int
         """
-        if not self.mojo_page:
-            self.set_mojo_page()
+        self.get_mojo_page()
         try:
             possible_divs = self.mojo_page.find_all('div', {'class':"mp_box_content"})
             # Keep track of Domestic if needed
@@ -682,20 +791,25 @@ class Film:
 
     def purge(self):
         """
-        Removes imdb_page and mojo_page field to free up space
-        :mutate imdb_page: sets to None
-        :mutate mojo_page: sets to None
+        Removes imdb_page, mojo_page and credits_page field to free up space
+        :mutate imdb_page: releases and sets to None
+        :mutate mojo_page: releases and sets to None
+        :mutate credits_page: releases and sets to None
         :return: Nothing
         """
+        for page in [self.imdb_page, self.mojo_page, self.credits_page]:
+            release_soup(page)
         self.imdb_page = None
+        self.title_tags = None
         self.mojo_page = None
+        self.credits_page = None
 
     ## AGGREGATE METHODS
     def get_actor(self, actor_id):
         """
         Gets an Actor instance using an actor_id
         :param actor_id: string id of an actor
-        :return: an Actor
+        :return: an Actor (an ActorRecord when reading from the store)
         """
         if actor_id == self.director:
             retrieve_id = "director-{0}".format(actor_id)
@@ -704,11 +818,13 @@ class Film:
             retrieve_id = actor_id
             director = False
 
-        default = Actor.Actor('NonsenseActorId', director)
+        if Actor.Actor.store:
+            return Actor.Actor.store.get_actor(retrieve_id)
         if Actor.Actor.all_actors.get(retrieve_id, None):
             return Actor.Actor.all_actors[retrieve_id]
-        else:
-            return default
+        if director not in Film.default_actors:
+            Film.default_actors[director] = Actor.Actor('NonsenseActorId', director)
+        return Film.default_actors[director]
 
     def get_actor_stats(self, func):
         """
@@ -0,0 +1,458 @@
+""" Compact, array-backed store of every Film and Actor read during aggregation """
+import datetime
+import numpy as np
+import os
+import pandas as pd
+from Actor import Actor
+from Film import Film
+from FilmTimeline import FilmTimeline
+
+# Film document field for each timeline stat
+STAT_FIELDS = {
+    "revenue": "revenue",
+    "stars": "stars",
+    "metascore": "metascore",
+    "votes": "num_votes"
+}
+# Stats that are floats, every other stat is an int
+FLOAT_STATS = set(['stars'])
+# Only the fields the store reads are pulled from MongoDB (a film's _id tells which document with its id was read)
+FILM_PROJECTION = {'_id': True, 'id': True, 'release_date': True, 'director': True, 'actors': True,
+                   'revenue': True, 'stars': True, 'metascore': True, 'num_votes': True}
+ACTOR_PROJECTION = {'_id': False, 'id': True, 'DIRECTOR': True, 'birthday': True, 'films': True}
+# Array fields written by save and memory-mapped by load
+ARRAY_FIELDS = ['release_days', 'release_years', 'birth_years', 'film_offsets', 'film_rows', 'film_days',
+                'cast_offsets', 'cast_rows', 'director_rows']
+# Fields holding a dict of stat -> array
+STAT_ARRAY_FIELDS = ['stats', 'prefix_sums', 'prefix_counts', 'prefix_maxes']
+DEFAULT_RELEASE_DAY = Film.get_field_defaults()['release_date']['value'].toordinal()
+DEFAULT_BIRTH_YEAR = Actor.get_field_defaults()['birthday']['value'].year
+
+
+def get_stat_dtype(stat):
+    """
+    Gets the numpy dtype for a stat
+    :param stat: key of FilmTimeline.STATS
+    :return: numpy dtype
+    """
+    return np.float64 if stat in FLOAT_STATS else np.int64
+
+
+def with_sentinel(values, sentinel=0):
+    """
+    Appends a value so that indexing with -1 (not found) returns it
+    :param values: array
+    :param sentinel: value for -1
+    :return: array one longer
+    """
+    values = np.asarray(values)
+    return np.append(values, np.array([sentinel], dtype=values.dtype))
+
+
+class FilmStore:
+    """
+    Films and actors held as typed columns instead of Film/Actor objects.
+    Films are rows indexed by id. Casts and filmographies are CSR arrays: the entries for row i are
+    [offsets[i], offsets[i + 1]). Filmographies are sorted oldest to newest and every actor has prefix
+    arrays over them laid out with one extra slot per actor, so the films before position p of actor a
+    are summarized at prefix[offsets[a] + a + p].
+    """
+
+    def __init__(self, film_docs, actor_docs):
+        ## FILMS
+        # Film id -> row (the last document with an id wins, like all_films)
+        self.film_index = dict()
+        self.film_ids = []
+        # MongoDB _id of the document each row was read from (not saved, a loaded store has None)
+        self.film_documents = []
+        days = []
+        stats = dict((stat, []) for stat in FilmTimeline.STATS)
+        directors = []
+        casts = []
+        for doc in film_docs:
+            f_id = doc.get('id', '')
+            if f_id not in self.film_index:
+                self.film_index[f_id] = len(self.film_ids)
+                self.film_ids.append(f_id)
+                for column in [self.film_documents, days, directors, casts] + stats.values():
+                    column.append(None)
+            row = self.film_index[f_id]
+            self.film_documents[row] = doc.get('_id')
+            # Missing values are read the same way the Film getters default them
+            days[row] = (doc.get('release_date') or datetime.datetime.fromordinal(DEFAULT_RELEASE_DAY)).toordinal()
+            for stat, field in STAT_FIELDS.items():
+                stats[stat][row] = doc.get(field) or 0
+            directors[row] = doc.get('director', '')
+            casts[row] = doc.get('actors') or []
+        # Release date as days since 0001-01-01 (-1 reads the default date)
+        self.release_days = with_sentinel(np.array(days, dtype=np.int32), DEFAULT_RELEASE_DAY)
+        self.release_years = with_sentinel(np.array([datetime.date.fromordinal(d).year for d in days], dtype=np.int16),
+                                           datetime.date.fromordinal(DEFAULT_RELEASE_DAY).year)
+        self.stats = dict((stat, with_sentinel(np.array(stats[stat], dtype=get_stat_dtype(stat))))
+                          for stat in FilmTimeline.STATS)
+
+        ## ACTORS
+        # Actor key (director-{id} for directors) -> row (the last document with a key wins, like all_actors)
+        self.actor_index = dict()
+        self.actor_keys = []
+        birth_years = []
+        filmographies = []
+        for doc in actor_docs:
+            key = doc.get('id', '')
+            if doc.get('DIRECTOR', False):
+                key = "director-{0}".format(key)
+            birth_year = (doc.get('birthday') or datetime.datetime(DEFAULT_BIRTH_YEAR, 1, 1)).year
+            film_rows = [self.film_index.get(f_id, -1) for f_id in doc.get('films') or []]
+            if key in self.actor_index:
+                birth_years[self.actor_index[key]] = birth_year
+                filmographies[self.actor_index[key]] = film_rows
+                continue
+            self.actor_index[key] = len(self.actor_keys)
+            self.actor_keys.append(key)
+            birth_years.append(birth_year)
+            filmographies.append(film_rows)
+        self.birth_years = with_sentinel(np.array(birth_years, dtype=np.int16), DEFAULT_BIRTH_YEAR)
+        self.build_filmographies(filmographies)
+
+        ## CASTS
+        # Actor row of every cast member, resolved the way Film.get_actor does (-1 if not scraped)
+        self.cast_offsets = np.zeros(len(casts) + 1, dtype=np.int64)
+        self.cast_offsets[1:] = np.cumsum([len(c) for c in casts])
+        self.cast_rows = np.array([self.get_actor_row("director-{0}".format(a) if a == director else a)
+                                   for cast, director in zip(casts, directors) for a in cast], dtype=np.int32)
+        self.director_rows = np.array([self.get_actor_row("director-{0}".format(d)) for d in directors],
+                                      dtype=np.int32)
+        self.reset_records()
+
+    @staticmethod
+    def load(directory, mmap_mode='r'):
+        """
+        Loads a store written by save, memory-mapping the arrays so processes share one copy
+        :param directory: directory the store was saved to
+        :param mmap_mode: numpy mmap mode
+        :return: FilmStore
+        """
+        store = FilmStore([], [])
+        for field in ARRAY_FIELDS:
+            setattr(store, field, np.load(os.path.join(directory, field + '.npy'), mmap_mode=mmap_mode))
+        for field in STAT_ARRAY_FIELDS:
+            setattr(store, field, dict((stat, np.load(os.path.join(directory, "{0}-{1}.npy".format(field, stat)),
+                                                      mmap_mode=mmap_mode)) for stat in FilmTimeline.STATS))
+        store.film_ids = np.load(os.path.join(directory, 'film_ids.npy')).tolist()
+        store.actor_keys = np.load(os.path.join(directory, 'actor_keys.npy')).tolist()
+        store.film_index = dict((f_id, row) for row, f_id in enumerate(store.film_ids))
+        store.film_documents = None
+        store.actor_index = dict((key, row) for row, key in enumerate(store.actor_keys))
+        store.reset_records()
+        return store
+
+    def save(self, directory):
+        """
+        Writes every array to a directory of .npy files that load can memory-map
+        :param directory: existing directory to write to
+        :return: Nothing
+        """
+        for field in ARRAY_FIELDS:
+            np.save(os.path.join(directory, field + '.npy'), getattr(self, field))
+        for field in STAT_ARRAY_FIELDS:
+            for stat, values in getattr(self, field).items():
+                np.save(os.path.join(directory, "{0}-{1}.npy".format(field, stat)), values)
+        # Ids are written as fixed width strings so no pickling is needed
+        np.save(os.path.join(directory, 'film_ids.npy'), np.array(self.film_ids or [''])[:len(self.film_ids)])
+        np.save(os.path.join(directory, 'actor_keys.npy'), np.array(self.actor_keys or [''])[:len(self.actor_keys)])
+
+    def reset_records(self):
+        """
+        Drops every record handed out by get_film and get_actor
+        :mutate film_records, actor_records: lazily created records, one slot per row plus one for not found
+        :return: Nothing
+        """
+        self.film_records = [None] * (len(self.film_ids) + 1)
+        self.actor_records = [None] * (len(self.actor_keys) + 1)
+
+    def build_filmographies(self, filmographies):
+        """
+        Builds the sorted filmography CSR arrays and their prefix arrays
+        :param filmographies: list of film row lists per actor
+        :mutate film_offsets, film_rows, film_days, prefix_*: sets these fields
+        :return: Nothing
+        """
+        num_actors = len(filmographies)
+        lengths = np.array([len(fs) for fs in filmographies], dtype=np.int64)
+        self.film_offsets = np.zeros(num_actors + 1, dtype=np.int64)
+        self.film_offsets[1:] = np.cumsum(lengths)
+        actors = np.repeat(np.arange(num_actors, dtype=np.int64), lengths)
+        rows = np.array([r for fs in filmographies for r in fs], dtype=np.int32)
+        days = self.release_days[rows]
+        # lexsort is stable, so films released on the same day keep their order like Actor.sort_films
+        order = np.lexsort((days, actors))
+        self.film_rows = rows[order]
+        self.film_days = days[order]
+
+        # Extended layout: a leading empty slot per actor followed by its films
+        slots = np.arange(num_actors, dtype=np.int64) + self.film_offsets[:-1]
+        film_slots = np.arange(len(self.film_rows), dtype=np.int64) + actors + 1
+        groups = np.repeat(np.arange(num_actors, dtype=np.int64), lengths + 1)
+        self.prefix_sums = dict()
+        self.prefix_counts = dict()
+        self.prefix_maxes = dict()
+        for stat in FilmTimeline.STATS:
+            dtype = get_stat_dtype(stat)
+            values = np.zeros(len(groups), dtype=dtype)
+            # Films that weren't scraped read as 0 and values of 0 are ignored
+            values[film_slots] = self.stats[stat][self.film_rows]
+            counts = np.cumsum(values != 0, dtype=np.int32)
+            self.prefix_counts[stat] = counts - np.repeat(counts[slots], lengths + 1)
+            if stat in FLOAT_STATS:
+                # Sum float filmographies one at a time so values are added in the same order as the object path
+                sums = np.zeros(len(groups), dtype=dtype)
+                for a in range(num_actors):
+                    start = slots[a]
+                    stop = start + lengths[a] + 1
+                    sums[start:stop] = np.cumsum(values[start:stop])
+            else:
+                sums = np.cumsum(values)
+                sums -= np.repeat(sums[slots], lengths + 1)
+            self.prefix_sums[stat] = sums
+            # The leading slot is 0 and negative values never count towards a max
+            self.prefix_maxes[stat] = pd.Series(np.maximum(values, 0)).groupby(groups).cummax().values.astype(dtype)
+
+    def get_film_row(self, film_id):
+        """
+        Gets the row of a film
+        :param film_id: string id of a film
+        :return: row, -1 if the film isn't in the store
+        """
+        return self.film_index.get(film_id, -1)
+
+    def get_actor_row(self, key):
+        """
+        Gets the row of an actor
+        :param key: actor id (director-{id} for directors)
+        :return: row, -1 if the actor isn't in the store
+        """
+        return self.actor_index.get(key, -1)
+
+    def get_film(self, film_id):
+        """
+        Gets a record with the Film getters used during aggregation
+        :param film_id: string id of a film
+        :mutate film_records: creates the record on first use
+        :return: FilmRecord (a default one if the film isn't in the store)
+        """
+        row = self.get_film_row(film_id)
+        if not self.film_records[row]:
+            self.film_records[row] = FilmRecord(self, row)
+        return self.film_records[row]
+
+    def get_actor(self, key):
+        """
+        Gets a record with the Actor getters used during aggregation
+        :param key: actor id (director-{id} for directors)
+        :mutate actor_records: creates the record on first use
+        :return: ActorRecord (a default one if the actor isn't in the store)
+        """
+        row = self.get_actor_row(key)
+        if not self.actor_records[row]:
+            self.actor_records[row] = ActorRecord(self, row)
+        return self.actor_records[row]
+
+    def get_filmography_range(self, actor_row):
+        """
+        Gets the CSR range of an actor's films
+        :param actor_row: row of an actor (-1 for a default actor with no films)
+        :return: start, stop
+        """
+        if actor_row < 0:
+            return 0, 0
+        return self.film_offsets[actor_row], self.film_offsets[actor_row + 1]
+
+    def get_position(self, actor_row, film_row):
+        """
+        Gets the number of films in an actor's filmography before the first appearance of a film
+        :param actor_row: row of an actor
+        :param film_row: row of a film
+        :return: position, None if the film isn't in the filmography
+        """
+        start, stop = self.get_filmography_range(actor_row)
+        if film_row < 0 or start == stop:
+            return None
+        day = self.release_days[film_row]
+        i = start + np.searchsorted(self.film_days[start:stop], day, 'left')
+        # Films released the same day keep their filmography order
+        while i < stop and self.film_days[i] == day:
+            if self.film_rows[i] == film_row:
+                return i - start
+            i += 1
+        return None
+
+
+class FilmRecord(object):
+    """ Read-only view of one Film row """
+    __slots__ = ['store', 'row']
+
+    def __init__(self, store, row):
+        self.store = store
+        self.row = row
+
+    def get_release_date(self):
+        """
+        Gets the release date
+        :return: datetime
+        """
+        return datetime.datetime.fromordinal(int(self.store.release_days[self.row]))
+
+    def get_revenue(self):
+        """
+        Gets the revenue
+        :return: int
+        """
+        return self.store.stats['revenue'][self.row].item()
+
+    def get_stars(self):
+        """
+        Gets the stars
+        :return: float
+        """
+        return self.store.stats['stars'][self.row].item()
+
+    def get_metascore(self):
+        """
+        Gets the metascore
+        :return: int
+        """
+        return self.store.stats['metascore'][self.row].item()
+
+    def get_num_votes(self):
+        """
+        Gets the num_votes
+        :return: int
+        """
+        return self.store.stats['votes'][self.row].item()
+
+
+class ActorRecord(object):
+    """ Read-only view of one Actor row with the aggregate getters of Actor """
+    __slots__ = ['store', 'row']
+
+    def __init__(self, store, row):
+        self.store = store
+        self.row = row
+
+    def get_prefix_index(self, f_id):
+        """
+        Gets the prefix array index that covers the films before a film
+        :param f_id: the id for the film to stop at
+        :return: int
+        """
+        start, stop = self.store.get_filmography_range(self.row)
+        position = self.store.get_position(self.row, self.store.get_film_row(f_id))
+        # If the film isn't in the filmography every film is included
+        if position is None:
+            position = stop - start
+        return start + max(0, self.row) + position
+
+    def get_film_average_before(self, stat, f_id):
+        """
+        Gets the average of a stat for the films up to a certain film
+        :param stat: key of FilmTimeline.STATS
+        :param f_id: film id to stop at
+        :return: average value (int)
+        """
+        if self.row < 0:
+            return 0
+        i = self.get_prefix_index(f_id)
+        # If length is 0, divide by 1
+        return self.store.prefix_sums[stat][i].item() / max(1, self.store.prefix_counts[stat][i].item())
+
+    def get_film_max_before(self, stat, f_id):
+        """
+        Gets the max of a stat for the films up to a certain film
+        :param stat: key of FilmTimeline.STATS
+        :param f_id: film id to stop at
+        :return: max value (int)
+        """
+        if self.row < 0:
+            return 0
+        return self.store.prefix_maxes[stat][self.get_prefix_index(f_id)].item()
+
+    def get_age_during(self, f_id):
+        """
+        Gets the approx. age of the actor during a film
+        :param f_id: the id for the film
+        :return: pos int
+        """
+        film_year = self.store.release_years[self.store.get_film_row(f_id)]
+        return max(0, int(film_year) - int(self.store.birth_years[self.row]))
+
+    def get_num_appearances_before(self, f_id):
+        """
+        How many films an actor has been in before
+        :param f_id: the id for the film
+        :return: the number of appearances before a movie
+        """
+        return self.store.get_position(self.row, self.store.get_film_row(f_id)) or 0
+
+    def get_avg_film_revenue_before(self, f_id):
+        """
+        Gets the average revenue before a film
+        :param f_id: the id for the film to stop at
+        :return: int
+        """
+        return self.get_film_average_before("revenue", f_id)
+
+    def get_max_film_revenue_before(self, f_id):
+        """
+        Gets the max revenue before a film
+        :param f_id: the id for the film to stop at
+        :return: int
+        """
+        return self.get_film_max_before("revenue", f_id)
+
+    def get_avg_film_stars_before(self, f_id):
+        """
+        Gets the average stars before a film
+        :param f_id: the id for the film to stop at
+        :return: int
+        """
+        return self.get_film_average_before("stars", f_id)
+
+    def get_max_film_stars_before(self, f_id):
+        """
+        Gets the max stars before a film
+        :param f_id: the id for the film to stop at
+        :return: int
+        """
+        return self.get_film_max_before("stars", f_id)
+
+    def get_avg_film_metascore_before(self, f_id):
+        """
+        Gets the average metascore before a film
+        :param f_id: the id for the film to stop at
+        :return: int
+        """
+        return self.get_film_average_before("metascore", f_id)
+
+    def get_max_film_metascore_before(self, f_id):
+        """
+        Gets the max metascore before a film
+        :param f_id: the id for the film to stop at
+        :return: int
+        """
+        return self.get_film_max_before("metascore", f_id)
+
+    def get_avg_film_votes_before(self, f_id):
+        """
+        Gets the average votes before a film
+        :param f_id: the id for the film to stop at
+        :return: int
+        """
+        return self.get_film_average_before("votes", f_id)
+
+    def get_max_film_votes_before(self, f_id):
+        """
+        Gets the max votes before a film
+        :param f_id: the id for the film to stop at
+        :return: int
+        """
+        return self.get_film_max_before("votes", f_id)
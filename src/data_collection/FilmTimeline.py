@@ -0,0 +1,131 @@
+""" Chronologically sorted filmography backed by prefix sums so "before" stats are lookups instead of scans """
+from bisect import bisect_left
+
+
+class FilmTimeline:
+    # Stats that are indexed mapped to the Film getter that reads them
+    STATS = {
+        "revenue": "get_revenue",
+        "stars": "get_stars",
+        "metascore": "get_metascore",
+        "votes": "get_num_votes"
+    }
+
+    def __init__(self, film_ids, get_film):
+        # Film ids sorted from oldest to newest
+        self.film_ids = film_ids
+        # Film id -> position of its first appearance in film_ids
+        self.positions = dict()
+        # Release date of each film, used for lookups by date
+        self.dates = []
+        # Prefix arrays per stat: index i covers the films before position i
+        self.sums = dict((stat, [0]) for stat in self.STATS)
+        self.counts = dict((stat, [0]) for stat in self.STATS)
+        self.maxes = dict((stat, [0]) for stat in self.STATS)
+        for pos, f_id in enumerate(film_ids):
+            film = get_film(f_id)
+            if f_id not in self.positions:
+                self.positions[f_id] = pos
+            self.dates.append(film.get_release_date())
+            for stat, getter in self.STATS.items():
+                self.add_value(stat, getattr(film, getter)())
+
+    def add_value(self, stat, val):
+        """
+        Extends the prefix arrays of a stat by one film
+        :param stat: key of STATS
+        :param val: the film's value for the stat
+        :mutate sums, counts, maxes: appends a position
+        :return: Nothing
+        """
+        sum_stat = self.sums[stat][-1]
+        length = self.counts[stat][-1]
+        max_stat = self.maxes[stat][-1]
+        # If value isn't available, ignore the film
+        if val:
+            sum_stat += val
+            length += 1
+            if val > max_stat:
+                max_stat = val
+        self.sums[stat].append(sum_stat)
+        self.counts[stat].append(length)
+        self.maxes[stat].append(max_stat)
+
+    def position_of(self, f_id):
+        """
+        Gets the number of films before a film
+        :param f_id: film id to stop at
+        :return: position, or the length of the timeline if the film isn't in it
+        """
+        return self.positions.get(f_id, len(self.film_ids))
+
+    def appearances_before(self, f_id):
+        """
+        Gets the number of appearances before a film
+        :param f_id: film id to stop at
+        :return: position, or 0 if the film isn't in the timeline
+        """
+        return self.positions.get(f_id, 0)
+
+    def position_before_date(self, date):
+        """
+        Gets the number of films released before a date
+        :param date: datetime to stop at
+        :return: position
+        """
+        return bisect_left(self.dates, date)
+
+    def average_at(self, stat, position):
+        """
+        Gets the average of a stat for the films before a position
+        :param stat: key of STATS
+        :param position: number of films to include
+        :return: average value (int)
+        """
+        # If length is 0, divide by 1
+        return self.sums[stat][position] / max(1, self.counts[stat][position])
+
+    def max_at(self, stat, position):
+        """
+        Gets the max of a stat for the films before a position
+        :param stat: key of STATS
+        :param position: number of films to include
+        :return: max value (int)
+        """
+        return self.maxes[stat][position]
+
+    def average_before(self, stat, f_id):
+        """
+        Gets the average of a stat for the films up to a certain film
+        :param stat: key of STATS
+        :param f_id: film id to stop at
+        :return: average value (int)
+        """
+        return self.average_at(stat, self.position_of(f_id))
+
+    def max_before(self, stat, f_id):
+        """
+        Gets the max of a stat for the films up to a certain film
+        :param stat: key of STATS
+        :param f_id: film id to stop at
+        :return: max value (int)
+        """
+        return self.max_at(stat, self.position_of(f_id))
+
+    def average_before_date(self, stat, date):
+        """
+        Gets the average of a stat for the films released before a date
+        :param stat: key of STATS
+        :param date: datetime to stop at
+        :return: average value (int)
+        """
+        return self.average_at(stat, self.position_before_date(date))
+
+    def max_before_date(self, stat, date):
+        """
+        Gets the max of a stat for the films released before a date
+        :param stat: key of STATS
+        :param date: datetime to stop at
+        :return: max value (int)
+        """
+        return self.max_at(stat, self.position_before_date(date))
@@ -3,6 +3,7 @@ from QueueConsumer import QueueConsumer
 
 
 class FindIMDbConsumer(QueueConsumer):
+    stage = 'find'
 
     def consume(self):
         """
@@ -11,8 +12,7 @@ class FindIMDbConsumer(QueueConsumer):
         :param output_q: queue of output items
         :return: Nothing
         """
-        film_todo = self.input_q.get()
-        self.input_q.task_done()
+        film_todo = self.get_input()
         # Sets imdb_id and returns the result ('' if not found)
         if film_todo.set_imdb_id():
             self.output_q.put(film_todo, film_todo.id)
@@ -0,0 +1,184 @@
+""" Keeps the crawl's pending items and Box Office Mojo position in MongoDB so a restarted crawl picks up there """
+from pymongo import ReplaceOne, DeleteOne
+from pymongo.errors import PyMongoError
+from threading import Thread, Lock, Event
+from config.GLOBALS import FRONTIER_CHECKPOINT_INTERVAL
+from utils.print_colors import FAIL, ENDC
+
+# _id of the document holding the next Box Office Mojo page of each letter
+POSITION_ID = 'position'
+
+
+class Frontier:
+    def __init__(self, collection, stages, flushes=(), interval=FRONTIER_CHECKPOINT_INTERVAL):
+        # Collection holding one document per pending item and the position document
+        self.collection = collection
+        # {stage name: (function item -> key, function item -> dict, function dict -> item)}
+        self.stages = stages
+        # Functions writing what the save stages buffered, called before items they finished are forgotten
+        self.flushes = flushes
+        self.interval = interval
+        # Changes since the last checkpoint: _id -> document to write, _ids to delete, letters whose page moved
+        self.added = dict()
+        self.removed = set()
+        self.position = dict()
+        self.position_changed = False
+        self.lock = Lock()
+        # Set to stop the checkpoint thread
+        self.stopping = Event()
+        self.thread = None
+
+    def get_id(self, stage, item):
+        """
+        Gets the _id an item is kept under
+        :param stage: stage name
+        :param item: Film or Actor
+        :return: string like films:tt0111161
+        """
+        return "{0}:{1}".format(stage, self.stages[stage][0](item))
+
+    def add(self, stage, item):
+        """
+        Records an item waiting on (or being worked by) a stage
+        :param stage: stage name
+        :param item: Film or Actor
+        :mutate added: adds the item's document
+        :return: Nothing
+        """
+        doc_id = self.get_id(stage, item)
+        doc = {'_id': doc_id, 'stage': stage, 'item': self.stages[stage][1](item)}
+        with self.lock:
+            self.removed.discard(doc_id)
+            self.added[doc_id] = doc
+
+    def remove(self, stage, item):
+        """
+        Forgets an item a stage is done with (whatever it made is recorded by the next stage first)
+        :param stage: stage name
+        :param item: Film or Actor
+        :mutate added: removes the item's document
+        :mutate removed: adds the item's _id
+        :return: Nothing
+        """
+        doc_id = self.get_id(stage, item)
+        with self.lock:
+            self.added.pop(doc_id, None)
+            self.removed.add(doc_id)
+
+    def set_position(self, letter, page):
+        """
+        Records the next Box Office Mojo page of a letter
+        :param letter: page letter
+        :param page: next page number (0 once the letter is done)
+        :mutate position: sets the letter's page
+        :return: Nothing
+        """
+        with self.lock:
+            self.position[letter] = page
+            self.position_changed = True
+
+    def load(self):
+        """
+        Reads the frontier left by an unfinished crawl
+        :mutate position: set to the saved one
+        :return: ({stage name: [item]}, {letter: next page}) (empty if the last crawl finished)
+        """
+        items = dict((stage, []) for stage in self.stages)
+        for doc in self.collection.find({}):
+            if doc['_id'] == POSITION_ID:
+                with self.lock:
+                    self.position = dict(doc['letters'])
+            elif doc.get('stage') in self.stages:
+                items[doc['stage']].append(self.stages[doc['stage']][2](doc['item']))
+        return items, dict(self.position)
+
+    def checkpoint(self):
+        """
+        Writes the changes since the last checkpoint in one bulk write
+        :mutate added: empties it
+        :mutate removed: empties it
+        :return: Boolean True if the changes were written
+        """
+        with self.lock:
+            added, self.added = self.added, dict()
+            removed, self.removed = self.removed, set()
+            position = dict(self.position) if self.position_changed else None
+            self.position_changed = False
+        # Flushed after the snapshot so every item it forgets had its save buffered before the flush (an item saved
+        # since is in the next checkpoint), nothing is forgotten while a save isn't written
+        if not all([flush() for flush in self.flushes]):
+            print "{0}Saves couldn't be written, the crawl frontier isn't checkpointed{1}".format(FAIL, ENDC)
+            self.restore(added, removed, position)
+            return False
+        requests = [ReplaceOne({'_id': doc_id}, doc, upsert=True) for doc_id, doc in added.items()]
+        requests.extend(DeleteOne({'_id': doc_id}) for doc_id in removed)
+        if position is not None:
+            requests.append(ReplaceOne({'_id': POSITION_ID}, {'_id': POSITION_ID, 'letters': position}, upsert=True))
+        if not requests:
+            return True
+        try:
+            self.collection.bulk_write(requests, ordered=False)
+            return True
+        except PyMongoError as e:
+            print "{0}Failed to checkpoint the crawl frontier: {1}{2}".format(FAIL, str(e), ENDC)
+            self.restore(added, removed, position)
+            return False
+
+    def restore(self, added, removed, position):
+        """
+        Puts back changes a checkpoint couldn't write, to be tried again next checkpoint unless changed since
+        :param added: {_id: document} taken by the checkpoint
+        :param removed: set of _ids taken by the checkpoint
+        :param position: position taken by the checkpoint (None if it hadn't changed)
+        :mutate added: adds the documents not removed since
+        :mutate removed: adds the _ids not added since
+        :return: Nothing
+        """
+        with self.lock:
+            for doc_id, doc in added.items():
+                if doc_id not in self.removed:
+                    self.added.setdefault(doc_id, doc)
+            self.removed.update(doc_id for doc_id in removed if doc_id not in self.added)
+            self.position_changed = self.position_changed or position is not None
+
+    def checkpoint_loop(self):
+        """
+        Checkpoints every interval seconds until stopped
+        :return: Nothing
+        """
+        while not self.stopping.wait(self.interval):
+            self.checkpoint()
+
+    def start(self):
+        """
+        Starts the thread checkpointing every interval
+        :mutate thread: starts and adds a thread
+        :return: Nothing
+        """
+        self.thread = Thread(target=self.checkpoint_loop)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stops the checkpoint thread
+        :mutate stopping: set
+        :return: Nothing
+        """
+        self.stopping.set()
+        if self.thread:
+            self.thread.join()
+
+    def clear(self):
+        """
+        Forgets the whole frontier once a crawl finished, so the next one starts from the first page
+        :mutate collection: drops it
+        :return: Nothing
+        """
+        self.stop()
+        with self.lock:
+            self.added = dict()
+            self.removed = set()
+            self.position = dict()
+            self.position_changed = False
+        self.collection.drop()
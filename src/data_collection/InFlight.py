@@ -0,0 +1,43 @@
+""" Counts the items in flight across a pipeline of SetQueues so the end of the whole pipeline can be waited on """
+from threading import Lock, Event
+
+
+class InFlight:
+    def __init__(self):
+        # Items put on a tracked SetQueue and not marked done by the consumer that took them
+        self.count = 0
+        self.lock = Lock()
+        # Set while nothing is in flight
+        self.drained = Event()
+        self.drained.set()
+
+    def add(self):
+        """
+        Counts an item put on a tracked queue (before it is put, so it can't be done before it is counted)
+        :mutate count: adds one
+        :mutate drained: cleared
+        :return: Nothing
+        """
+        with self.lock:
+            self.count += 1
+            self.drained.clear()
+
+    def done(self):
+        """
+        Uncounts an item once its consumer has finished it, including putting whatever it made downstream
+        :mutate count: subtracts one
+        :mutate drained: set once nothing is in flight
+        :return: Nothing
+        """
+        with self.lock:
+            self.count -= 1
+            if not self.count:
+                self.drained.set()
+
+    def join(self, timeout):
+        """
+        Waits until nothing is in flight
+        :param timeout: seconds to wait at most (waiting in steps keeps the main thread responsive to Ctrl-C)
+        :return: Boolean True if nothing is in flight
+        """
+        return self.drained.wait(timeout)
@@ -0,0 +1,81 @@
+""" Where the save stages hand the Films and Actors they are done with - nothing of them is kept in memory """
+import os
+from bson import json_util
+from threading import Lock
+from config.GLOBALS import OUTPUT_SINK, OUTPUT_LOG_DIR
+
+
+class OutputSink:
+    """ Drops saved items (they are in MongoDB already), only counting them """
+
+    def __init__(self):
+        # Items handed in
+        self.count = 0
+        self.lock = Lock()
+
+    def put(self, item, id_check=''):
+        """
+        Takes a saved item (same call as SetQueue.put so a sink can stand in for an output queue)
+        :param item: Film or Actor
+        :param id_check: unused
+        :mutate count: adds one
+        :return: Nothing
+        """
+        with self.lock:
+            self.count += 1
+
+    def close(self):
+        """
+        Finishes with the items handed in
+        :return: Nothing
+        """
+        pass
+
+
+class LogSink(OutputSink):
+    """ Appends each saved item's fields to a JSON lines file, one compact line per item """
+
+    def __init__(self, path):
+        OutputSink.__init__(self)
+        folder = os.path.dirname(path)
+        if folder and not os.path.isdir(folder):
+            os.makedirs(folder)
+        # Appended to, so a resumed crawl adds to the log of the one it resumes
+        self.path = path
+        self.file = open(path, 'a')
+
+    def put(self, item, id_check=''):
+        """
+        Writes a saved item's fields as a line of the log (bson.json_util keeps the dates readable back)
+        :param item: Film or Actor
+        :param id_check: unused
+        :mutate file: adds a line
+        :mutate count: adds one
+        :return: Nothing
+        """
+        line = json_util.dumps(item.export(), separators=(',', ':')) + '\n'
+        with self.lock:
+            self.file.write(line)
+            self.count += 1
+
+    def close(self):
+        """
+        Closes the log
+        :mutate file: closed
+        :return: Nothing
+        """
+        with self.lock:
+            self.file.close()
+
+
+def make_output_sink(name, kind=OUTPUT_SINK):
+    """
+    Makes a sink of the configured kind
+    :param name: what the sink takes ('films' or 'actors'), names its log
+    :param kind: 'discard', 'log' (OUTPUT_LOG_DIR/name.jsonl) or 'aggregate' (dropped, collect_data aggregates
+    MongoDB once the crawl is over)
+    :return: OutputSink or LogSink
+    """
+    if kind == 'log':
+        return LogSink(os.path.join(OUTPUT_LOG_DIR, "{0}.jsonl".format(name)))
+    return OutputSink()
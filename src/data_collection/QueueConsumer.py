@@ -1,15 +1,29 @@
 """ Abstract class to handle taking an item, doing something, and adding it to an output Queue """
+import sys
 from abc import ABCMeta, abstractmethod
+from Queue import Empty
 from threading import Thread
+from time import time
+from traceback import format_exc
+from config.GLOBALS import CONSUMER_IDLE_TIMEOUT
+from utils import metrics
 
 
 class QueueConsumer:
     __metaclass__ = ABCMeta
+    # Stage name the consumer's metrics are labelled with
+    stage = 'consumer'
 
     def __init__(self, ins, outs):
         self.input_q = ins
         self.output_q = outs
         self.thread = None
+        # Set to False to have the thread exit once it is done with its current item
+        self.running = True
+        # True between taking an item and marking it done, the item and when it was taken
+        self.holding = False
+        self.item = None
+        self.taken = 0
 
     def start(self):
         """
@@ -21,16 +35,67 @@ class QueueConsumer:
         self.thread.daemon = True
         self.thread.start()
 
+    def stop(self):
+        """
+        Asks the thread to exit once it is done with its current item (or has waited CONSUMER_IDLE_TIMEOUT for one)
+        :mutate running: sets to False
+        :return: Nothing
+        """
+        self.running = False
+
+    def join(self, timeout=None):
+        """
+        Waits for a stopped thread to exit
+        :param timeout: seconds to wait at most (None to wait as long as it takes)
+        :return: Nothing
+        """
+        if self.thread:
+            self.thread.join(timeout)
+
+    def get_input(self):
+        """
+        Takes an item from the input queue, waiting CONSUMER_IDLE_TIMEOUT at most so a stopped thread can exit
+        (consume_loop marks it done once consume returns)
+        :mutate input_q: takes an item
+        :mutate holding: sets to True
+        :mutate item: sets to the item
+        :mutate taken: sets to now
+        :exception Empty: if no item came in time
+        :return: an item
+        """
+        self.item = self.input_q.get(timeout=CONSUMER_IDLE_TIMEOUT)
+        self.holding = True
+        self.taken = time()
+        return self.item
+
     def consume_loop(self):
         """
-        While True to keep consuming items
+        Keeps consuming items until stopped, marking each done only after its outputs have been put (or failed if
+        consume raised, so the input queue can retry it)
         :return: Nothing
         """
-        while True:
+        while self.running:
+            failure = None
             try:
                 self.consume()
+            except Empty:
+                pass
             except:
-                print "SOMETHING ABSOLUTELY  HORRID HAPPENED BUT I'M GONNA KEEP ON TRUCKING!!!!"
+                if self.holding:
+                    failure = (sys.exc_info()[1], format_exc())
+                    metrics.inc('stage_errors_total', {'stage': self.stage})
+                else:
+                    print "SOMETHING ABSOLUTELY  HORRID HAPPENED BUT I'M GONNA KEEP ON TRUCKING!!!!"
+            finally:
+                if self.holding:
+                    self.holding = False
+                    metrics.observe('stage_seconds', {'stage': self.stage}, time() - self.taken)
+                    metrics.inc('stage_items_total', {'stage': self.stage})
+                    if failure:
+                        self.input_q.task_failed(self.item, *failure)
+                    else:
+                        self.input_q.task_done(self.item)
+                    self.item = None
 
     @abstractmethod
     def consume(self):
@@ -0,0 +1,137 @@
+""" Puts items a stage failed on back on its queue after a growing delay, and dead-letters those that keep failing """
+import heapq
+from itertools import count
+from threading import Thread, Condition
+from time import time
+from config.GLOBALS import RETRY_MAX_ATTEMPTS, RETRY_DELAY, RETRY_MAX_DELAY
+from utils import metrics
+from utils.print_colors import FAIL, WARNING, ENDC
+
+
+class RetryQueue:
+    def __init__(self, dead_letters=None, max_attempts=RETRY_MAX_ATTEMPTS, delay=RETRY_DELAY,
+                 max_delay=RETRY_MAX_DELAY):
+        # DeadLetters keeping the items that failed max_attempts times (None to drop them)
+        self.dead_letters = dead_letters
+        # Tries an item gets, seconds before the first retry (doubles every retry) and most seconds between retries
+        self.max_attempts = max_attempts
+        self.delay = delay
+        self.max_delay = max_delay
+        # id(item) -> (item, times it failed) for the items that failed and haven't been finished since
+        self.attempts = dict()
+        # (time due, order, SetQueue, item) waiting to be put back on their stage's queue, soonest first
+        self.waiting = []
+        self.order = count()
+        self.condition = Condition()
+        self.stopping = False
+        self.thread = None
+        # Items put back and items given up on
+        self.retried = 0
+        self.dead = 0
+
+    def get_delay(self, attempts):
+        """
+        Gets how long an item waits before its next try
+        :param attempts: times the item failed
+        :return: float seconds
+        """
+        return min(self.max_delay, self.delay * 2 ** (attempts - 1))
+
+    def describe(self, stage, item):
+        """
+        Gets what an item is printed as
+        :param stage: stage name
+        :param item: the item
+        :return: string like films:tt0111161 (the item's repr without dead_letters)
+        """
+        return self.dead_letters.get_id(stage, item) if self.dead_letters else repr(item)
+
+    def add(self, q, item, error, trace):
+        """
+        Schedules another try of an item a stage failed on, or gives up on it after max_attempts
+        (an item waiting for its retry stays in flight and on the frontier)
+        :param q: SetQueue of the stage that failed
+        :param item: the item
+        :param error: the exception
+        :param trace: formatted traceback of the exception
+        :mutate attempts: counts the failure (forgets the item if given up on)
+        :mutate waiting: adds the item if it gets another try
+        :return: Nothing
+        """
+        with self.condition:
+            attempts = self.attempts.get(id(item), (item, 0))[1] + 1
+            retry = attempts < self.max_attempts
+            if retry:
+                self.attempts[id(item)] = (item, attempts)
+                delay = self.get_delay(attempts)
+                heapq.heappush(self.waiting, (time() + delay, next(self.order), q, item))
+                self.retried += 1
+                self.condition.notify()
+            else:
+                self.attempts.pop(id(item), None)
+                self.dead += 1
+        if retry:
+            print "{0}Failed on {1}: {2}, try {3} of {4} in {5:.0f}s{6}".format(
+                WARNING, self.describe(q.stage, item), repr(error), attempts + 1, self.max_attempts, delay, ENDC)
+            metrics.inc('stage_retries_total', {'queue': q.stage})
+        else:
+            print "{0}Gave up on {1} after {2} tries: {3}{4}".format(
+                FAIL, self.describe(q.stage, item), attempts, repr(error), ENDC)
+            metrics.inc('stage_dead_letters_total', {'queue': q.stage})
+            if self.dead_letters:
+                self.dead_letters.add(q.stage, item, error, trace, attempts)
+            q.forget(item)
+
+    def forget(self, item):
+        """
+        Forgets the failures of an item that was finished
+        :param item: the item
+        :mutate attempts: removes the item
+        :return: Nothing
+        """
+        with self.condition:
+            self.attempts.pop(id(item), None)
+
+    def retry_loop(self):
+        """
+        Puts items back on their stage's queue once they are due until stopped
+        :mutate waiting: takes the items put back
+        :return: Nothing
+        """
+        while True:
+            with self.condition:
+                while not self.stopping and (not self.waiting or self.waiting[0][0] > time()):
+                    self.condition.wait(self.waiting[0][0] - time() if self.waiting else None)
+                if self.stopping:
+                    return
+                due, order, q, item = heapq.heappop(self.waiting)
+            q.retry(item)
+
+    def start(self):
+        """
+        Starts the thread putting items back
+        :mutate thread: starts and adds a thread
+        :return: Nothing
+        """
+        self.thread = Thread(target=self.retry_loop)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stops the thread putting items back (items still waiting stay on the frontier)
+        :mutate stopping: set
+        :return: Nothing
+        """
+        with self.condition:
+            self.stopping = True
+            self.condition.notify()
+        if self.thread:
+            self.thread.join()
+
+    def qsize(self):
+        """
+        Returns the number of items waiting for a retry
+        :return: int
+        """
+        return len(self.waiting)
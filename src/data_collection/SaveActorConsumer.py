@@ -1,29 +1,26 @@
 """ Takes Actor from ActorConsumer, and adds them to mongodb """
-import pymongo
-from config.GLOBALS import MONGO_DB, MONGO_URL
 from QueueConsumer import QueueConsumer
 from utils.print_colors import OKBLUE, ENDC
 
 
 class SaveActorConsumer(QueueConsumer):
+    stage = 'save_actor'
 
-    def __init__(self, ins, outs):
+    # Every consumer of the stage adds to the same BatchWriter
+    def __init__(self, ins, outs, writer):
         QueueConsumer.__init__(self, ins, outs)
-        client = pymongo.MongoClient(MONGO_URL)
-        db_conn = client[MONGO_DB]
-        self.collection = db_conn['actors']
+        self.writer = writer
 
     def consume(self):
         """
-        Saves an actor to the database
+        Hands an actor to the writer saving it to the database
         :param input_q: queue of input items
         :param output_q: queue of output items
         :return: Nothing
         """
-        actor_todo = self.input_q.get()
-        self.input_q.task_done()
+        actor_todo = self.get_input()
         print "{0}Saving Actor:{1} to the database...{2}".format(OKBLUE, actor_todo.id, ENDC)
-        self.collection.insert(actor_todo.export())
+        self.writer.add(actor_todo.export())
         # Drop useless fields
         actor_todo.purge()
         if actor_todo.DIRECTOR:
@@ -1,9 +1,13 @@
 """ Scrapes IMDb info, add to a Queue of actors and a Queue of finished Films """
 from QueueConsumer import QueueConsumer
 from Actor import Actor
+from utils.fetch import fetch_all
+import parse_pool
 
 
 class ScrapeIMDbConsumer(QueueConsumer):
+    stage = 'scrape'
+
     # Have to have a queue to add all of the actors to
     def __init__(self, ins, outs, actors):
         QueueConsumer.__init__(self, ins, outs)
@@ -16,9 +20,12 @@ class ScrapeIMDbConsumer(QueueConsumer):
         :param output_q: queue of output items
         :return: Nothing
         """
-        film_todo = self.input_q.get()
-        self.input_q.task_done()
-        film_todo.set_non_aggregate_fields()
+        film_todo = self.get_input()
+        if parse_pool.pool:
+            # Pages are fetched here and parsed on the parse processes
+            parse_pool.scrape_film(film_todo, fetch_all(film_todo.get_page_urls()))
+        else:
+            film_todo.set_non_aggregate_fields()
         self.output_q.put(film_todo, film_todo.id)
         for a in film_todo.get_actors():
             self.actor_ins.put(Actor(a, False), a)
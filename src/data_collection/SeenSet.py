@@ -0,0 +1,242 @@
+""" Sets of seen keys for SetQueue - exact, hashed or behind a Bloom filter, optionally layered over a shared base """
+import hashlib
+import math
+import struct
+from threading import Lock
+from config.GLOBALS import SEEN_SET_BACKEND, SEEN_SET_BLOOM_CAPACITY, SEEN_SET_BLOOM_ERROR_RATE
+
+
+def get_hash64(key):
+    """
+    Hashes a key to 64 bits
+    :param key: string
+    :return: int
+    """
+    return struct.unpack('<q', hashlib.md5(key).digest()[:8])[0]
+
+
+class SeenSet:
+    """ Exact keys, interned so an id held by several sets (or objects) is stored once """
+
+    def __init__(self, keys=(), base=None):
+        # Keys added to this set
+        self.keys = set(self.normalize(k) for k in keys)
+        # Read-only set shared with other SeenSets (None for no base), keys in it count as seen
+        self.base = base
+        self.lock = Lock()
+
+    @staticmethod
+    def normalize(key):
+        """
+        Turns a key into what is stored
+        :param key: string or unicode
+        :return: interned utf-8 string
+        """
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+        return intern(key)
+
+    def has(self, key):
+        """
+        Checks a normalized key (reads are atomic so no lock is taken)
+        :param key: normalized key
+        :return: Boolean
+        """
+        return key in self.keys or (self.base is not None and self.base.has(key))
+
+    def __contains__(self, key):
+        return self.has(self.normalize(key))
+
+    def __len__(self):
+        return len(self.keys) + (len(self.base) if self.base is not None else 0)
+
+    def __iter__(self):
+        """
+        Iterates normalized keys, the base's included
+        :return: generator
+        """
+        for key in self.keys:
+            yield key
+        if self.base is not None:
+            for key in self.base:
+                yield key
+
+    def add_if_absent(self, key):
+        """
+        Adds a key unless it was already seen, as one atomic step
+        :param key: string or unicode
+        :mutate keys: adds the key
+        :return: Boolean True if the key was added
+        """
+        key = self.normalize(key)
+        with self.lock:
+            if self.has(key):
+                return False
+            self.keys.add(key)
+            return True
+
+    def add(self, key):
+        """
+        Adds a key
+        :param key: string or unicode
+        :mutate keys: adds the key
+        :return: Nothing
+        """
+        key = self.normalize(key)
+        with self.lock:
+            self.keys.add(key)
+
+    def discard(self, key):
+        """
+        Removes a key added to this set (keys in the base stay seen)
+        :param key: string or unicode
+        :mutate keys: removes the key
+        :return: Nothing
+        """
+        key = self.normalize(key)
+        with self.lock:
+            self.keys.discard(key)
+
+
+class HashedSeenSet(SeenSet):
+    """ Keys stored as 64-bit hashes - smaller than the strings, a false positive is about 1 in 2^64 per pair """
+
+    @staticmethod
+    def normalize(key):
+        """
+        Turns a key into what is stored
+        :param key: string, unicode or an already hashed int
+        :return: int
+        """
+        if isinstance(key, (int, long)):
+            return key
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+        return get_hash64(key)
+
+
+class BloomSeenSet:
+    """ Bloom filter in front of an exact SeenSet - keys never seen are answered without touching the backing set """
+
+    def __init__(self, backing, base=None, capacity=SEEN_SET_BLOOM_CAPACITY, error_rate=SEEN_SET_BLOOM_ERROR_RATE):
+        # Exact set (without a base of its own) answering when the filter says a key may have been seen
+        self.backing = backing
+        # Read-only BloomSeenSet shared with other sets (None for no base), it checks its own filter
+        self.base = base
+        # Filter sized for capacity keys at error_rate false positives
+        self.num_bits = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.num_hashes = max(1, int(round(self.num_bits / float(capacity) * math.log(2))))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.lock = Lock()
+        for key in backing.keys:
+            self.set_bits(key)
+
+    def get_positions(self, key):
+        """
+        Gets the filter bits of a normalized key (double hashing on its 64-bit hash)
+        :param key: key normalized by the backing set
+        :return: list of bit positions
+        """
+        h = key if isinstance(key, (int, long)) else get_hash64(key)
+        h1 = h & 0xffffffff
+        h2 = (h >> 32) & 0xffffffff | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def set_bits(self, key):
+        """
+        Adds a normalized key to the filter
+        :param key: key normalized by the backing set
+        :mutate bits: sets the key's bits
+        :return: Nothing
+        """
+        for p in self.get_positions(key):
+            self.bits[p >> 3] |= 1 << (p & 7)
+
+    def might_have(self, key):
+        """
+        Checks the filter for a normalized key
+        :param key: key normalized by the backing set
+        :return: Boolean False if the key was never added
+        """
+        for p in self.get_positions(key):
+            if not self.bits[p >> 3] & (1 << (p & 7)):
+                return False
+        return True
+
+    def has(self, key):
+        """
+        Checks a normalized key
+        :param key: key normalized by the backing set
+        :return: Boolean
+        """
+        return (self.might_have(key) and self.backing.has(key)) or (self.base is not None and self.base.has(key))
+
+    def __contains__(self, key):
+        return self.has(self.backing.normalize(key))
+
+    def __len__(self):
+        return len(self.backing) + (len(self.base) if self.base is not None else 0)
+
+    def __iter__(self):
+        """
+        Iterates normalized keys, the base's included
+        :return: generator
+        """
+        for key in self.backing:
+            yield key
+        if self.base is not None:
+            for key in self.base:
+                yield key
+
+    def add_if_absent(self, key):
+        """
+        Adds a key unless it was already seen, as one atomic step
+        :param key: string or unicode
+        :mutate bits: sets the key's bits
+        :mutate backing: adds the key
+        :return: Boolean True if the key was added
+        """
+        key = self.backing.normalize(key)
+        with self.lock:
+            if self.has(key):
+                return False
+            self.set_bits(key)
+            self.backing.add(key)
+            return True
+
+    def add(self, key):
+        """
+        Adds a key
+        :param key: string or unicode
+        :mutate bits: sets the key's bits
+        :mutate backing: adds the key
+        :return: Nothing
+        """
+        key = self.backing.normalize(key)
+        with self.lock:
+            self.set_bits(key)
+            self.backing.add(key)
+
+    def discard(self, key):
+        """
+        Removes a key from the backing set (its bits stay set, so it costs a backing lookup from then on)
+        :param key: string or unicode
+        :mutate backing: removes the key
+        :return: Nothing
+        """
+        self.backing.discard(key)
+
+
+def make_seen_set(keys=(), base=None, backend=SEEN_SET_BACKEND):
+    """
+    Makes a seen set of the configured kind
+    :param keys: keys seen already
+    :param base: read-only seen set shared with other sets (made by make_seen_set with the same backend)
+    :param backend: 'exact', 'hashed' or 'bloom' (a Bloom filter in front of hashed keys)
+    :return: SeenSet, HashedSeenSet or BloomSeenSet
+    """
+    if backend == 'exact':
+        return SeenSet(keys, base)
+    if backend == 'bloom':
+        return BloomSeenSet(HashedSeenSet(keys), base)
+    return HashedSeenSet(keys, base)
@@ -1,13 +1,39 @@
-""" Class to handle a Queue for multiprocessing and a set of seen items to avoid repeat processes """
-from Queue import Queue
-from multiprocessing import Lock
+""" Class to handle a Queue between threads and a set of seen items to avoid repeat processes """
+from itertools import islice
+from Queue import Queue, Full
+from threading import Lock
+from SeenSet import make_seen_set
 
 
 class SetQueue:
-    def __init__(self, starting_set=set()):
-        self.seen = starting_set
-        self.seen_lock = Lock()
-        self.queue = Queue()
+    def __init__(self, starting_set=set(), maxsize=0, seen=None, in_flight=None, frontier=None, stage=None,
+                 retries=None):
+        # Keys of the items already put (pass a seen set to share it with other SetQueues)
+        self.seen = seen if seen is not None else make_seen_set(starting_set)
+        # InFlight counting the items put here until task_done (pass one InFlight to every stage of a pipeline)
+        self.in_flight = in_flight
+        # Frontier recording the items put here under stage until task_done (None to keep them in memory only)
+        self.frontier = frontier
+        self.stage = stage
+        # RetryQueue putting back the items a consumer failed on (None to drop them)
+        self.retries = retries
+        self.stats_lock = Lock()
+        # put blocks while maxsize items are waiting (0 for no limit)
+        self.maxsize = maxsize
+        self.queue = Queue(maxsize)
+        # Most items ever waiting at once and number of puts that had to wait for room
+        self.high_water = 0
+        self.waits = 0
+
+    @staticmethod
+    def get_key(item, id_check=''):
+        """
+        Gets the key an item is seen under
+        :param item: an item
+        :param id_check: Optional arg to use to check ID instead
+        :return: string
+        """
+        return id_check if id_check else str(item)
 
     def is_seen(self, item, id_check=''):
         """
@@ -16,10 +42,7 @@ class SetQueue:
         :param id_check: Optional arg to use to check ID instead
         :return: Boolean
         """
-        with self.seen_lock:
-            if id_check:
-                return id_check in self.seen
-            return item in self.seen
+        return self.get_key(item, id_check) in self.seen
 
     def mark_seen(self, item, id_check=''):
         """
@@ -29,40 +52,129 @@ class SetQueue:
         :mutate seen: add an item to the set
         :return: Nothing
         """
-        with self.seen_lock:
-            if id_check:
-                self.seen.add(id_check)
-            else:
-                self.seen.add(str(item))
+        self.seen.add(self.get_key(item, id_check))
+
+    def unmark_seen(self, item, id_check=''):
+        """
+        Forgets an item was seen
+        :param item: an item
+        :param id_check: Optional arg to use to check ID instead
+        :mutate seen: removes an item from the set
+        :return: Nothing
+        """
+        self.seen.discard(self.get_key(item, id_check))
 
-    def put(self, item, id_check=''):
+    def claim(self, item, id_check=''):
         """
-        Puts an item in the Queue if it hasn't been seen
+        Marks an item as seen without queueing it, checking and marking as one atomic step
         :param item: an item
         :param id_check: Optional arg to use to check ID instead
         :mutate seen: adds an item
+        :return: Boolean True if the item wasn't seen before
+        """
+        return self.seen.add_if_absent(self.get_key(item, id_check))
+
+    def put(self, item, id_check='', block=True, timeout=None):
+        """
+        Puts an item in the Queue if it hasn't been seen, waiting for room if the Queue is full
+        :param item: an item
+        :param id_check: Optional arg to use to check ID instead
+        :param block: wait for room (raise Full right away if False)
+        :param timeout: seconds to wait for room at most (None to wait as long as it takes)
+        :mutate seen: adds an item
         :mutate queue: adds an item
-        :exception: small chance some error will happen between is_seen and mark_seen
+        :mutate in_flight: counts an item
+        :mutate frontier: records an item
+        :exception Full: if there was no room in time (the item isn't marked seen so it can be put again)
         :return: Nothing
         """
-        if not self.is_seen(item, id_check):
-            self.mark_seen(item, id_check)
-            return self.queue.put(item)
+        if self.claim(item, id_check):
+            if self.in_flight:
+                self.in_flight.add()
+            if self.frontier:
+                self.frontier.add(self.stage, item)
+            try:
+                try:
+                    self.queue.put(item, False)
+                except Full:
+                    if not block:
+                        raise
+                    with self.stats_lock:
+                        self.waits += 1
+                    self.queue.put(item, True, timeout)
+            except Full:
+                self.unmark_seen(item, id_check)
+                if self.in_flight:
+                    self.in_flight.done()
+                if self.frontier:
+                    self.frontier.remove(self.stage, item)
+                raise
+            size = self.queue.qsize()
+            with self.stats_lock:
+                self.high_water = max(self.high_water, size)
 
-    def get(self):
+    def get(self, block=True, timeout=None):
         """
         Gets an item from the Queue
+        :param block: wait for an item (raise Empty right away if False)
+        :param timeout: seconds to wait for an item at most (None to wait as long as it takes)
         :mutate queue: take an item
+        :exception Empty: if no item came in time
         :return: an item
         """
-        return self.queue.get()
+        return self.queue.get(block, timeout)
+
+    def task_done(self, item=None):
+        """
+        Marks an item taken with get as finished - call once the work on it, downstream puts included, is done
+        :param item: the item (needed to forget it when there is a frontier or retries)
+        :mutate in_flight: uncounts an item
+        :mutate frontier: forgets the item
+        :return: Nothing
+        """
+        self.queue.task_done()
+        self.forget(item)
+
+    def task_failed(self, item, error, trace):
+        """
+        Marks an item taken with get as failed - it is tried again later if there are retries, dropped otherwise
+        :param item: the item
+        :param error: the exception the consumer raised
+        :param trace: formatted traceback of the exception
+        :mutate retries: schedules the item (it stays in flight and on the frontier until it is finished)
+        :return: Nothing
+        """
+        if self.retries:
+            self.queue.task_done()
+            self.retries.add(self, item, error, trace)
+        else:
+            self.task_done(item)
+
+    def retry(self, item):
+        """
+        Puts a failed item back, whether it was seen or not (it is still counted in flight and on the frontier)
+        :param item: the item
+        :mutate queue: adds an item
+        :return: Nothing
+        """
+        self.queue.put(item)
 
-    def task_done(self):
+    def forget(self, item=None):
         """
-        Releases queue from lock after getting an item
+        Uncounts an item that left the queue's stage for good
+        :param item: the item (needed to forget it when there is a frontier or retries)
+        :mutate in_flight: uncounts an item
+        :mutate frontier: forgets the item
+        :mutate retries: forgets the item's failures
         :return: Nothing
         """
-        return self.queue.task_done()
+        if self.in_flight:
+            self.in_flight.done()
+        if item is not None:
+            if self.frontier:
+                self.frontier.remove(self.stage, item)
+            if self.retries:
+                self.retries.forget(item)
 
     def empty(self):
         """
@@ -77,3 +189,25 @@ class SetQueue:
         :return: int
         """
         return self.queue.qsize()
+
+    def sample(self, count):
+        """
+        Gets the items next in line without taking them
+        :param count: most items to get
+        :return: [item]
+        """
+        with self.queue.mutex:
+            return list(islice(self.queue.queue, count))
+
+    def get_stats(self):
+        """
+        Gets how full the Queue is and has been
+        :return: {'size': int, 'maxsize': int, 'active': int, 'high_water': int, 'waits': int}
+        """
+        with self.queue.mutex:
+            size = self.queue._qsize()
+            # Taken by a consumer and not marked done yet
+            active = self.queue.unfinished_tasks - size
+        with self.stats_lock:
+            return {'size': size, 'maxsize': self.maxsize, 'active': active, 'high_water': self.high_water,
+                    'waits': self.waits}
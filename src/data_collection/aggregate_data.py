@@ -1,70 +1,178 @@
 import pymongo
 from Actor import Actor
+from aggregate_incremental import aggregate_incremental, read_fingerprints, save_state, clear_state
 from Film import Film
-from config.GLOBALS import MONGO_URL, MONGO_DB
-from Queue import Queue
+from FilmStore import FilmStore, FILM_PROJECTION, ACTOR_PROJECTION
+from config.GLOBALS import MONGO_URL, MONGO_DB, AGGREGATION_MODE
+from utils.print_colors import OKGREEN, FAIL, ENDC
 
 
-def import_actors(db):
+def import_store(db):
     """
-    Imports Actors, creates object and adds to queue
+    Reads the fields aggregation needs from every film and actor into a FilmStore
     :param db: db connection
-    :return: queue of actors
+    :return: FilmStore
     """
-    actors = db['actors'].find({'FAILED': False})
-    return_q = Queue()
-    for a in actors:
-        created_a = Actor(a['id'], a['DIRECTOR'])
-        created_a.import_fields(a)
-        return_q.put(created_a)
-    return return_q
+    films = db['films'].find({'FAILED': False}, FILM_PROJECTION)
+    actors = db['actors'].find({'FAILED': False}, ACTOR_PROJECTION)
+    return FilmStore(films, actors)
+
+
+def import_films(db, store):
+    """
+    Imports Films one at a time so only the film being aggregated is held as an object
+    :param db: db connection
+    :param store: FilmStore the films were read into
+    :return: generator of films
+    """
+    films = db['films'].find({'FAILED': False}, no_cursor_timeout=True)
+    try:
+        for f in films:
+            # Skip films added since the store was read and documents of a repeated id the store didn't keep
+            row = store.get_film_row(f.get('id', ''))
+            if row < 0 or f['_id'] != store.film_documents[row]:
+                continue
+            # I didn't save mojo_year so passing None
+            # It isn't important as these films were already saved
+            created_f = Film(f['mojo_id'], f['mojo_title'], None)
+            created_f.import_fields(f)
+            yield created_f
+    finally:
+        films.close()
 
 
-def import_films(db):
+def import_objects(db):
     """
-    Imports Films, creates object and adds to queue
+    Reads every finished film and actor as plain Film and Actor objects, the object path without a FilmStore
     :param db: db connection
-    :return: queue of films
+    :mutate Film.all_films: adds every film
+    :mutate Actor.all_actors: adds every actor (directors as director-<id>)
+    :return: Nothing
     """
-    films = db['films'].find({'FAILED': False})
-    return_q = Queue()
-    for f in films:
-        # I didn't save mojo_year so passing None
-        # It isn't important as these films were already saved
+    for f in db['films'].find({'FAILED': False}):
         created_f = Film(f['mojo_id'], f['mojo_title'], None)
         created_f.import_fields(f)
-        return_q.put(created_f)
-    return return_q
+        Film.all_films[created_f.id] = created_f
+    for a in db['actors'].find({'FAILED': False}):
+        created_a = Actor(a['id'], a['DIRECTOR'])
+        created_a.import_fields(a)
+        if created_a.DIRECTOR:
+            Actor.all_actors["director-{0}".format(created_a.id)] = created_a
+        else:
+            Actor.all_actors[created_a.id] = created_a
+
+
+def verify_film(film, row):
+    """
+    Checks the batched pass against the object path for a film
+    :param film: a Film with set_aggregate_fields already called
+    :param row: {field: value} from aggregate_vectorized.get_aggregate_rows
+    :return: number of mismatched fields
+    """
+    from aggregate_vectorized import compare_aggregates
+    mismatches = compare_aggregates(film, row)
+    for f_id, field, expected, val in mismatches:
+        print "{0}Film:{1} {2} object: {3} vectorized: {4}{5}".format(FAIL, f_id, field, expected, val, ENDC)
+    return len(mismatches)
+
+
+def aggregate_verify(db, rows):
+    """
+    Aggregates every film on the object path without the FilmStore and checks the batched pass against it, so a
+    bug building the store shows up as a mismatch instead of on both sides
+    :param db: db connection
+    :param rows: {film id: {field: value}} from the batched pass over the store
+    :mutate films_agg: saves the object path's films
+    :mutate Film.all_films, Actor.all_actors: filled while aggregating, emptied after
+    :return: number of mismatched fields and films only one side has
+    """
+    store = Film.store
+    Film.store = None
+    Actor.store = None
+    try:
+        import_objects(db)
+        mismatches = 0
+        for f_id, film in Film.all_films.iteritems():
+            film.set_aggregate_fields()
+            if f_id in rows:
+                mismatches += verify_film(film, rows[f_id])
+            else:
+                print "{0}Film:{1} missing from the vectorized pass{2}".format(FAIL, f_id, ENDC)
+                mismatches += 1
+            db['films_agg'].insert(film.export())
+        for f_id in set(rows) - set(Film.all_films):
+            print "{0}Film:{1} missing from the object path{2}".format(FAIL, f_id, ENDC)
+            mismatches += 1
+    finally:
+        Film.store = store
+        Actor.store = store
+        Film.all_films.clear()
+        Actor.all_actors.clear()
+    return mismatches
+
+
+def aggregate_all(db, store, mode):
+    """
+    Drops films_agg and aggregates every film in the store
+    :param db: db connection
+    :param store: FilmStore that Film and Actor read from
+    :param mode: 'objects', 'parallel', 'vectorized' or 'verify'
+    :mutate films_agg: replaces the collection
+    :return: Nothing
+    """
+    print "Dropping films_agg collection..."
+    db.drop_collection("films_agg")
+    if mode == 'parallel':
+        from aggregate_parallel import aggregate_parallel
+        aggregate_parallel(store)
+        return
+
+    # 'vectorized' and 'verify' compute every film's aggregates in one batched pass up front
+    rows = None
+    if mode in ['vectorized', 'verify']:
+        from aggregate_vectorized import compute_aggregates, get_aggregate_rows, apply_aggregates
+        print "Computing aggregates for {0} films...".format(len(store.film_ids))
+        rows = get_aggregate_rows(compute_aggregates(store))
+
+    # 'verify' checks against every film and actor held as objects, the other modes stream films over the store
+    if mode == 'verify':
+        mismatches = aggregate_verify(db, rows)
+        color = FAIL if mismatches else OKGREEN
+        print "{0}{1} mismatched aggregate fields{2}".format(color, mismatches, ENDC)
+        return
+
+    # Call aggregate on every film and save it to MongoDb
+    for film in import_films(db, store):
+        if mode == 'vectorized':
+            apply_aggregates(film, rows[film.id])
+        else:
+            film.set_aggregate_fields()
+        db['films_agg'].insert(film.export())
 
 
-def main():
+def main(mode=AGGREGATION_MODE):
     print "Connecting to {0}...".format(MONGO_URL)
     client = pymongo.MongoClient(MONGO_URL)
     print "Linking to the following data: {0}...".format(MONGO_DB)
     db_conn = client[MONGO_DB]
-    print "Dropping films_agg collection..."
-    db_conn.drop_collection("films_agg")
-    # Add all finished films to the Film.dict
-    film_output_q = import_films(db_conn)
-    actor_output_q = import_actors(db_conn)
-    while not film_output_q.empty():
-        q_film = film_output_q.get()
-        film_output_q.task_done()
-        Film.all_films[q_film.id] = q_film
-
-    # Add all finished actors to the Actor.dict
-    while not actor_output_q.empty():
-        a_film = actor_output_q.get()
-        actor_output_q.task_done()
-        if a_film.DIRECTOR:
-            Actor.all_actors["director-{0}".format(a_film.id)] = a_film
-        else:
-            Actor.all_actors[a_film.id] = a_film
-
-    # Call aggregate on every film
-    for f_id in Film.all_films:
-        Film.all_films[f_id].set_aggregate_fields()
+    incremental = mode == 'incremental'
+    # Only incremental runs fingerprint every document, read before the store so anything that changes in between
+    # is picked up next run
+    if incremental:
+        film_fingerprints, actor_fingerprints = read_fingerprints(db_conn)
+    # Read every finished film and actor into the store that aggregation looks them up in
+    store = import_store(db_conn)
+    Film.store = store
+    Actor.store = store
 
-    # Save all of the films to MongoDb
-    for f_id in Film.all_films:
-        db_conn['films_agg'].insert(Film.all_films[f_id].export())
+    if incremental:
+        if aggregate_incremental(db_conn, store, film_fingerprints, actor_fingerprints):
+            return
+        print "No previous aggregation to update, aggregating every film..."
+        mode = 'objects'
+    aggregate_all(db_conn, store, mode)
+    if incremental:
+        save_state(db_conn, store, film_fingerprints, actor_fingerprints)
+    else:
+        # films_agg was replaced without fingerprints, the saved ones would no longer match it
+        clear_state(db_conn)
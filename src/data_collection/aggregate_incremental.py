@@ -0,0 +1,212 @@
+""" Incremental aggregation - recomputes only the films affected by films and actors that changed since the last run """
+import hashlib
+import numpy as np
+from Film import Film
+from FilmStore import ACTOR_PROJECTION
+from utils.print_colors import OKBLUE, ENDC
+
+# Number of ids sent in a single $in query
+QUERY_CHUNK_SIZE = 1000
+
+
+def get_fingerprint(doc):
+    """
+    Hashes a document so changes can be found on the next run
+    :param doc: dict from MongoDB
+    :return: hex string
+    """
+    return hashlib.md5(repr(sorted((k, v) for k, v in doc.items() if k != '_id'))).hexdigest()
+
+
+def get_actor_key(doc):
+    """
+    Gets the key an actor document is stored under (director-{id} for directors)
+    :param doc: actor dict from MongoDB
+    :return: string
+    """
+    if doc.get('DIRECTOR', False):
+        return "director-{0}".format(doc.get('id', ''))
+    return doc.get('id', '')
+
+
+def get_chunks(items):
+    """
+    Splits a list into chunks that fit in a query
+    :param items: list
+    :return: generator of lists
+    """
+    items = list(items)
+    for start in range(0, len(items), QUERY_CHUNK_SIZE):
+        yield items[start:start + QUERY_CHUNK_SIZE]
+
+
+def read_fingerprints(db):
+    """
+    Fingerprints every film and actor aggregation reads
+    :param db: db connection
+    :return: {film id: hash}, {actor key: hash}
+    """
+    films = dict()
+    for f in db['films'].find({'FAILED': False}):
+        # The last document with an id is the one aggregated (same as FilmStore)
+        films[f.get('id', '')] = get_fingerprint(f)
+    actors = dict()
+    for a in db['actors'].find({'FAILED': False}, ACTOR_PROJECTION):
+        actors[get_actor_key(a)] = get_fingerprint(a)
+    return films, actors
+
+
+def load_state(db):
+    """
+    Reads the fingerprints saved by the last run
+    :param db: db connection
+    :return: {film id: (hash, release day)}, {actor key: hash} or None, None if there was no previous run
+    """
+    films = dict()
+    actors = dict()
+    for s in db['films_agg_state'].find({}):
+        if s['kind'] == 'film':
+            films[s['key']] = (s['hash'], s['day'])
+        else:
+            actors[s['key']] = s['hash']
+    if not films and not actors:
+        return None, None
+    return films, actors
+
+
+def save_state(db, store, film_fingerprints, actor_fingerprints):
+    """
+    Saves the fingerprints the films_agg collection was computed from
+    :param db: db connection
+    :param store: FilmStore aggregation read from
+    :param film_fingerprints: {film id: hash} read before the store
+    :param actor_fingerprints: {actor key: hash} read before the store
+    :mutate films_agg_state: replaces the collection
+    :return: Nothing
+    """
+    db.drop_collection('films_agg_state')
+    states = [{'kind': 'film', 'key': f_id, 'hash': h,
+               'day': int(store.release_days[store.get_film_row(f_id)])}
+              for f_id, h in film_fingerprints.items()]
+    states.extend({'kind': 'actor', 'key': key, 'hash': h} for key, h in actor_fingerprints.items())
+    for chunk in get_chunks(states):
+        db['films_agg_state'].insert(chunk)
+
+
+def clear_state(db):
+    """
+    Forgets the fingerprints of the last run, so the next incremental run aggregates every film
+    :param db: db connection
+    :mutate films_agg_state: drops the collection
+    :return: Nothing
+    """
+    db.drop_collection('films_agg_state')
+
+
+def get_casting_films(store):
+    """
+    Builds a reverse index of the films each actor was cast in (or directed)
+    :param store: FilmStore
+    :return: CSR offsets per actor row, film rows
+    """
+    num_films = len(store.film_ids)
+    actor_rows = np.concatenate([store.cast_rows, store.director_rows]).astype(np.int64)
+    film_rows = np.concatenate([np.repeat(np.arange(num_films, dtype=np.int64), np.diff(store.cast_offsets)),
+                                np.arange(num_films, dtype=np.int64)])
+    known = actor_rows >= 0
+    order = np.argsort(actor_rows[known], kind='mergesort')
+    actor_rows = actor_rows[known][order]
+    film_rows = film_rows[known][order]
+    offsets = np.searchsorted(actor_rows, np.arange(len(store.actor_keys) + 1))
+    return offsets, film_rows
+
+
+def get_affected_films(db, store, changed_films, changed_actors, removed_actors):
+    """
+    Finds every film whose aggregate fields may differ from the last run
+    :param db: db connection
+    :param store: FilmStore
+    :param changed_films: {film id: earliest of the old and new release day} for new, changed and removed films
+    :param changed_actors: actor keys that are new or changed
+    :param removed_actors: actor keys that were removed
+    :return: set of film rows
+    """
+    affected = set(store.get_film_row(f_id) for f_id in changed_films) - set([-1])
+    offsets, casting_films = get_casting_films(store)
+
+    # A new or changed actor changes every film they were cast in
+    for key in changed_actors:
+        row = store.get_actor_row(key)
+        if row >= 0:
+            affected.update(casting_films[offsets[row]:offsets[row + 1]].tolist())
+    # Films that cast a removed actor can't be found through the store
+    removed_ids = list(set(key.replace('director-', '', 1) for key in removed_actors))
+    for chunk in get_chunks(removed_ids):
+        query = {'FAILED': False, '$or': [{'actors': {'$in': chunk}}, {'director': {'$in': chunk}}]}
+        for f in db['films'].find(query, {'_id': False, 'id': True}):
+            affected.add(store.get_film_row(f.get('id', '')))
+
+    # A changed film changes the films after it in the timeline of every actor who has it in their filmography
+    timeline_days = dict()
+    for chunk in get_chunks(changed_films):
+        for a in db['actors'].find({'FAILED': False, 'films': {'$in': chunk}}, ACTOR_PROJECTION):
+            row = store.get_actor_row(get_actor_key(a))
+            if row < 0:
+                continue
+            day = min(changed_films[f_id] for f_id in a.get('films', []) if f_id in changed_films)
+            timeline_days[row] = min(day, timeline_days.get(row, day))
+    for row, day in timeline_days.items():
+        for film_row in casting_films[offsets[row]:offsets[row + 1]].tolist():
+            # Films missing from the filmography read the whole timeline
+            if store.release_days[film_row] >= day or store.get_position(row, film_row) is None:
+                affected.add(film_row)
+    affected.discard(-1)
+    return affected
+
+
+def aggregate_incremental(db, store, film_fingerprints, actor_fingerprints):
+    """
+    Recomputes and upserts only the films affected by changes since the last run
+    :param db: db connection
+    :param store: FilmStore read after the fingerprints
+    :param film_fingerprints: {film id: hash} read before the store
+    :param actor_fingerprints: {actor key: hash} read before the store
+    :mutate films_agg: upserts affected films and removes films that are gone
+    :mutate films_agg_state: saves the new fingerprints
+    :return: False if there is no previous run to start from, True otherwise
+    """
+    old_films, old_actors = load_state(db)
+    if old_films is None:
+        return False
+    changed_films = dict()
+    for f_id, h in film_fingerprints.items():
+        row = store.get_film_row(f_id)
+        old = old_films.get(f_id)
+        if row >= 0 and (not old or old[0] != h):
+            day = int(store.release_days[row])
+            changed_films[f_id] = min(day, old[1]) if old else day
+    removed_films = [f_id for f_id in old_films if f_id not in film_fingerprints]
+    for f_id in removed_films:
+        changed_films[f_id] = old_films[f_id][1]
+    changed_actors = [key for key, h in actor_fingerprints.items() if old_actors.get(key) != h]
+    removed_actors = [key for key in old_actors if key not in actor_fingerprints]
+    print "{0}Changed since the last run: {1} films, {2} actors ({3} films and {4} actors removed){5}".format(
+        OKBLUE, len(changed_films) - len(removed_films), len(changed_actors), len(removed_films),
+        len(removed_actors), ENDC)
+
+    affected = get_affected_films(db, store, changed_films, changed_actors, removed_actors)
+    print "{0}Recomputing {1} of {2} films...{3}".format(OKBLUE, len(affected), len(store.film_ids), ENDC)
+    db['films_agg'].create_index('id')
+    for chunk in get_chunks(removed_films):
+        db['films_agg'].remove({'id': {'$in': chunk}})
+    for chunk in get_chunks(store.film_ids[row] for row in sorted(affected)):
+        # Repeated ids are aggregated once, from their last document (like FilmStore)
+        films = dict((f.get('id', ''), f) for f in db['films'].find({'FAILED': False, 'id': {'$in': chunk}}))
+        for f in films.values():
+            # I didn't save mojo_year so passing None
+            created_f = Film(f['mojo_id'], f['mojo_title'], None)
+            created_f.import_fields(f)
+            created_f.set_aggregate_fields()
+            db['films_agg'].update({'id': created_f.id}, created_f.export(), upsert=True)
+    save_state(db, store, film_fingerprints, actor_fingerprints)
+    return True
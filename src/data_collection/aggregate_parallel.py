@@ -0,0 +1,86 @@
+""" Process-pool aggregation - workers memory-map one saved FilmStore and each save their own partition of films """
+import pymongo
+import shutil
+import tempfile
+from multiprocessing import Pool, cpu_count
+from Actor import Actor
+from Film import Film
+from FilmStore import FilmStore
+from config.GLOBALS import MONGO_DB, MONGO_URL, AGGREGATION_WORKERS, AGGREGATION_PARTITION_SIZE
+from utils.print_colors import OKBLUE, ENDC
+
+# Per worker process connection to the films collections (set by init_worker)
+worker_db = None
+
+
+def init_worker(store_directory):
+    """
+    Sets up a worker process: maps the shared store and opens its own MongoDB connection
+    :param store_directory: directory FilmStore.save wrote to
+    :mutate Film.store, Actor.store: the memory-mapped store
+    :mutate worker_db: db connection for this process
+    :return: Nothing
+    """
+    global worker_db
+    store = FilmStore.load(store_directory)
+    Film.store = store
+    Actor.store = store
+    worker_db = pymongo.MongoClient(MONGO_URL)[MONGO_DB]
+
+
+def aggregate_partition(film_ids):
+    """
+    Aggregates a partition of films and saves them to films_agg
+    :param film_ids: ids of the films in the partition
+    :return: number of films saved
+    """
+    # Repeated ids are aggregated once, from their last document (like FilmStore)
+    films = dict((f['id'], f) for f in worker_db['films'].find({'FAILED': False, 'id': {'$in': film_ids}}))
+    aggregated = []
+    for f in films.values():
+        # I didn't save mojo_year so passing None
+        created_f = Film(f['mojo_id'], f['mojo_title'], None)
+        created_f.import_fields(f)
+        created_f.set_aggregate_fields()
+        aggregated.append(created_f.export())
+    if aggregated:
+        worker_db['films_agg'].insert(aggregated)
+    return len(aggregated)
+
+
+def get_partitions(store, size):
+    """
+    Splits the store's films into partitions
+    :param store: FilmStore
+    :param size: films per partition
+    :return: generator of lists of film ids
+    """
+    for start in range(0, len(store.film_ids), size):
+        yield store.film_ids[start:start + size]
+
+
+def aggregate_parallel(store, workers=AGGREGATION_WORKERS, partition_size=AGGREGATION_PARTITION_SIZE):
+    """
+    Aggregates every film in a store across a pool of processes
+    :param store: FilmStore read from the films and actors collections
+    :param workers: number of processes (None for one per core)
+    :param partition_size: films handed to a worker at a time
+    :return: number of films saved
+    """
+    workers = workers or cpu_count()
+    store_directory = tempfile.mkdtemp(prefix='film_store_')
+    saved = 0
+    try:
+        store.save(store_directory)
+        print "{0}Aggregating {1} films on {2} processes...{3}".format(OKBLUE, len(store.film_ids), workers, ENDC)
+        pool = Pool(workers, init_worker, (store_directory,))
+        try:
+            for count in pool.imap_unordered(aggregate_partition, get_partitions(store, partition_size)):
+                saved += count
+                print "{0}Saved {1}/{2} films to films_agg{3}".format(OKBLUE, saved, len(store.film_ids), ENDC)
+        finally:
+            pool.close()
+            pool.join()
+    finally:
+        shutil.rmtree(store_directory, ignore_errors=True)
+    return saved
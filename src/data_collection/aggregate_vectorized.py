@@ -0,0 +1,187 @@
+""" Columnar alternative to Film.set_aggregate_fields - computes every film's aggregate fields in one batched pass """
+import numpy as np
+import pandas as pd
+from FilmStore import FLOAT_STATS
+from FilmTimeline import FilmTimeline
+
+# Every field set by Film.set_aggregate_fields
+AGGREGATE_FIELDS = ['avg_actor_film_appearances', 'max_actor_film_appearances', 'director_number_of_films',
+                    'avg_actor_film_revenue', 'max_actor_film_revenue', 'avg_director_film_revenue',
+                    'max_director_film_revenue', 'avg_actor_age', 'director_age', 'avg_actor_film_stars',
+                    'max_actor_film_stars', 'avg_director_film_stars', 'max_director_film_stars',
+                    'avg_actor_film_metascore', 'max_actor_film_metascore', 'avg_director_film_metascore',
+                    'max_director_film_metascore', 'avg_actor_film_votes', 'max_actor_film_votes',
+                    'avg_director_film_votes', 'max_director_film_votes']
+# Relative tolerance used when checking float fields against the object path
+FLOAT_TOLERANCE = 1e-9
+
+
+def divide(sums, counts, stat=None):
+    """
+    Averages like the object path does (floor division for ints)
+    :param sums: array of sums
+    :param counts: array of counts
+    :param stat: key of FilmTimeline.STATS or None for an int
+    :return: array of averages
+    """
+    # If length is 0, divide by 1
+    counts = np.maximum(1, counts)
+    if stat in FLOAT_STATS:
+        return sums / counts
+    return sums // counts
+
+
+class TimelineLookup:
+    """ Answers the Actor 'before' getters for many (actor, film) pairs at once from a FilmStore """
+
+    def __init__(self, store):
+        self.store = store
+        self.num_rows = len(store.film_ids) + 1
+        num_actors = len(store.actor_keys)
+        lengths = np.diff(store.film_offsets)
+        # Appended 0 so that actor row -1 (not scraped) reads as an actor with no films
+        self.lengths = np.append(lengths, 0)
+        self.bases = np.append(store.film_offsets[:-1] + np.arange(num_actors, dtype=np.int64), 0)
+        # Only the first appearance of a film counts, same as list.index
+        actors = np.repeat(np.arange(num_actors, dtype=np.int64), lengths)
+        keys = self.get_pair_keys(actors, store.film_rows)
+        self.pair_keys, firsts = np.unique(keys, return_index=True)
+        self.pair_positions = firsts - store.film_offsets[actors[firsts]]
+        if not len(self.pair_keys):
+            # Nothing can match a negative key
+            self.pair_keys = np.array([-1], dtype=np.int64)
+            self.pair_positions = np.array([0], dtype=np.int64)
+
+    def get_pair_keys(self, actor_rows, film_rows):
+        """
+        Combines actor and film rows into one sortable key
+        :param actor_rows: array of actor rows
+        :param film_rows: array of film rows (-1 for films not in the store)
+        :return: array of int64 keys
+        """
+        return actor_rows.astype(np.int64) * self.num_rows + (film_rows.astype(np.int64) + 1)
+
+    def lookup(self, actor_rows, film_rows):
+        """
+        Gets the 'before' stats for (actor, film) pairs
+        :param actor_rows: array of actor rows (-1 if the actor wasn't scraped)
+        :param film_rows: array of film rows to stop at
+        :return: dict of column -> array
+        """
+        store = self.store
+        known = actor_rows >= 0
+        keys = self.get_pair_keys(actor_rows, film_rows)
+        hits = np.minimum(np.searchsorted(self.pair_keys, keys), len(self.pair_keys) - 1)
+        found = known & (self.pair_keys[hits] == keys)
+        positions = np.where(found, self.pair_positions[hits], 0)
+        # If the film isn't in the filmography every film is included
+        prefixes = self.bases[actor_rows] + np.where(found, positions, self.lengths[actor_rows])
+        film_years = store.release_years[film_rows].astype(np.int64)
+        columns = {
+            'appearances': positions,
+            'age': np.maximum(0, film_years - store.birth_years[actor_rows].astype(np.int64))
+        }
+        for stat in FilmTimeline.STATS:
+            sums = np.where(known, store.prefix_sums[stat][prefixes], 0)
+            counts = np.where(known, store.prefix_counts[stat][prefixes], 0)
+            columns['avg_' + stat] = divide(sums, counts, stat)
+            columns['max_' + stat] = np.where(known, store.prefix_maxes[stat][prefixes], 0)
+        return columns
+
+
+def get_actor_stats(values, films, num_films, stat=None):
+    """
+    Vectorized Film.get_actor_stats
+    :param values: array with a value per cast row
+    :param films: array with the film row of each cast row
+    :param num_films: number of films
+    :param stat: key of FilmTimeline.STATS the values are averages of, None for an int
+    :return: avg array, max array
+    """
+    # If the actor doesn't have a value, skip it
+    valid = values > 0
+    frame = pd.DataFrame({'film': films, 'value': np.where(valid, values, 0), 'valid': valid.astype(np.int64)})
+    grouped = frame.groupby('film', sort=False)
+    sums = grouped['value'].sum().reindex(np.arange(num_films)).fillna(0).values
+    counts = grouped['valid'].sum().reindex(np.arange(num_films)).fillna(0).values.astype(np.int64)
+    maxes = grouped['value'].max().reindex(np.arange(num_films)).fillna(0).values
+    if stat not in FLOAT_STATS:
+        sums = sums.astype(np.int64)
+        maxes = maxes.astype(np.int64)
+    return divide(sums, counts, stat), maxes
+
+
+def compute_aggregates(store):
+    """
+    Computes every aggregate field for every film in a FilmStore
+    :param store: FilmStore
+    :return: DataFrame indexed by film id with a column per AGGREGATE_FIELDS
+    """
+    num_films = len(store.film_ids)
+    if not num_films:
+        return pd.DataFrame(columns=AGGREGATE_FIELDS)
+    result = pd.DataFrame(index=pd.Index(store.film_ids, dtype=object))
+    timelines = TimelineLookup(store)
+
+    # Cast rows: one per (film, cast member) in the order of Film.actors
+    cast_films = np.repeat(np.arange(num_films, dtype=np.int64), np.diff(store.cast_offsets))
+    cast_stats = timelines.lookup(store.cast_rows.astype(np.int64), cast_films)
+    result['avg_actor_film_appearances'], result['max_actor_film_appearances'] = get_actor_stats(
+        cast_stats['appearances'], cast_films, num_films)
+    result['avg_actor_age'] = get_actor_stats(cast_stats['age'], cast_films, num_films)[0]
+    for stat in FilmTimeline.STATS:
+        result['avg_actor_film_' + stat], result['max_actor_film_' + stat] = get_actor_stats(
+            cast_stats['avg_' + stat], cast_films, num_films, stat)
+
+    # Director rows: one per film
+    director_stats = timelines.lookup(store.director_rows.astype(np.int64), np.arange(num_films, dtype=np.int64))
+    result['director_number_of_films'] = director_stats['appearances']
+    result['director_age'] = director_stats['age']
+    for stat in FilmTimeline.STATS:
+        result['avg_director_film_' + stat] = director_stats['avg_' + stat]
+        result['max_director_film_' + stat] = director_stats['max_' + stat]
+    return result[AGGREGATE_FIELDS]
+
+
+def get_aggregate_rows(aggregates):
+    """
+    Converts computed aggregates to plain python values per film
+    :param aggregates: DataFrame from compute_aggregates
+    :return: dict of film id -> {field: value}
+    """
+    # tolist gives python numbers which pymongo can encode
+    columns = [aggregates[field].tolist() for field in AGGREGATE_FIELDS]
+    return dict((f_id, dict(zip(AGGREGATE_FIELDS, values)))
+                for f_id, values in zip(aggregates.index.tolist(), zip(*columns)))
+
+
+def apply_aggregates(film, row):
+    """
+    Copies computed aggregate fields onto a Film
+    :param film: a Film
+    :param row: {field: value} from get_aggregate_rows
+    :mutate film: sets every aggregate field
+    :return: Nothing
+    """
+    for field in AGGREGATE_FIELDS:
+        setattr(film, field, row[field])
+
+
+def compare_aggregates(film, row):
+    """
+    Checks computed aggregate fields against the ones set on a Film by the object path
+    :param film: a Film with set_aggregate_fields already called
+    :param row: {field: value} from get_aggregate_rows
+    :return: [(film id, field, object value, vectorized value)] for every mismatch
+    """
+    mismatches = []
+    for field in AGGREGATE_FIELDS:
+        expected = getattr(film, field)
+        val = row[field]
+        if isinstance(val, float) or isinstance(expected, float):
+            same = abs(expected - val) <= FLOAT_TOLERANCE * max(1.0, abs(expected))
+        else:
+            same = expected == val
+        if not same:
+            mismatches.append((film.id, field, expected, val))
+    return mismatches
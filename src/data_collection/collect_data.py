@@ -1,19 +1,45 @@
 """ Script to start data collection process """
+# Imported up front: strptime imports it lazily, which isn't thread safe the first time the parse threads call it
+import _strptime
 import pymongo
-import requests
 from Actor import Actor
 from ActorConsumer import ActorConsumer
+from BatchWriter import BatchWriter
 from bs4 import BeautifulSoup
+from ConsumerPool import ConsumerPool
+from DeadLetters import DeadLetters
 from datetime import datetime
 from Film import Film
 from FindIMDbConsumer import FindIMDbConsumer
+from Frontier import Frontier
+from itertools import chain
+from InFlight import InFlight
+from OutputSink import make_output_sink
+import parse_pool
 from Queue import Queue
+from RetryQueue import RetryQueue
 from SaveActorConsumer import SaveActorConsumer
 from SaveFilmConsumer import SaveFilmConsumer
 from ScrapeIMDbConsumer import ScrapeIMDbConsumer
+from SeenSet import make_seen_set
 from SetQueue import SetQueue
-from time import sleep
-from config.GLOBALS import MONGO_DB, MONGO_URL, COLLECTIONS
+from threading import Thread
+from config.GLOBALS import MONGO_DB, MONGO_URL, COLLECTIONS, CRAWL_MODE, QUEUE_CAPACITY, CONSUMER_WORKERS, \
+    METRICS_SNAPSHOT_FILE, STARTUP_BATCH_SIZE, MEMORY_SAMPLE_SIZE, OUTPUT_SINK
+from utils import metrics, page_cache
+from utils.memory import get_items_size, get_resident_bytes
+from utils.mongo import get_db
+from utils.print_colors import FAIL, WARNING, ENDC
+from utils.fetch import fetch, get_host_stats, avoided
+
+# Indexes of the fields collect_data queries (and BatchWriter upserts on) by collection
+FILM_ID_INDEX = [('id', pymongo.ASCENDING)]
+FILM_MOJO_INDEX = [('mojo_id', pymongo.ASCENDING)]
+ACTOR_INDEX = [('DIRECTOR', pymongo.ASCENDING), ('id', pymongo.ASCENDING)]
+INDEXES = {'films': [FILM_ID_INDEX, FILM_MOJO_INDEX], 'actors': [ACTOR_INDEX]}
+# Box Office Mojo page letters
+LETTERS = ['NUM', 'A', 'B', 'C', 'D', 'E', 'F', 'G', 'H', 'I', 'J', 'K', 'L', 'M', 'N', 'O', 'P', 'Q', 'R', 'S',
+           'T', 'U', 'V', 'W', 'X', 'Y', 'Z']
 
 
 def drop_collections(db):
@@ -29,61 +55,113 @@ def drop_collections(db):
             db.drop_collection(c)
 
 
+def has_index(collection, keys):
+    """
+    Checks an index exists
+    :param collection: pymongo collection
+    :param keys: keys of the index
+    :return: Boolean
+    """
+    return keys in [info['key'] for info in collection.index_information().values()]
+
+
+def ensure_indexes(db):
+    """
+    Creates the indexes the startup queries and the save upserts use (if missing) and checks they exist
+    :param db: data base connection
+    :mutate db: creates missing indexes
+    :return: Nothing
+    """
+    for collection, indexes in INDEXES.items():
+        for keys in indexes:
+            db[collection].create_index(keys)
+        for keys in indexes:
+            if not has_index(db[collection], keys):
+                print "{0}Missing index {1} on {2}, startup queries will scan it{3}".format(
+                    WARNING, keys, collection, ENDC)
+
+
+def get_indexed_values(collection, field, query, index):
+    """
+    Streams the values of a field, read from an index covering the query instead of the documents
+    :param collection: pymongo collection
+    :param field: field to read
+    :param query: filter on fields of the index
+    :param index: keys of the index (made by ensure_indexes, the collection is scanned if it is missing)
+    :return: generator of values (documents without the field, or with it null, are skipped)
+    """
+    docs = collection.find(query, {field: True, '_id': False}).batch_size(STARTUP_BATCH_SIZE)
+    # MongoDB rejects a hint to an index that doesn't exist
+    if has_index(collection, index):
+        docs = docs.hint(index)
+    for doc in docs:
+        if doc.get(field) is not None:
+            yield doc[field]
+
+
 def get_seen_db_films(db):
     """
     Gets all of the movies already seen in the database
     :param db: data base connection
-    :return: set(imdb_id)
+    :return: generator of imdb_id
     """
-    return set(db['films'].distinct("id", {}))
+    return get_indexed_values(db['films'], 'id', {}, FILM_ID_INDEX)
 
 
 def get_scraped_mojo_ids(db):
     """
         Gets all of the mojo_ids of movies already processed that passed
         :param db: data base connection
-        :return: set(mojo_id)
+        :return: generator of mojo_id
         """
-    return set(db['films'].distinct("mojo_id", {}))
+    return get_indexed_values(db['films'], 'mojo_id', {}, FILM_MOJO_INDEX)
 
 
 def get_seen_db_actors(db):
     """
         Gets all of the actors already seen in the database
         :param db: data base connection
-        :return: set(imdb_id)
+        :return: generator of imdb_id
         """
-    return set(db['actors'].distinct("id", {"DIRECTOR": False}))
+    return get_indexed_values(db['actors'], 'id', {"DIRECTOR": False}, ACTOR_INDEX)
 
 
 def get_all_film_people(db):
     """
-        Gets all of the actors and directors referenced by films
+        Gets all of the actors and directors referenced by films, reading only those two fields
+        (repeats are left to the seen sets of the queues they are put on)
         :param db: data base connection
-        :return: [{'id': str, 'DIRECTOR': boolean}]
+        :return: generator of {'id': str, 'DIRECTOR': boolean}
         """
-    films = db['films'].find({})
-    unique_people = set()
-    peoples = []
-    for f in films:
-        director = "director-{0}".format(f.get('director', ''))
-        if director not in unique_people:
-            peoples.append({'id': f.get('director', ''), 'DIRECTOR': True})
-            unique_people.add(director)
-        for a in f.get('actors', []):
-            if a not in unique_people:
-                peoples.append({'id': a, 'DIRECTOR': False})
-                unique_people.add(a)
-    return peoples
+    # Read as fast as actor_todo_q drains, a batch can take longer than the server's idle cursor timeout to use up
+    films = db['films'].find({}, {'director': True, 'actors': True, '_id': False}, no_cursor_timeout=True)
+    try:
+        for f in films.batch_size(STARTUP_BATCH_SIZE):
+            yield {'id': f.get('director', ''), 'DIRECTOR': True}
+            for a in f.get('actors', []):
+                yield {'id': a, 'DIRECTOR': False}
+    finally:
+        films.close()
 
 
 def get_seen_db_directors(db):
     """
         Gets all of the directors already seen in the database
         :param db: data base connection
-        :return: set(director-imdb_id)
+        :return: generator of director-imdb_id
         """
-    return set("director-{0}".format(imdb_id) for imdb_id in db['actors'].distinct("id", {"DIRECTOR": True}))
+    return ("director-{0}".format(imdb_id)
+            for imdb_id in get_indexed_values(db['actors'], 'id', {"DIRECTOR": True}, ACTOR_INDEX))
+
+
+def get_bom_url(l, p):
+    """
+    Gets the url of a box office mojo title page
+    :param l: the page letter
+    :param p: the page number
+    :return: string url
+    """
+    return "http://www.boxofficemojo.com/movies/alphabetical.htm?letter={0}&page={1}&p=.htm".format(l, p)
 
 
 def get_bom_movies(l, p):
@@ -93,8 +171,15 @@ def get_bom_movies(l, p):
     :param p: the page number
     :return: a list of bs'd elements
     """
-    url = "http://www.boxofficemojo.com/movies/alphabetical.htm?letter={0}&page={1}&p=.htm".format(l, p)
-    res = requests.get(url)
+    return parse_bom_movies(fetch(get_bom_url(l, p)))
+
+
+def parse_bom_movies(res):
+    """
+    Gets the title table from a fetched box office mojo page
+    :param res: response for the page
+    :return: a list of bs'd elements
+    """
     if res.status_code >= 400:
         return []
     soup = BeautifulSoup(res.content, "html.parser")
@@ -105,78 +190,357 @@ def get_bom_movies(l, p):
     return [m for m in movie_rows if m.name == 'tr']
 
 
-def main():
+def get_bom_films(table):
+    """
+    Makes a Film for every row of a box office mojo title table with revenue
+    :param table: a list of bs'd elements from get_bom_movies
+    :return: [Film]
+    """
+    films = []
+    for tr in table:
+        try:
+            tds = tr.find_all('td')
+            if len(tds) < 7:
+                continue
+            # If revenue is not applicable
+            if tds[2].text.strip() == 'n/a':
+                continue
+            title = tds[0].text.strip()
+            mojo_id = tds[0].find('a')['href'].replace('/movies/?id=', '').replace('.htm', '')
+            mojo_year = str(datetime.strptime(tds[6].text.strip(), "%m/%d/%Y").year)
+            films.append(Film(mojo_id, title, mojo_year))
+        except:
+            print "Failed while processing: {0}".format(str(tr))
+    return films
+
+
+def get_people_todo(people):
+    """
+    Makes an Actor to scrape for each person referenced by a film
+    :param people: [{'id': str, 'DIRECTOR': boolean}] from get_all_film_people
+    :return: generator of (Actor, id_check for the actor SetQueues)
+    """
+    for p in people:
+        if p['DIRECTOR']:
+            yield Actor(p['id'], True), "director-{0}".format(p['id'])
+        else:
+            yield Actor(p['id'], False), p['id']
+
+
+def get_actor_key(actor):
+    """
+    Gets the key an actor is seen under in the actor SetQueues
+    :param actor: Actor
+    :return: string imdb_id (director-imdb_id for directors)
+    """
+    return "director-{0}".format(actor.id) if actor.DIRECTOR else actor.id
+
+
+def get_film_doc(film):
+    """
+    Gets what the frontier keeps of a film
+    :param film: Film
+    :return: {'mojo_year': string, 'fields': Film.export()}
+    """
+    return {'mojo_year': film.mojo_year, 'fields': film.export()}
+
+
+def make_film(doc):
+    """
+    Makes a film back from what the frontier kept
+    :param doc: from get_film_doc
+    :return: Film
+    """
+    film = Film('', '', doc['mojo_year'])
+    film.import_fields(doc['fields'])
+    return film
+
+
+def make_actor(doc):
+    """
+    Makes an actor back from what the frontier kept
+    :param doc: Actor.export()
+    :return: Actor
+    """
+    actor = Actor(doc['id'], doc['DIRECTOR'])
+    actor.import_fields(doc)
+    return actor
+
+
+# Frontier stages: (key of an item - the id_check it is put with, what is kept of it, how it is made back)
+FRONTIER_STAGES = {
+    'raw': (lambda film: film.mojo_id, get_film_doc, make_film),
+    'films': (lambda film: film.id, get_film_doc, make_film),
+    'actors': (get_actor_key, lambda actor: actor.export(), make_actor),
+    'save_films': (lambda film: film.id, get_film_doc, make_film),
+    'save_actors': (get_actor_key, lambda actor: actor.export(), make_actor)
+}
+
+
+def get_start_pages(position):
+    """
+    Gets the Box Office Mojo page each letter starts from
+    :param position: {letter: next page (0 once done)} saved by an unfinished crawl
+    :return: [(letter, page)] for the letters not done yet
+    """
+    return [(letter, position.get(letter, 1)) for letter in LETTERS if position.get(letter, 1)]
+
+
+def format_queue_stats(q):
+    """
+    Formats how full a SetQueue is and has been
+    :param q: SetQueue
+    :return: string like 12/1000 +4 active (peak 1000, 3 waits)
+    """
+    stats = q.get_stats()
+    return "{0}/{1} +{2} active (peak {3}, {4} waits)".format(
+        stats['size'], stats['maxsize'] or 'unbounded', stats['active'], stats['high_water'], stats['waits'])
+
+
+def get_item_bytes(q):
+    """
+    Estimates the bytes held by an item waiting in a queue from the first MEMORY_SAMPLE_SIZE items
+    :param q: SetQueue
+    :return: int bytes (0 while the queue is empty)
+    """
+    return get_items_size(q.sample(MEMORY_SAMPLE_SIZE))
+
+
+def format_memory(queues):
+    """
+    Formats the resident memory and the estimated memory held by the items waiting in each queue
+    :param queues: [(queue name, SetQueue)]
+    :return: string like 312.5 MB resident, raw 1.2 KB x 40 ...
+    """
+    return "{0:.1f} MB resident, {1}".format(get_resident_bytes() / 1024.0 ** 2, " ".join(
+        "{0} {1:.1f} KB x {2}".format(name, get_item_bytes(q) / 1024.0, q.qsize()) for name, q in queues))
+
+
+def print_fetch_stats():
+    """
+    Prints connection reuse and request rate per host, fetches avoided and page cache hits
+    :return: Nothing
+    """
+    for host, stats in get_host_stats().items():
+        print "{0}: {1} requests {2} connections opened {3} reused {4:.1f}/s {5} throttled".format(
+            host, stats['requests'], stats['opened'], stats['reused'], stats['rate'], stats['throttled'])
+    print "fetches avoided for pages that already failed: {0}".format(avoided['fetches'])
+    if page_cache.cache:
+        print "page cache: {0} hits {1} misses".format(page_cache.cache.hits, page_cache.cache.misses)
+
+
+def add_queue_gauges(queues):
+    """
+    Registers the depth, items being worked and estimated memory of each queue as gauges
+    :param queues: {queue name: SetQueue}
+    :return: Nothing
+    """
+    for name, q in queues.items():
+        metrics.add_gauge('queue_depth', {'queue': name}, q.qsize)
+        metrics.add_gauge('queue_active', {'queue': name}, lambda q=q: q.get_stats()['active'])
+        metrics.add_gauge('queue_bytes', {'queue': name}, lambda q=q: get_item_bytes(q) * q.qsize())
+    metrics.add_gauge('process_resident_bytes', {}, get_resident_bytes)
+
+
+def main(mode=CRAWL_MODE):
+    # Parse processes fork before any thread is started
+    parse_pool.start_pool()
     print "Connecting to {0}...".format(MONGO_URL)
-    client = pymongo.MongoClient(MONGO_URL)
     print "Linking to the following data: {0}...".format(MONGO_DB)
-    db_conn = client[MONGO_DB]
-    # Seen films
-    seen_films = get_seen_db_films(db_conn)
-    seen_mojos = get_scraped_mojo_ids(db_conn)
-    seen_people = get_seen_db_actors(db_conn).union(get_seen_db_directors(db_conn))
+    # One pooled client for the startup queries and the writers
+    db_conn = get_db()
+    ensure_indexes(db_conn)
+    # Seen ids in the database, streamed off the indexes, each stored once and shared as the base of the queues'
+    # seen sets
+    seen_films = make_seen_set(get_seen_db_films(db_conn))
+    seen_mojos = make_seen_set(get_scraped_mojo_ids(db_conn))
+    seen_people = make_seen_set(chain(get_seen_db_actors(db_conn), get_seen_db_directors(db_conn)))
+    # Read while the crawl runs, people are put on actor_todo_q as the films are streamed
     add_to_people_q = get_all_film_people(db_conn)
+    # Saved films and actors are written in batches, shared by every save consumer
+    film_writer = BatchWriter(db_conn['films'], ['id'])
+    actor_writer = BatchWriter(db_conn['actors'], ['id', 'DIRECTOR'])
+    # Pending items and Box Office Mojo position, checkpointed so a restart resumes them
+    frontier = Frontier(db_conn['crawl_frontier'], FRONTIER_STAGES, [film_writer.flush, actor_writer.flush])
+    resumed, position = frontier.load()
+    if position or any(resumed.values()):
+        print "Resuming the last crawl: {0}".format(
+            " ".join("{0}={1}".format(stage, len(items)) for stage, items in resumed.items()))
+    # Items on or being worked by any stage, the crawl is over once it drains
+    in_flight = InFlight()
+    # Items a stage raised on go back on its queue a few times before they are kept as dead letters
+    retries = RetryQueue(DeadLetters(db_conn['dead_letters'], FRONTIER_STAGES))
     # Queue of Film objects with only a mojo_id, mojo_title and mojo_year
-    raw_mojo_q = SetQueue(starting_set=seen_mojos.copy())
+    raw_mojo_q = SetQueue(seen=seen_mojos, maxsize=QUEUE_CAPACITY, in_flight=in_flight, frontier=frontier,
+                          stage='raw', retries=retries)
     # Queue of Film objects with an imdb_id that need to be scraped
-    film_todo_q = SetQueue(starting_set=seen_films.copy())
+    film_todo_q = SetQueue(seen=make_seen_set(base=seen_films), maxsize=QUEUE_CAPACITY, in_flight=in_flight,
+                           frontier=frontier, stage='films', retries=retries)
     # Queue of Films to be saved
-    film_save_q = SetQueue(starting_set=seen_films.copy())
+    film_save_q = SetQueue(seen=make_seen_set(base=seen_films), maxsize=QUEUE_CAPACITY, in_flight=in_flight,
+                           frontier=frontier, stage='save_films', retries=retries)
     # Queue of Actors to be saved
-    actor_save_q = SetQueue(starting_set=seen_people.copy())
+    actor_save_q = SetQueue(seen=make_seen_set(base=seen_people), maxsize=QUEUE_CAPACITY, in_flight=in_flight,
+                            frontier=frontier, stage='save_actors', retries=retries)
     # Queue of Actor objects with an imdb_id that need to be scraped
-    actor_todo_q = SetQueue(starting_set=seen_people.copy())
-    for p in add_to_people_q:
-        if p['DIRECTOR']:
-            actor_todo_q.put(Actor(p['id'], True), "director-{0}".format(p['id']))
-        else:
-            actor_todo_q.put(Actor(p['id'], False), p['id'])
-    # Queue of finished Film objects
-    film_output_q = SetQueue(starting_set=seen_films.copy())
-    # Queue of finished Actor objects
-    actor_output_q = SetQueue(starting_set=seen_people.copy())
-    # Page letters
-    letters = ['NUM', 'A', 'B', 'C', 'D', 'E', 'F', 'G', 'H', 'I', 'J', 'K', 'L', 'M', 'N', 'O', 'P', 'Q', 'R', 'S',
-               'T', 'U', 'V', 'W', 'X', 'Y', 'Z']
+    actor_todo_q = SetQueue(seen=make_seen_set(base=seen_people), maxsize=QUEUE_CAPACITY, in_flight=in_flight,
+                            frontier=frontier, stage='actors', retries=retries)
+    # Where finished Film and Actor objects go, nothing keeps them in memory
+    film_output = make_output_sink('films')
+    actor_output = make_output_sink('actors')
+    add_queue_gauges({'raw': raw_mojo_q, 'films': film_todo_q, 'actors': actor_todo_q, 'save_films': film_save_q,
+                      'save_actors': actor_save_q})
+    metrics.add_gauge('queue_depth', {'queue': 'retries'}, retries.qsize)
+    metrics.start()
 
     def start_consumers():
         """
-        Starts each consumer
-        :return: array of running consumers
+        Starts a pool of consumers for each stage
+        :return: array of running ConsumerPools
+        """
+        stages = [('save_actor', actor_save_q, lambda: SaveActorConsumer(actor_save_q, actor_output, actor_writer)),
+                  ('save_film', film_save_q, lambda: SaveFilmConsumer(film_save_q, film_output, film_writer))]
+        # The crawl engine does the scraping stages itself in concurrent mode
+        if mode != 'concurrent':
+            stages = [('find', raw_mojo_q, lambda: FindIMDbConsumer(raw_mojo_q, film_todo_q)),
+                      ('scrape', film_todo_q, lambda: ScrapeIMDbConsumer(film_todo_q, film_save_q, actor_todo_q)),
+                      ('actor', actor_todo_q, lambda: ActorConsumer(actor_todo_q, actor_save_q))] + stages
+        pools = []
+        for name, input_q, make_consumer in stages:
+            min_workers, max_workers = CONSUMER_WORKERS[name]
+            pool = ConsumerPool(name, input_q, make_consumer, min_workers, max_workers)
+            pool.start()
+            pools.append(pool)
+        return pools
+
+    def add_people():
         """
-        cs = [FindIMDbConsumer(raw_mojo_q, film_todo_q), ScrapeIMDbConsumer(film_todo_q, film_save_q, actor_todo_q),
-              ActorConsumer(actor_todo_q, actor_save_q), SaveActorConsumer(actor_save_q, actor_output_q),
-              SaveFilmConsumer(film_save_q, film_output_q)]
-        for c in cs:
-            c.start()
-        return cs
-
-    consumers = start_consumers()
-    for letter in letters:
-        page = 1
-        table = get_bom_movies(letter, str(page))
-        while table:
-            print "Starting scrape of {0}{1}...".format(letter, str(page))
-            for tr in table:
-                try:
-                    tds = tr.find_all('td')
-                    if len(tds) < 7:
-                        continue
-                    # If revenue is not applicable
-                    if tds[2].text.strip() == 'n/a':
-                        continue
-                    title = tds[0].text.strip()
-                    mojo_id = tds[0].find('a')['href'].replace('/movies/?id=', '').replace('.htm', '')
-                    mojo_year = str(datetime.strptime(tds[6].text.strip(), "%m/%d/%Y").year)
-                    raw_mojo_q.put(Film(mojo_id, title, mojo_year), mojo_id)
-                except:
-                    print "Failed while processing: {0}".format(str(tr))
-            if letter == 'NUM':
-                break
-            # Get the next page of films
-            page += 1
-            table = get_bom_movies(letter, str(page))
-
-    while not (raw_mojo_q.empty() and film_todo_q.empty() and actor_todo_q.empty() and actor_save_q.empty() and film_save_q.empty()):
-        print "raw: {0} films: {1} actors: {2} save_films: {3} save_actors: {4}".format(
-            raw_mojo_q.qsize(), film_todo_q.qsize(), actor_todo_q.qsize(), film_save_q.qsize(), actor_save_q.qsize())
-        sleep(5)
+        Adds the people referenced by films from earlier crawls, waiting for room in actor_todo_q
+        :return: Nothing
+        """
+        try:
+            for actor, id_check in get_people_todo(add_to_people_q):
+                actor_todo_q.put(actor, id_check)
+        except Exception as e:
+            # The next crawl streams every film's people again
+            print "{0}Stopped adding the people of earlier films: {1}{2}".format(FAIL, repr(e), ENDC)
+
+    def replay(stages):
+        """
+        Puts the items the last crawl left on some stages back on their queues
+        :param stages: [(stage name, SetQueue)]
+        :return: Nothing
+        """
+        for stage, q in stages:
+            for item in resumed[stage]:
+                q.put(item, FRONTIER_STAGES[stage][0](item))
+
+    film_writer.start()
+    actor_writer.start()
+    pools = start_consumers()
+    retries.start()
+    frontier.start()
+    try:
+        replay([('save_films', film_save_q), ('save_actors', actor_save_q)])
+        if mode == 'concurrent':
+            from crawl_concurrent import crawl
+            crawl(get_start_pages(position), get_people_todo(add_to_people_q), raw_mojo_q, film_todo_q, actor_todo_q,
+                  film_save_q, actor_save_q, frontier, resumed, retries)
+        else:
+            replay([('actors', actor_todo_q), ('films', film_todo_q), ('raw', raw_mojo_q)])
+            # Started after the consumers so a full actor_todo_q is drained while people are added
+            people_thread = Thread(target=add_people)
+            people_thread.daemon = True
+            people_thread.start()
+            for letter, page in get_start_pages(position):
+                table = get_bom_movies(letter, str(page))
+                while table:
+                    print "Starting scrape of {0}{1}...".format(letter, str(page))
+                    for film in get_bom_films(table):
+                        raw_mojo_q.put(film, film.mojo_id)
+                    if letter == 'NUM':
+                        break
+                    # Get the next page of films
+                    page += 1
+                    frontier.set_position(letter, page)
+                    table = get_bom_movies(letter, str(page))
+                frontier.set_position(letter, 0)
+            people_thread.join()
+        # Returns as soon as every item put has been finished by its stage, printing the status every 5 seconds
+        while not in_flight.join(5):
+            print "raw: {0} films: {1} actors: {2} save_films: {3} save_actors: {4}".format(
+                *[format_queue_stats(q) for q in [raw_mojo_q, film_todo_q, actor_todo_q, film_save_q, actor_save_q]])
+            print "workers: {0}".format(" ".join("{0}={1}".format(p.name, p.size()) for p in pools))
+            print "retries: {0} waiting, {1} retried, {2} given up on".format(
+                retries.qsize(), retries.retried, retries.dead)
+            print "memory: {0}".format(format_memory([('raw', raw_mojo_q), ('films', film_todo_q), (
+                'actors', actor_todo_q), ('save_films', film_save_q), ('save_actors', actor_save_q)]))
+            print_fetch_stats()
+    except KeyboardInterrupt:
+        # Whatever finished since the last checkpoint isn't redone by the next crawl, items waiting for a retry are
+        # still on the frontier
+        retries.stop()
+        frontier.stop()
+        frontier.checkpoint()
+        raise
+    print "All stages drained, shutting down..."
+    for pool in pools:
+        pool.stop()
+    retries.stop()
+    if retries.dead:
+        print "{0}{1} items given up on are kept in dead_letters, run_replay_dead_letters.py crawls them " \
+              "again{2}".format(WARNING, retries.dead, ENDC)
+    # Written after the consumers stop so nothing is added after the last flush
+    saved = True
+    for writer in [film_writer, actor_writer]:
+        saved = writer.close() and saved
+        print "{0}: {1} documents saved, {2} failed, {3} couldn't be written".format(
+            writer.collection.name, writer.written, writer.failed, writer.pending())
+    for name, sink in [('films', film_output), ('actors', actor_output)]:
+        sink.close()
+        print "{0}: {1} handed to the {2} output".format(name, sink.count, OUTPUT_SINK)
+    if saved:
+        # Nothing is left to resume, the next crawl starts over
+        frontier.clear()
+    else:
+        # The last checkpoint still has the items whose saves weren't written
+        frontier.stop()
+        print "{0}Some documents couldn't be saved, the next crawl resumes them from the frontier{1}".format(
+            WARNING, ENDC)
+    parse_pool.stop_pool()
+    metrics.stop()
+    if METRICS_SNAPSHOT_FILE:
+        # The last snapshot covers the whole crawl, however short
+        metrics.write_snapshot(METRICS_SNAPSHOT_FILE, None)
+    if OUTPUT_SINK == 'aggregate' and (film_output.count or actor_output.count):
+        # The saved films and actors are aggregated straight from MongoDB
+        from aggregate_data import main as aggregate
+        print "Aggregating the crawled films..."
+        aggregate()
+
+
+def replay_dead_letters(mode=CRAWL_MODE):
+    """
+    Crawls the items kept as dead letters again - they are moved to the frontier and resumed on the stage that gave up
+    on them (without going through Box Office Mojo again unless the last crawl was unfinished)
+    :param mode: crawl mode, as for main
+    :return: Nothing
+    """
+    # Parse processes fork before the client starts its monitor threads (main uses this pool)
+    parse_pool.start_pool()
+    try:
+        db_conn = get_db()
+        dead_letters = DeadLetters(db_conn['dead_letters'], FRONTIER_STAGES)
+        if not dead_letters.count():
+            print "No dead letters to replay"
+            return
+        frontier = Frontier(db_conn['crawl_frontier'], FRONTIER_STAGES)
+        resumed, position = frontier.load()
+        if not position and not any(resumed.values()):
+            # The last crawl finished, every letter is done
+            for letter in LETTERS:
+                frontier.set_position(letter, 0)
+        print "Replaying {0} dead letters...".format(dead_letters.replay(frontier))
+        main(mode)
+    finally:
+        parse_pool.stop_pool()
@@ -0,0 +1,216 @@
+""" Concurrent crawl - the collect_data stages as CrawlEngine callbacks so hundreds of pages are fetched at once """
+from threading import Lock
+from traceback import format_exc
+from Actor import Actor
+from collect_data import get_bom_url, parse_bom_movies, get_bom_films, print_fetch_stats, get_actor_key
+from CrawlEngine import CrawlEngine
+import parse_pool
+from config.GLOBALS import CRAWL_FETCHERS, CRAWL_PARSERS, CRAWL_HOST_CONCURRENCY, QUEUE_CAPACITY
+from utils import metrics
+from utils.fetch import raise_fetch_error
+from utils.print_colors import OKGREEN, ENDC
+
+
+class EngineStage(object):
+    """ Stands in for a stage's SetQueue to the RetryQueue - an item it failed on is handed to the engine again """
+
+    def __init__(self, stage, engine, frontier, retries, submit):
+        # Frontier stage name, engine the item's pages are fetched on, Frontier and RetryQueue of the crawl
+        self.stage = stage
+        self.engine = engine
+        self.frontier = frontier
+        self.retries = retries
+        # Function taking an item and submitting its fetches
+        self.submit = submit
+
+    def fail(self, item, error, trace):
+        """
+        Schedules another try of an item a callback raised on (the engine waits for it)
+        :param item: Film or Actor
+        :param error: the exception
+        :param trace: formatted traceback of the exception
+        :mutate engine: holds a pending task until the item is retried or given up on
+        :return: Nothing
+        """
+        metrics.inc('stage_errors_total', {'stage': self.stage})
+        self.engine.hold()
+        self.retries.add(self, item, error, trace)
+
+    def retry(self, item):
+        """
+        Submits an item's fetches again
+        :param item: Film or Actor
+        :return: Nothing
+        """
+        self.submit(item)
+        self.engine.task_done()
+
+    def done(self, item):
+        """
+        Forgets an item the stage finished
+        :param item: Film or Actor
+        :mutate frontier: forgets the item
+        :return: Nothing
+        """
+        self.frontier.remove(self.stage, item)
+        self.retries.forget(item)
+
+    def forget(self, item):
+        """
+        Forgets an item given up on (the RetryQueue kept it as a dead letter)
+        :param item: Film or Actor
+        :mutate frontier: forgets the item
+        :return: Nothing
+        """
+        self.frontier.remove(self.stage, item)
+        self.engine.task_done()
+
+
+def crawl(start_pages, people, raw_mojo_q, film_todo_q, actor_todo_q, film_save_q, actor_save_q, frontier, resumed,
+          retries):
+    """
+    Scrapes every Box Office Mojo letter, the films on it and their actors, all fetched concurrently
+    :param start_pages: [(letter, page)] Box Office Mojo page each letter starts from
+    :param people: (Actor, id_check) for the people referenced by films from earlier crawls
+    :param raw_mojo_q: SetQueue whose seen set holds the mojo_ids already found
+    :param film_todo_q: SetQueue whose seen set holds the film ids already scraped
+    :param actor_todo_q: SetQueue whose seen set holds the people already scraped
+    :param film_save_q: SetQueue finished Films are put on
+    :param actor_save_q: SetQueue finished Actors are put on
+    :param frontier: Frontier recording the films and actors being worked and the page of each letter
+    :param resumed: {'raw': [Film], 'films': [Film], 'actors': [Actor]} left by the last crawl
+    :param retries: RetryQueue retrying the films and actors a callback raised on
+    :return: Nothing
+    """
+    # A parse thread waits on the parse process its page is handed to, one per process keeps them all busy
+    engine = CrawlEngine(CRAWL_FETCHERS, max(CRAWL_PARSERS, parse_pool.size), CRAWL_HOST_CONCURRENCY, QUEUE_CAPACITY)
+    metrics.add_gauge('queue_depth', {'queue': 'fetches'}, lambda: engine.qsize()[0])
+    metrics.add_gauge('queue_depth', {'queue': 'pages'}, lambda: engine.qsize()[1])
+
+    def attempt(stage, item, work, *args):
+        # A failed item is retried (then dead-lettered) instead of dropped, it stays on the frontier meanwhile
+        try:
+            work(*args)
+        except Exception as e:
+            stages[stage].fail(item, e, format_exc())
+        else:
+            stages[stage].done(item)
+
+    # Stage work raises when a page's fetch raised (network errors) so attempt retries the item, a page the host
+    # answered with an error marks it FAILED as in the threads mode
+    def finish_actor(actor, page):
+        raise_fetch_error(page)
+        if parse_pool.pool:
+            parse_pool.scrape_actor(actor, page)
+        else:
+            actor.set_imdb_page(page)
+            actor.set_non_aggregate_fields()
+        if actor.DIRECTOR:
+            actor_save_q.put(actor, "director-{0}".format(actor.id))
+        else:
+            actor_save_q.put(actor, actor.id)
+
+    def on_actor_page(actor):
+        def callback(page):
+            attempt('actors', actor, finish_actor, actor, page)
+        return callback
+
+    def submit_actor(actor):
+        engine.submit(actor.get_imdb_url(), on_actor_page(actor))
+
+    def scrape_actor(actor, id_check):
+        if actor_todo_q.claim(actor, id_check):
+            frontier.add('actors', actor)
+            submit_actor(actor)
+
+    def finish_film(film, pages):
+        raise_fetch_error(*pages.values())
+        if parse_pool.pool:
+            parse_pool.scrape_film(film, pages)
+        else:
+            film.set_pages(pages)
+            film.set_non_aggregate_fields()
+        film_save_q.put(film, film.id)
+        for a in film.get_actors():
+            scrape_actor(Actor(a, False), a)
+        scrape_actor(Actor(film.director, True), "director-{0}".format(film.director))
+
+    def scrape_film(film):
+        # The three pages of a film are fetched at once, the last one to arrive finishes the film
+        pages = dict()
+        pages_lock = Lock()
+        urls = film.get_page_urls()
+
+        def on_page(name):
+            def callback(page):
+                with pages_lock:
+                    pages[name] = page
+                    done = len(pages) == len(urls)
+                if done:
+                    attempt('films', film, finish_film, film, pages)
+            return callback
+
+        for name, url in urls.items():
+            engine.submit(url, on_page(name))
+
+    def search_film(film, results):
+        # Sets imdb_id and returns the result ('' if not found)
+        raise_fetch_error(results)
+        if film.set_imdb_id(results) and film_todo_q.claim(film, film.id):
+            frontier.add('films', film)
+            scrape_film(film)
+
+    def on_search_page(film):
+        def callback(results):
+            attempt('raw', film, search_film, film, results)
+        return callback
+
+    def submit_search(film):
+        engine.submit(film.get_imdb_search_url(), on_search_page(film))
+
+    def find_film(film):
+        if raw_mojo_q.claim(film, film.mojo_id):
+            frontier.add('raw', film)
+            submit_search(film)
+
+    def on_bom_page(letter, page):
+        def callback(res):
+            table = parse_bom_movies(res)
+            if not table:
+                frontier.set_position(letter, 0)
+                return
+            print "Starting scrape of {0}{1}...".format(letter, str(page))
+            for film in get_bom_films(table):
+                find_film(film)
+            # Pages of a letter are only known to exist once the one before has films
+            if letter != 'NUM':
+                frontier.set_position(letter, page + 1)
+                engine.submit(get_bom_url(letter, str(page + 1)), on_bom_page(letter, page + 1))
+            else:
+                frontier.set_position(letter, 0)
+        return callback
+
+    stages = dict((stage, EngineStage(stage, engine, frontier, retries, submit)) for stage, submit in [
+        ('raw', submit_search), ('films', scrape_film), ('actors', submit_actor)])
+    engine.start()
+    # Work left by the last crawl and letters first so fetching starts while the people are still streamed from the
+    # database
+    for actor in resumed['actors']:
+        scrape_actor(actor, get_actor_key(actor))
+    for film in resumed['films']:
+        if film_todo_q.claim(film, film.id):
+            frontier.add('films', film)
+            scrape_film(film)
+    for film in resumed['raw']:
+        find_film(film)
+    for letter, page in start_pages:
+        engine.submit(get_bom_url(letter, str(page)), on_bom_page(letter, page))
+    for actor, id_check in people:
+        scrape_actor(actor, id_check)
+
+    while not engine.join(5):
+        fetches, parses = engine.qsize()
+        print "{0}fetches waiting: {1} pages waiting: {2} save_films: {3} save_actors: {4}{5}".format(
+            OKGREEN, fetches, parses, film_save_q.qsize(), actor_save_q.qsize(), ENDC)
+        print_fetch_stats()
+    engine.stop()
@@ -0,0 +1,51 @@
+""" Finds every tag Film reads from an IMDb title page in a single walk over the page """
+from bs4.element import Tag
+
+# field -> (tag name, attribute, value) of the first tag holding it (what the setters used to find one by one)
+TITLE_TAGS = {
+    'stars': ('span', 'itemprop', 'ratingValue'),
+    'metascore': ('div', 'class', 'metacriticScore'),
+    'num_votes': ('span', 'itemprop', 'ratingCount'),
+    'length': ('time', 'itemprop', 'duration'),
+    'mpaa': ('meta', 'itemprop', 'contentRating'),
+    'budget': ('div', 'id', 'titleDetails'),
+    'release_date': ('meta', 'itemprop', 'datePublished'),
+    'director': ('span', 'itemprop', 'director')
+}
+
+# tag name -> [(field, attribute, value)]
+TAGS_BY_NAME = dict()
+for field, (name, attribute, value) in TITLE_TAGS.items():
+    TAGS_BY_NAME.setdefault(name, []).append((field, attribute, value))
+
+
+def matches(tag, attribute, value):
+    """
+    Checks a tag attribute the way BeautifulSoup's find does
+    :param tag: bs4 Tag
+    :param attribute: attribute name
+    :param value: string the attribute must have (one of the classes for multi-valued attributes)
+    :return: Boolean
+    """
+    found = tag.get(attribute)
+    if isinstance(found, list):
+        return value in found or ' '.join(found) == value
+    return found == value
+
+
+def extract_title_tags(page):
+    """
+    Walks an IMDb title page once, stopping as soon as every field's tag is found
+    :param page: BS'd IMDb title page
+    :return: {field: first matching bs4 Tag} (fields without a tag are left out)
+    """
+    found = dict()
+    for tag in page.descendants:
+        if not isinstance(tag, Tag):
+            continue
+        for field, attribute, value in TAGS_BY_NAME.get(tag.name, []):
+            if field not in found and matches(tag, attribute, value):
+                found[field] = tag
+        if len(found) == len(TITLE_TAGS):
+            break
+    return found
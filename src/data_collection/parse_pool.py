@@ -0,0 +1,112 @@
+""" Process pool scraping fields out of fetched pages - only raw bytes and plain fields cross the process boundary """
+from multiprocessing import Pool, cpu_count
+from Actor import Actor
+from Film import Film
+from config.GLOBALS import PARSE_PROCESSES
+
+# Pool of parse processes, None while pages are parsed in the calling thread, and its number of processes (set by
+# start_pool)
+pool = None
+size = 0
+
+
+class RawPage(object):
+    """ A fetched page as shipped to a parse process - has the fields the setters read from a requests.Response """
+
+    def __init__(self, status_code, content):
+        self.status_code = status_code
+        self.content = content
+
+
+def get_raw_pages(pages):
+    """
+    Strips fetched responses down to what a parse process needs
+    :param pages: {name: requests.Response}
+    :return: {name: RawPage}
+    """
+    return dict((name, RawPage(page.status_code, page.content)) for name, page in pages.items())
+
+
+def scrape_film_fields(fields, mojo_year, pages):
+    """
+    Runs in a parse process - scrapes a film's non aggregate fields from its pages
+    :param fields: Film.export() of the film so far
+    :param mojo_year: year found on Box Office Mojo
+    :param pages: {'imdb': RawPage, 'mojo': RawPage, 'credits': RawPage}
+    :return: Film.export() of the scraped film
+    """
+    film = Film('', '', mojo_year)
+    film.import_fields(fields)
+    film.set_pages(pages)
+    film.set_non_aggregate_fields()
+    return film.export()
+
+
+def scrape_actor_fields(fields, page):
+    """
+    Runs in a parse process - scrapes an actor's non aggregate fields from their IMDb page
+    :param fields: Actor.export() of the actor so far
+    :param page: RawPage
+    :return: Actor.export() of the scraped actor
+    """
+    actor = Actor('', fields['DIRECTOR'])
+    actor.import_fields(fields)
+    actor.set_imdb_page(page)
+    actor.set_non_aggregate_fields()
+    return actor.export()
+
+
+def start_pool(processes=PARSE_PROCESSES):
+    """
+    Starts the parse processes - call before starting any threads (MongoClient's included) so the processes fork
+    from a single thread, does nothing if they are started already
+    :param processes: number of processes (None for one per core, 0 to parse in the calling thread)
+    :mutate pool: sets it
+    :mutate size: sets it
+    :return: Nothing
+    """
+    global pool, size
+    if processes != 0 and not pool:
+        size = processes or cpu_count()
+        pool = Pool(size)
+
+
+def stop_pool():
+    """
+    Lets the parse processes finish their work and waits for them to exit
+    :mutate pool: sets it back to None
+    :mutate size: sets it back to 0
+    :return: Nothing
+    """
+    global pool, size
+    if pool:
+        pool.close()
+        pool.join()
+        pool = None
+        size = 0
+
+
+def scrape_film(film, pages):
+    """
+    Scrapes a film's non aggregate fields from its fetched pages on the parse pool
+    :param film: Film with its id set
+    :param pages: {'imdb': response, 'mojo': response, 'credits': response}
+    :mutate film: imports the scraped fields (no pages are kept)
+    :return: Film
+    """
+    fields = pool.apply(scrape_film_fields, (film.export(), film.mojo_year, get_raw_pages(pages)))
+    film.import_fields(fields)
+    return film
+
+
+def scrape_actor(actor, page):
+    """
+    Scrapes an actor's non aggregate fields from their fetched IMDb page on the parse pool
+    :param actor: Actor with their id set
+    :param page: response for the IMDb page
+    :mutate actor: imports the scraped fields (no page is kept)
+    :return: Actor
+    """
+    fields = pool.apply(scrape_actor_fields, (actor.export(), RawPage(page.status_code, page.content)))
+    actor.import_fields(fields)
+    return actor
@@ -1,4 +1,6 @@
 
 if __name__ == '__main__':
+    import sys
     from utils.fix_revenues import main
-    main()
+    # Exits with 1 if some updates weren't saved
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,3 @@
+if __name__ == '__main__':
+    from data_collection.collect_data import replay_dead_letters
+    replay_dead_letters()
@@ -0,0 +1 @@
+""" Unit tests - run python -m unittest discover -b tests from src (MongoDB is stood in for by mongomock) """
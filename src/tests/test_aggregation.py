@@ -0,0 +1,147 @@
+""" Checks the object path over the FilmStore and the vectorized pass against plain Film and Actor objects """
+import datetime
+import random
+import unittest
+import mongomock
+from data_collection import aggregate_data
+from data_collection.Actor import Actor
+from data_collection.Film import Film
+from data_collection.aggregate_vectorized import AGGREGATE_FIELDS, compute_aggregates, get_aggregate_rows, \
+    compare_aggregates
+
+
+def make_docs(seed, num_films=120, num_actors=60, num_directors=15, repeats=10):
+    """
+    Makes random film and actor documents like the crawl saves
+    :param seed: random seed
+    :param num_films: films made
+    :param num_actors: actors made (directors are made on top, some of them act too)
+    :param num_directors: directors made
+    :param repeats: films saved a second time, with other values, under the same id
+    :return: ([film dict], [actor dict])
+    """
+    r = random.Random(seed)
+    film_ids = ['tt{0:05d}'.format(i) for i in range(num_films)]
+    actor_ids = ['nm{0:05d}'.format(i) for i in range(num_actors)]
+    director_ids = ['nm{0:05d}'.format(i) for i in range(num_actors - 5, num_actors + num_directors)]
+    films = []
+    for i, f_id in enumerate(film_ids):
+        film = {'id': f_id, 'FAILED': False, 'mojo_id': u'm{0}'.format(i), 'mojo_title': u'T{0}'.format(i),
+                'stars': r.choice([0, round(r.uniform(1, 10), 1)]), 'metascore': r.choice([0, r.randint(1, 100)]),
+                'num_votes': r.choice([0, r.randint(1, 2000000)]), 'revenue': r.choice([0, r.randint(1, 10 ** 9)]),
+                'director': r.choice(director_ids + ['']), 'actors': r.sample(actor_ids, r.randint(0, 6))}
+        # Some films have no release date, some the default one
+        if r.random() < 0.9:
+            film['release_date'] = r.choice([datetime.datetime(3000, 1, 1),
+                                             datetime.datetime(r.randint(1980, 2010), r.randint(1, 12),
+                                                               r.randint(1, 28))])
+        films.append(film)
+    for film in r.sample(films, repeats):
+        films.append(dict(film, revenue=r.randint(1, 10 ** 9), actors=film['actors'][:2]))
+    actors = []
+    for a_id in actor_ids:
+        # Films never scraped are in filmographies too
+        filmography = [f['id'] for f in films if a_id in f['actors'] and r.random() < 0.8]
+        filmography.extend('tt9{0:04d}'.format(r.randint(0, 50)) for i in range(r.randint(0, 3)))
+        actors.append({'id': a_id, 'FAILED': False, 'DIRECTOR': False, 'films': sorted(set(filmography)),
+                       'birthday': r.choice([None, datetime.datetime(r.randint(1900, 1980), 1, 1)])})
+    for d_id in director_ids:
+        filmography = [f['id'] for f in films if f['director'] == d_id and r.random() < 0.9]
+        actors.append({'id': d_id, 'FAILED': False, 'DIRECTOR': True, 'films': sorted(set(filmography)),
+                       'birthday': r.choice([None, datetime.datetime(r.randint(1900, 1980), 1, 1)])})
+    return films, actors
+
+
+def get_row(film):
+    """
+    Gets the aggregate fields a Film was given
+    :param film: a Film with set_aggregate_fields already called
+    :return: {field: value}
+    """
+    return dict((field, getattr(film, field)) for field in AGGREGATE_FIELDS)
+
+
+class Aggregates(object):
+    """ Aggregate fields of a film, read like a Film's by compare_aggregates """
+
+    def __init__(self, f_id, row):
+        self.id = f_id
+        self.__dict__.update(row)
+
+
+class TestAggregation(unittest.TestCase):
+
+    def setUp(self):
+        self.db = mongomock.MongoClient().db
+        films, actors = make_docs(7)
+        self.db['films'].insert_many(films)
+        self.db['actors'].insert_many(actors)
+        self.store = aggregate_data.import_store(self.db)
+
+    def tearDown(self):
+        Film.store = None
+        Actor.store = None
+        Film.all_films.clear()
+        Actor.all_actors.clear()
+
+    def get_object_path(self):
+        """
+        Aggregates every film as plain objects, without the store
+        :return: {film id: {field: value}}
+        """
+        aggregate_data.import_objects(self.db)
+        rows = dict()
+        for f_id, film in Film.all_films.items():
+            film.set_aggregate_fields()
+            rows[f_id] = get_row(film)
+        Film.all_films.clear()
+        Actor.all_actors.clear()
+        return rows
+
+    def assert_matches(self, rows, expected):
+        """
+        Checks aggregates against the object path's
+        :param rows: {film id: {field: value}}
+        :param expected: {film id: {field: value}} from get_object_path
+        :return: Nothing
+        """
+        self.assertEqual(sorted(rows), sorted(expected))
+        for f_id, row in rows.items():
+            self.assertEqual(compare_aggregates(Aggregates(f_id, expected[f_id]), row), [])
+
+    def test_store_objects_match_object_path(self):
+        expected = self.get_object_path()
+        Film.store = self.store
+        Actor.store = self.store
+        rows = dict()
+        for film in aggregate_data.import_films(self.db, self.store):
+            film.set_aggregate_fields()
+            rows[film.id] = get_row(film)
+        self.assert_matches(rows, expected)
+
+    def test_vectorized_matches_object_path(self):
+        expected = self.get_object_path()
+        self.assert_matches(get_aggregate_rows(compute_aggregates(self.store)), expected)
+
+    def test_verify_finds_no_mismatches(self):
+        rows = get_aggregate_rows(compute_aggregates(self.store))
+        self.assertEqual(aggregate_data.aggregate_verify(self.db, rows), 0)
+        self.assertEqual(self.db['films_agg'].count_documents({}), len(self.store.film_ids))
+
+    def test_verify_finds_a_wrong_aggregate(self):
+        rows = get_aggregate_rows(compute_aggregates(self.store))
+        row = rows[self.store.film_ids[0]]
+        row['director_number_of_films'] += 1
+        self.assertEqual(aggregate_data.aggregate_verify(self.db, rows), 1)
+
+    def test_store_keeps_last_document_of_an_id(self):
+        f_id = self.store.film_ids[0]
+        self.db['films'].insert_one(dict(self.db['films'].find_one({'id': f_id}, {'_id': False}), revenue=123))
+        store = aggregate_data.import_store(self.db)
+        self.assertEqual(store.stats['revenue'][store.get_film_row(f_id)], 123)
+        films = [f for f in aggregate_data.import_films(self.db, store) if f.id == f_id]
+        self.assertEqual([f.revenue for f in films], [123])
+
+
+if __name__ == '__main__':
+    unittest.main()
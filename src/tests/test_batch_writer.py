@@ -0,0 +1,98 @@
+""" Checks BatchWriter's batching, upserts and what it does with writes that fail """
+import threading
+import time
+import unittest
+import mongomock
+from pymongo.errors import AutoReconnect
+from data_collection import BatchWriter as batch_writer
+from data_collection.BatchWriter import BatchWriter
+
+
+class FlakyCollection(object):
+    """ Stands in for a collection whose bulk writes fail while failures is above 0 """
+
+    def __init__(self, collection, failures=0, delay=0):
+        self.collection = collection
+        self.name = collection.name
+        self.failures = failures
+        # Seconds a bulk write takes
+        self.delay = delay
+
+    def bulk_write(self, requests, ordered=True):
+        time.sleep(self.delay)
+        if self.failures:
+            self.failures -= 1
+            raise AutoReconnect('connection reset')
+        return self.collection.bulk_write(requests, ordered=ordered)
+
+
+class TestBatchWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.collection = mongomock.MongoClient().db['films']
+
+    def test_documents_are_written_in_batches(self):
+        writer = BatchWriter(self.collection, ['id'], batch_size=3, upsert=False)
+        for i in range(4):
+            writer.add({'id': i})
+        self.assertEqual(self.collection.count_documents({}), 3)
+        self.assertEqual(writer.pending(), 1)
+        self.assertTrue(writer.flush())
+        self.assertEqual((self.collection.count_documents({}), writer.written, writer.pending()), (4, 4, 0))
+
+    def test_upsert_replaces_a_document_with_the_same_keys(self):
+        writer = BatchWriter(self.collection, ['id'], upsert=True)
+        writer.add({'id': 1, 'revenue': 1})
+        writer.add({'id': 1, 'revenue': 2})
+        self.assertTrue(writer.flush())
+        self.assertEqual([d['revenue'] for d in self.collection.find({}, {'_id': False})], [2])
+
+    def test_duplicate_keys_are_dropped_for_good(self):
+        self.collection.create_index('id', unique=True)
+        writer = BatchWriter(self.collection, ['id'], upsert=False)
+        writer.add({'id': 1})
+        writer.add({'id': 1})
+        self.assertTrue(writer.flush())
+        self.assertEqual((writer.written, writer.failed, writer.pending()), (1, 1, 0))
+
+    def test_failed_writes_are_kept_and_retried(self):
+        writer = BatchWriter(FlakyCollection(self.collection, failures=1), ['id'], upsert=False)
+        writer.add({'id': 1})
+        self.assertFalse(writer.flush())
+        self.assertEqual(writer.pending(), 1)
+        # Not tried again before its retry is due
+        self.assertGreater(writer.retry_at, time.time())
+        self.assertFalse(writer.flush())
+        writer.retry_at = 0
+        self.assertTrue(writer.flush())
+        self.assertEqual((self.collection.count_documents({}), writer.failures, writer.pending()), (1, 0, 0))
+
+    def test_flush_waits_for_a_write_in_progress(self):
+        writer = BatchWriter(FlakyCollection(self.collection, failures=1, delay=0.2), ['id'], upsert=False)
+        writer.add({'id': 1})
+        thread = threading.Thread(target=writer.flush)
+        thread.start()
+        time.sleep(0.05)
+        # The other thread's write fails and puts the document back, so it isn't written yet
+        self.assertFalse(writer.flush())
+        thread.join()
+        self.assertEqual(writer.pending(), 1)
+
+    def test_close_reports_writes_left(self):
+        retries, delay = batch_writer.SAVE_CLOSE_RETRIES, batch_writer.SAVE_RETRY_DELAY
+        batch_writer.SAVE_CLOSE_RETRIES, batch_writer.SAVE_RETRY_DELAY = 1, 0.01
+        try:
+            writer = BatchWriter(FlakyCollection(self.collection, failures=5), ['id'], upsert=False)
+            writer.start()
+            writer.add({'id': 1})
+            self.assertFalse(writer.close())
+            self.assertEqual(writer.pending(), 1)
+            writer = BatchWriter(FlakyCollection(self.collection, failures=1), ['id'], upsert=False)
+            writer.add({'id': 2})
+            self.assertTrue(writer.close())
+        finally:
+            batch_writer.SAVE_CLOSE_RETRIES, batch_writer.SAVE_RETRY_DELAY = retries, delay
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+""" Checks that Frontier checkpoints only what the save stages wrote and puts back changes it couldn't write """
+import unittest
+import mongomock
+from pymongo.errors import AutoReconnect
+from data_collection.Frontier import Frontier
+
+STAGES = {'films': (lambda item: item, lambda item: {'id': item}, lambda doc: doc['id'])}
+
+
+class BrokenCollection(object):
+    """ Stands in for a collection that can't be written to """
+
+    def bulk_write(self, requests, ordered=True):
+        raise AutoReconnect('connection reset')
+
+
+class TestFrontier(unittest.TestCase):
+
+    def setUp(self):
+        self.collection = mongomock.MongoClient().db['crawl_frontier']
+        self.saved = [True]
+        self.frontier = Frontier(self.collection, STAGES, [lambda: self.saved[0]])
+
+    def test_checkpoint_writes_changes(self):
+        self.frontier.add('films', 'tt1')
+        self.frontier.add('films', 'tt2')
+        self.frontier.set_position('A', 3)
+        self.assertTrue(self.frontier.checkpoint())
+        self.frontier.remove('films', 'tt1')
+        self.assertTrue(self.frontier.checkpoint())
+        items, position = Frontier(self.collection, STAGES).load()
+        self.assertEqual((items, position), ({'films': ['tt2']}, {'A': 3}))
+
+    def test_unsaved_changes_are_put_back(self):
+        self.frontier.add('films', 'tt1')
+        self.assertTrue(self.frontier.checkpoint())
+        self.frontier.remove('films', 'tt1')
+        self.frontier.set_position('A', 2)
+        # A save that isn't written keeps the item on the frontier
+        self.saved[0] = False
+        self.assertFalse(self.frontier.checkpoint())
+        self.assertEqual(Frontier(self.collection, STAGES).load(), ({'films': ['tt1']}, {}))
+        self.saved[0] = True
+        self.assertTrue(self.frontier.checkpoint())
+        self.assertEqual(Frontier(self.collection, STAGES).load(), ({'films': []}, {'A': 2}))
+
+    def test_failed_write_is_put_back(self):
+        collection = self.frontier.collection
+        self.frontier.collection = BrokenCollection()
+        self.frontier.add('films', 'tt1')
+        self.assertFalse(self.frontier.checkpoint())
+        self.frontier.collection = collection
+        self.assertTrue(self.frontier.checkpoint())
+        self.assertEqual(Frontier(self.collection, STAGES).load()[0], {'films': ['tt1']})
+
+    def test_later_changes_win_over_restored_ones(self):
+        self.saved[0] = False
+        self.frontier.add('films', 'tt1')
+        self.frontier.set_position('A', 2)
+        self.assertFalse(self.frontier.checkpoint())
+        # Changed since the failed checkpoint, the restored changes don't undo it
+        self.frontier.remove('films', 'tt1')
+        self.frontier.set_position('A', 0)
+        self.saved[0] = True
+        self.assertTrue(self.frontier.checkpoint())
+        self.assertEqual(Frontier(self.collection, STAGES).load(), ({'films': []}, {'A': 0}))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+""" Checks RetryQueue's retries and DeadLetters keeping and replaying what it gave up on """
+import time
+import unittest
+import mongomock
+from data_collection.DeadLetters import DeadLetters
+from data_collection.Frontier import Frontier
+from data_collection.RetryQueue import RetryQueue
+
+STAGES = {'films': (lambda item: item['id'], lambda item: dict(item), lambda doc: dict(doc))}
+
+
+class Stage(object):
+    """ Stands in for a stage's SetQueue, recording what the RetryQueue hands back """
+
+    def __init__(self):
+        self.stage = 'films'
+        self.retried = []
+        self.forgotten = []
+
+    def retry(self, item):
+        self.retried.append(item)
+
+    def forget(self, item):
+        self.forgotten.append(item)
+
+
+def wait_for(check, timeout=5):
+    """
+    Waits until a check passes
+    :param check: function returning a Boolean
+    :param timeout: seconds to wait at most
+    :return: Boolean the last check
+    """
+    end = time.time() + timeout
+    while not check() and time.time() < end:
+        time.sleep(0.01)
+    return check()
+
+
+class TestRetryQueue(unittest.TestCase):
+
+    def setUp(self):
+        db = mongomock.MongoClient().db
+        self.dead_letters = DeadLetters(db['dead_letters'], STAGES)
+        self.frontier = Frontier(db['crawl_frontier'], STAGES)
+        self.retries = RetryQueue(self.dead_letters, max_attempts=3, delay=0.01, max_delay=0.02)
+        self.retries.start()
+
+    def tearDown(self):
+        self.retries.stop()
+
+    def test_delay_doubles_up_to_the_max(self):
+        retries = RetryQueue(delay=1.0, max_delay=5.0)
+        self.assertEqual([retries.get_delay(attempts) for attempts in range(1, 6)], [1.0, 2.0, 4.0, 5.0, 5.0])
+
+    def test_failed_item_is_retried(self):
+        stage = Stage()
+        item = {'id': 'tt1'}
+        self.retries.add(stage, item, ValueError('broken'), '')
+        self.assertTrue(wait_for(lambda: stage.retried == [item]))
+        self.assertEqual(stage.forgotten, [])
+        self.assertEqual(self.retries.attempts[id(item)], (item, 1))
+        # Finishing the item forgets its failures
+        self.retries.forget(item)
+        self.assertEqual(self.retries.attempts, {})
+
+    def test_item_is_dead_lettered_after_max_attempts(self):
+        stage = Stage()
+        item = {'id': 'tt1'}
+        for attempt in range(3):
+            self.retries.add(stage, item, ValueError('broken'), 'trace')
+        self.assertTrue(wait_for(lambda: len(stage.retried) == 2))
+        self.assertEqual(stage.forgotten, [item])
+        self.assertEqual(self.dead_letters.count(), 1)
+        doc = self.dead_letters.collection.find_one({'_id': 'films:tt1'})
+        self.assertEqual((doc['stage'], doc['item'], doc['attempts'], doc['traceback']),
+                         ('films', {'id': 'tt1'}, 3, 'trace'))
+        self.assertEqual(self.retries.attempts, {})
+
+    def test_replay_moves_dead_letters_to_the_frontier(self):
+        self.dead_letters.add('films', {'id': 'tt1'}, ValueError('broken'), '', 3)
+        self.assertEqual(self.dead_letters.replay(self.frontier), 1)
+        self.assertEqual(self.dead_letters.count(), 0)
+        items, position = self.frontier.load()
+        self.assertEqual(items['films'], [{'id': 'tt1'}])
+
+    def test_replay_keeps_dead_letters_if_the_checkpoint_fails(self):
+        self.frontier.flushes = [lambda: False]
+        self.dead_letters.add('films', {'id': 'tt1'}, ValueError('broken'), '', 3)
+        self.dead_letters.replay(self.frontier)
+        self.assertEqual(self.dead_letters.count(), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
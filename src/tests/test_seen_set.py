@@ -0,0 +1,55 @@
+""" Checks every seen set backend, alone and layered over a shared base """
+import unittest
+from data_collection.SeenSet import make_seen_set
+
+BACKENDS = ['exact', 'hashed', 'bloom']
+
+
+class TestSeenSet(unittest.TestCase):
+
+    def test_add_if_absent_adds_once(self):
+        for backend in BACKENDS:
+            seen = make_seen_set(['tt1'], backend=backend)
+            self.assertIn('tt1', seen)
+            self.assertFalse(seen.add_if_absent('tt1'), backend)
+            self.assertTrue(seen.add_if_absent('tt2'), backend)
+            self.assertFalse(seen.add_if_absent('tt2'), backend)
+            self.assertEqual(len(seen), 2, backend)
+
+    def test_unicode_and_str_keys_are_the_same(self):
+        for backend in BACKENDS:
+            seen = make_seen_set(backend=backend)
+            seen.add(u'nm\xe9')
+            self.assertIn(u'nm\xe9'.encode('utf-8'), seen, backend)
+            self.assertFalse(seen.add_if_absent(u'nm\xe9'), backend)
+
+    def test_discard_forgets_a_key(self):
+        for backend in BACKENDS:
+            seen = make_seen_set(['tt1', 'tt2'], backend=backend)
+            seen.discard('tt1')
+            self.assertNotIn('tt1', seen, backend)
+            self.assertIn('tt2', seen, backend)
+            self.assertTrue(seen.add_if_absent('tt1'), backend)
+
+    def test_never_added_keys_are_not_seen(self):
+        for backend in BACKENDS:
+            seen = make_seen_set(['nm{0}'.format(i) for i in range(1000)], backend=backend)
+            self.assertFalse(any('tt{0}'.format(i) in seen for i in range(1000)), backend)
+
+    def test_base_keys_are_seen_and_stay_seen(self):
+        for backend in BACKENDS:
+            base = make_seen_set(['tt1'], backend=backend)
+            seen = make_seen_set(['tt2'], base=base, backend=backend)
+            self.assertIn('tt1', seen, backend)
+            self.assertFalse(seen.add_if_absent('tt1'), backend)
+            seen.discard('tt1')
+            self.assertIn('tt1', seen, backend)
+            self.assertEqual(len(seen), 2, backend)
+            self.assertEqual(len(list(seen)), 2, backend)
+            # Keys added on top don't reach the base
+            self.assertTrue(seen.add_if_absent('tt3'))
+            self.assertNotIn('tt3', base, backend)
+
+
+if __name__ == '__main__':
+    unittest.main()
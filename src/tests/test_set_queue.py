@@ -0,0 +1,92 @@
+""" Checks SetQueue's de-duplication, backpressure and the in-flight, frontier and retry bookkeeping """
+import unittest
+import mongomock
+from Queue import Full
+from data_collection.Frontier import Frontier
+from data_collection.InFlight import InFlight
+from data_collection.RetryQueue import RetryQueue
+from data_collection.SetQueue import SetQueue
+
+STAGES = {'films': (lambda item: item, lambda item: {'id': item}, lambda doc: doc['id'])}
+
+
+class TestSetQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.in_flight = InFlight()
+        self.frontier = Frontier(mongomock.MongoClient().db['crawl_frontier'], STAGES)
+
+    def make_queue(self, maxsize=0, retries=None):
+        return SetQueue(maxsize=maxsize, in_flight=self.in_flight, frontier=self.frontier, stage='films',
+                        retries=retries)
+
+    def test_items_are_put_once(self):
+        q = self.make_queue()
+        q.put('tt1')
+        q.put('tt1')
+        q.put('other', 'tt1')
+        self.assertEqual(q.qsize(), 1)
+        self.assertEqual(self.in_flight.count, 1)
+        self.assertEqual(list(self.frontier.added), ['films:tt1'])
+
+    def test_claim_marks_without_queueing(self):
+        q = self.make_queue()
+        self.assertTrue(q.claim('tt1'))
+        self.assertFalse(q.claim('tt1'))
+        q.put('tt1')
+        self.assertTrue(q.empty())
+
+    def test_full_put_unmarks_the_item(self):
+        q = self.make_queue(maxsize=1)
+        q.put('tt1')
+        self.assertRaises(Full, q.put, 'tt2', block=False)
+        self.assertRaises(Full, q.put, 'tt2', timeout=0.01)
+        self.assertFalse(q.is_seen('tt2'))
+        self.assertEqual(self.in_flight.count, 1)
+        self.assertNotIn('films:tt2', self.frontier.added)
+        self.assertEqual(q.get_stats()['waits'], 1)
+        # Once there is room the item can be put again
+        q.get()
+        q.task_done('tt1')
+        q.put('tt2', block=False)
+        self.assertEqual(q.get(), 'tt2')
+
+    def test_task_done_forgets_the_item(self):
+        q = self.make_queue()
+        q.put('tt1')
+        q.task_done(q.get())
+        self.assertEqual(self.in_flight.count, 0)
+        self.assertTrue(self.in_flight.join(0))
+        self.assertNotIn('films:tt1', self.frontier.added)
+        self.assertIn('films:tt1', self.frontier.removed)
+        # Still seen, a finished item isn't put again
+        q.put('tt1')
+        self.assertTrue(q.empty())
+
+    def test_failed_item_is_put_back(self):
+        retries = RetryQueue(delay=0.01)
+        retries.start()
+        try:
+            q = self.make_queue(retries=retries)
+            q.put('tt1')
+            q.task_failed(q.get(), ValueError('broken'), '')
+            # Waiting for its retry the item stays in flight and on the frontier
+            self.assertEqual(self.in_flight.count, 1)
+            self.assertIn('films:tt1', self.frontier.added)
+            self.assertEqual(q.get(timeout=5), 'tt1')
+            q.task_done('tt1')
+            self.assertEqual(self.in_flight.count, 0)
+            self.assertEqual(retries.attempts, {})
+        finally:
+            retries.stop()
+
+    def test_failed_item_without_retries_is_dropped(self):
+        q = self.make_queue()
+        q.put('tt1')
+        q.task_failed(q.get(), ValueError('broken'), '')
+        self.assertEqual(self.in_flight.count, 0)
+        self.assertTrue(q.empty())
+
+
+if __name__ == '__main__':
+    unittest.main()
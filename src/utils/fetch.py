@@ -0,0 +1,229 @@
+""" Shared HTTP layer for every scraper - one keep-alive session with a connection pool per host """
+import requests
+import sys
+import time
+from collections import OrderedDict
+from requests.adapters import HTTPAdapter
+from threading import Thread, Lock
+from urlparse import urlparse
+from utils import metrics, page_cache
+from utils.print_colors import WARNING, ENDC
+from utils.rate_limit import THROTTLE_CODES, get_bucket, get_retry_after, buckets
+from config.GLOBALS import HTTP_POOL_HOSTS, HTTP_POOL_SIZE, HTTP_TIMEOUT, HTTP_MAX_RETRIES, HTTP_FAILURE_TTL, \
+    HTTP_FAILURE_MAX, CRAWL_HOST_CONCURRENCY
+
+# Headers sent with every request (bodies are decompressed by requests)
+HEADERS = {'Accept-Encoding': 'gzip, deflate', 'Connection': 'keep-alive'}
+
+# Process wide session, created on first use
+session = None
+session_lock = Lock()
+
+
+# url -> (time, FailedResponse) for pages the host answered with a client error, oldest failure first
+failed_pages = OrderedDict()
+failed_lock = Lock()
+# Fetches skipped because the page already failed for the same object or url
+avoided = {'fetches': 0}
+
+
+class FailedResponse(object):
+    """ Stands in for the response of a fetch that raised (or failed before) so callers handle it like an HTTP error """
+    content = ''
+
+    def __init__(self, url, error, status_code=599):
+        self.url = url
+        self.error = error
+        self.status_code = status_code
+
+
+def raise_fetch_error(*responses):
+    """
+    Re-raises the exception a fetch stood in for, so the item it was for is retried like one whose fetch raised
+    in place (responses the host gave, client errors included, are left to the caller)
+    :param responses: requests.Response or FailedResponse
+    :exception: the exception of the first FailedResponse made from one
+    :return: Nothing
+    """
+    for response in responses:
+        if isinstance(response, FailedResponse) and isinstance(response.error, Exception):
+            raise response.error
+
+
+def count_avoided():
+    """
+    Counts a fetch skipped because its page already failed
+    :mutate avoided: adds one
+    :return: Nothing
+    """
+    with failed_lock:
+        avoided['fetches'] += 1
+
+
+def get_failed(url):
+    """
+    Gets the remembered failure of a url
+    :param url: page to get
+    :mutate failed_pages: forgets failures older than HTTP_FAILURE_TTL
+    :return: FailedResponse or None if the url hasn't failed recently
+    """
+    with failed_lock:
+        if url not in failed_pages:
+            return None
+        failed_at, response = failed_pages[url]
+        if time.time() - failed_at > HTTP_FAILURE_TTL:
+            del failed_pages[url]
+            return None
+        avoided['fetches'] += 1
+        return response
+
+
+def remember_failure(url, response):
+    """
+    Remembers a url the host answered with a client error (throttling is not remembered, it is retried)
+    :param url: page to get
+    :param response: requests.Response
+    :mutate failed_pages: adds the url, forgets failures older than HTTP_FAILURE_TTL and the oldest past
+    HTTP_FAILURE_MAX
+    :return: Nothing
+    """
+    if 400 <= response.status_code < 500 and response.status_code not in THROTTLE_CODES:
+        now = time.time()
+        with failed_lock:
+            # Re-added at the end so the dict stays in failure order and expired urls are at its start
+            failed_pages.pop(url, None)
+            failed_pages[url] = (now, FailedResponse(url, 'failed before', response.status_code))
+            while failed_pages and (len(failed_pages) > HTTP_FAILURE_MAX or
+                                    now - next(failed_pages.itervalues())[0] > HTTP_FAILURE_TTL):
+                failed_pages.popitem(last=False)
+
+
+def get_session():
+    """
+    Gets the shared session, creating it if needed
+    :mutate session: creates it on first call
+    :return: requests.Session
+    """
+    global session
+    with session_lock:
+        if not session:
+            s = requests.Session()
+            s.headers.update(HEADERS)
+            # One pool per host, each holding enough idle keep-alive connections for every fetch running on it
+            adapter = HTTPAdapter(pool_connections=HTTP_POOL_HOSTS,
+                                  pool_maxsize=max(HTTP_POOL_SIZE, CRAWL_HOST_CONCURRENCY))
+            s.mount('http://', adapter)
+            s.mount('https://', adapter)
+            session = s
+    return session
+
+
+def get_limited(url, timeout):
+    """
+    Gets a page through the shared session at the rate its host allows, retrying while the host throttles it
+    :param url: page to get
+    :param timeout: (connect, read) timeout in seconds
+    :return: requests.Response (still throttled after HTTP_MAX_RETRIES retries)
+    """
+    bucket = get_bucket(urlparse(url).hostname)
+    attempt = 0
+    while True:
+        bucket.acquire()
+        start = time.time()
+        try:
+            response = get_session().get(url, timeout=timeout)
+        except Exception:
+            bucket.on_response(None, time.time() - start)
+            raise
+        if response.status_code not in THROTTLE_CODES:
+            bucket.on_response(response.status_code, time.time() - start)
+            return response
+        wait = bucket.on_throttle(get_retry_after(response), attempt)
+        if attempt >= HTTP_MAX_RETRIES:
+            return response
+        attempt += 1
+        print "{0}{1} throttled {2} ({3}), retry {4} in {5:.1f}s{6}".format(
+            WARNING, bucket.host, url, response.status_code, attempt, wait, ENDC)
+
+
+def fetch(url, timeout=HTTP_TIMEOUT):
+    """
+    Gets a page from the page cache or through the shared session
+    :param url: page to get
+    :param timeout: (connect, read) timeout in seconds
+    :return: requests.Response (page_cache.CachedResponse if it was cached, FailedResponse if it failed recently)
+    """
+    failed = get_failed(url)
+    if failed is not None:
+        return failed
+    if page_cache.cache:
+        cached = page_cache.cache.get(url)
+        if cached is not None:
+            return cached
+    host = urlparse(url).hostname
+    start = time.time()
+    code = 'error'
+    try:
+        response = get_limited(url, timeout)
+        code = response.status_code
+    finally:
+        metrics.observe('fetch_seconds', {'host': host}, time.time() - start)
+        metrics.inc('fetch_responses_total', {'host': host, 'code': code})
+    metrics.inc('fetch_bytes_total', {'host': host}, len(response.content))
+    remember_failure(url, response)
+    # Error pages aren't cached so they are tried again next time
+    if page_cache.cache and response.status_code < 400:
+        page_cache.cache.put(url, response)
+    return response
+
+
+def fetch_all(urls, timeout=HTTP_TIMEOUT):
+    """
+    Gets independent pages at once - one thread per page past the first, so the wait is the slowest page's
+    :param urls: {name: url}
+    :param timeout: (connect, read) timeout in seconds
+    :exception: the first exception a fetch raised, once every fetch is over
+    :return: {name: response as returned by fetch}
+    """
+    responses = dict()
+    errors = []
+
+    def fetch_one(name, url):
+        try:
+            responses[name] = fetch(url, timeout)
+        except Exception:
+            errors.append(sys.exc_info())
+
+    items = urls.items()
+    threads = [Thread(target=fetch_one, args=item) for item in items[1:]]
+    for t in threads:
+        t.start()
+    if items:
+        fetch_one(*items[0])
+    for t in threads:
+        t.join()
+    if errors:
+        raise errors[0][0], errors[0][1], errors[0][2]
+    return responses
+
+
+def get_host_stats():
+    """
+    Gets how many connections were opened and reused for each host and the rate it is fetched at
+    :return: {host: {'requests': int, 'opened': int, 'reused': int, 'rate': float, 'throttled': int}}
+    """
+    stats = dict()
+    for host, bucket in buckets.items():
+        stats[host] = {'requests': 0, 'opened': 0, 'reused': 0, 'rate': bucket.rate, 'throttled': bucket.throttled}
+    if not session:
+        return stats
+    for adapter in set(session.adapters.values()):
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools[key]
+            host_stats = stats.setdefault(pool.host, {'requests': 0, 'opened': 0, 'reused': 0, 'rate': 0.0,
+                                                      'throttled': 0})
+            host_stats['requests'] += pool.num_requests
+            host_stats['opened'] += pool.num_connections
+            host_stats['reused'] += max(0, pool.num_requests - pool.num_connections)
+    return stats
@@ -1,21 +1,62 @@
 """ Some revenues are missing because I only looked for Worldwide revenue. This will fill in 0's with domestic """
-import pymongo
+from pymongo import UpdateOne
+from threading import Lock
+from data_collection.BatchWriter import BatchWriter
+from data_collection.CrawlEngine import CrawlEngine
 from data_collection.Film import Film
-from config.GLOBALS import MONGO_DB, MONGO_URL
+from config.GLOBALS import MONGO_DB, MONGO_URL, CRAWL_FETCHERS, CRAWL_PARSERS, CRAWL_HOST_CONCURRENCY, \
+    QUEUE_CAPACITY
+from utils.mongo import get_db
+from utils.print_colors import OKGREEN, FAIL, ENDC
 
 
 def main():
+    """
+    Fills in missing revenues with the domestic revenue from Box Office Mojo
+    :return: Boolean True if every update was saved
+    """
     print "Connecting to {0}...".format(MONGO_URL)
-    client = pymongo.MongoClient(MONGO_URL)
     print "Linking to the following data: {0}...".format(MONGO_DB)
-    db_conn = client[MONGO_DB]
-    # Films that need to be fixed
-    fix_films = db_conn['films'].find({"revenue": 0, "FAILED": False})
+    db_conn = get_db()
+    # Films that need to be fixed (only mojo_id is needed to find their revenue)
+    query = {"revenue": 0, "FAILED": False}
+    total = db_conn['films'].count_documents(query)
+    fix_films = db_conn['films'].find(query, {'mojo_id': True})
+    # Mojo pages are fetched concurrently under the shared rate limits and parsed on the engine's parse threads
+    engine = CrawlEngine(CRAWL_FETCHERS, CRAWL_PARSERS, CRAWL_HOST_CONCURRENCY, QUEUE_CAPACITY)
+    writer = BatchWriter(db_conn['films'], ['_id'])
+    progress = {'checked': 0, 'recovered': 0}
+    progress_lock = Lock()
+
+    def on_mojo_page(ff, tmp_f):
+        def callback(page):
+            tmp_f.set_mojo_page(page)
+            new_rev = tmp_f.set_revenue()
+            # If the revenue is greater than zero, update the revenue field
+            if new_rev > 0:
+                print "Updating the revenue for Film:{0} to ${1}".format(ff['mojo_id'], str(new_rev))
+                writer.add_request(UpdateOne({"_id": ff["_id"]}, {'$set': {'revenue': new_rev}}))
+            with progress_lock:
+                progress['checked'] += 1
+                if new_rev > 0:
+                    progress['recovered'] += 1
+        return callback
+
+    engine.start()
+    writer.start()
     for ff in fix_films:
         # Make a Film class (only mojo_id is important)
         tmp_f = Film(ff['mojo_id'], 'NoTitle', 3000)
-        new_rev = tmp_f.set_revenue()
-        # If the revenue is greater than zero, update the revenue field
-        if new_rev > 0:
-            print "Updating the revenue for Film:{0} to ${1}".format(ff['mojo_id'], str(new_rev))
-            db_conn['films'].update({"_id": ff["_id"]}, {'$set': {'revenue': new_rev}})
+        engine.submit(tmp_f.get_mojo_url(), on_mojo_page(ff, tmp_f))
+    while not engine.join(5):
+        print "{0}Checked {1}/{2} films, {3} revenues recovered{4}".format(
+            OKGREEN, progress['checked'], total, progress['recovered'], ENDC)
+    engine.stop()
+    saved = writer.close()
+    print "{0}Checked {1}/{2} films, {3} revenues recovered, {4} updates saved, {5} failed{6}".format(
+        OKGREEN, progress['checked'], total, progress['recovered'], writer.written, writer.failed, ENDC)
+    if not saved or writer.failed:
+        print "{0}{1} updates couldn't be saved and {2} were rejected, run again to recover them{3}".format(
+            FAIL, writer.pending(), writer.failed, ENDC)
+        return False
+    return True
@@ -0,0 +1,58 @@
+""" Rough memory accounting for the crawl - deep sizes of queued items and the process's resident memory """
+import os
+import resource
+import sys
+from types import ModuleType, FunctionType, MethodType, BuiltinFunctionType
+
+# Shared objects a deep size doesn't walk into
+SKIPPED_TYPES = (type, ModuleType, FunctionType, MethodType, BuiltinFunctionType)
+
+
+def get_deep_size(obj):
+    """
+    Gets the bytes held by an object and everything it references (walked without recursion, parsed pages are deep)
+    :param obj: any object
+    :return: int bytes (each object is counted once)
+    """
+    seen = set()
+    stack = [obj]
+    size = 0
+    while stack:
+        o = stack.pop()
+        if id(o) in seen or isinstance(o, SKIPPED_TYPES):
+            continue
+        seen.add(id(o))
+        size += sys.getsizeof(o)
+        if isinstance(o, dict):
+            stack.extend(o.keys())
+            stack.extend(o.values())
+        elif isinstance(o, (list, tuple, set, frozenset)):
+            stack.extend(o)
+        if hasattr(o, '__dict__'):
+            stack.append(o.__dict__)
+    return size
+
+
+def get_items_size(items):
+    """
+    Gets the average deep size of some items
+    :param items: [any object]
+    :return: int bytes (0 without items)
+    """
+    if not items:
+        return 0
+    return sum(get_deep_size(item) for item in items) // len(items)
+
+
+def get_resident_bytes():
+    """
+    Gets the resident memory of the process
+    :return: int bytes (the peak where /proc isn't available)
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, ValueError, IndexError):
+        # Kilobytes on Linux, bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
@@ -0,0 +1,298 @@
+""" Process wide metrics for the crawl - counters, gauges and latency histograms, served as Prometheus text and saved
+as JSON snapshots """
+import json
+import os
+import socket
+import time
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from threading import Thread, Lock, Event
+from config.GLOBALS import METRICS_PORT, METRICS_SNAPSHOT_FILE, METRICS_SNAPSHOT_INTERVAL, METRICS_LATENCY_BUCKETS
+
+# What each metric measures, for the Prometheus HELP lines
+HELP = {
+    'stage_items_total': 'Items finished by a pipeline stage',
+    'stage_errors_total': 'Items a pipeline stage raised on',
+    'stage_seconds': 'Seconds a pipeline stage spent on an item',
+    'stage_retries_total': 'Items put back on a queue after its stage raised on them',
+    'stage_dead_letters_total': 'Items given up on after their stage kept raising on them',
+    'fetch_seconds': 'Seconds a page fetch took over the network, retries included',
+    'fetch_responses_total': 'Pages fetched over the network by status code',
+    'fetch_bytes_total': 'Bytes of page content downloaded',
+    'queue_depth': 'Items waiting in a queue',
+    'queue_active': 'Items taken from a queue and not finished yet',
+    'queue_bytes': 'Estimated bytes held by the items waiting in a queue',
+    'process_resident_bytes': 'Resident memory of the crawl process'
+}
+
+# name -> {labels: float} for counters, name -> {labels: Histogram} for histograms
+counters = dict()
+histograms = dict()
+# name -> {labels: function returning the current value} for gauges, read when the metrics are collected
+gauges = dict()
+lock = Lock()
+started = time.time()
+# Server for /metrics while it is running, threads started by start and set to stop them
+server = None
+threads = []
+stopping = Event()
+
+
+class Histogram:
+    """ Counts of observations at or under each bucket bound, plus their count and sum """
+
+    def __init__(self, bounds=METRICS_LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * len(bounds)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        """
+        Adds an observation (must hold lock)
+        :param value: float
+        :mutate counts: adds one to every bucket the value fits in
+        :return: Nothing
+        """
+        for i, bound in enumerate(self.bounds):
+            if value <= bound:
+                self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+    def export(self):
+        """
+        Gets the histogram as plain values
+        :return: {'buckets': [[bound, count]], 'count': int, 'sum': float}
+        """
+        return {'buckets': [[b, c] for b, c in zip(self.bounds, self.counts)], 'count': self.count, 'sum': self.sum}
+
+
+def get_labels(labels):
+    """
+    Turns labels into a key
+    :param labels: dict of label name -> value
+    :return: tuple of (name, value) sorted by name
+    """
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def inc(name, labels, value=1):
+    """
+    Adds to a counter
+    :param name: metric name
+    :param labels: dict of label name -> value
+    :param value: amount to add
+    :mutate counters: adds to the counter
+    :return: Nothing
+    """
+    key = get_labels(labels)
+    with lock:
+        series = counters.setdefault(name, dict())
+        series[key] = series.get(key, 0) + value
+
+
+def observe(name, labels, value):
+    """
+    Adds an observation to a histogram
+    :param name: metric name
+    :param labels: dict of label name -> value
+    :param value: float, seconds for latencies
+    :mutate histograms: adds the observation
+    :return: Nothing
+    """
+    key = get_labels(labels)
+    with lock:
+        series = histograms.setdefault(name, dict())
+        if key not in series:
+            series[key] = Histogram()
+        series[key].observe(value)
+
+
+def add_gauge(name, labels, get_value):
+    """
+    Registers a gauge read when the metrics are collected
+    :param name: metric name
+    :param labels: dict of label name -> value
+    :param get_value: function taking nothing and returning a number
+    :mutate gauges: adds the gauge
+    :return: Nothing
+    """
+    with lock:
+        gauges.setdefault(name, dict())[get_labels(labels)] = get_value
+
+
+def get_snapshot():
+    """
+    Gets the current value of every metric
+    :return: {'time': float, 'uptime': float, 'counters': {name: [[labels, value]]},
+              'gauges': {name: [[labels, value]]}, 'histograms': {name: [[labels, Histogram.export()]]}}
+    """
+    with lock:
+        snapshot = {'time': time.time(), 'uptime': time.time() - started,
+                    'counters': dict((n, [[dict(k), v] for k, v in s.items()]) for n, s in counters.items()),
+                    'histograms': dict((n, [[dict(k), h.export()] for k, h in s.items()])
+                                       for n, s in histograms.items())}
+        read = [(n, k, f) for n, s in gauges.items() for k, f in s.items()]
+    # Gauges are read outside the lock, they may take locks of their own
+    snapshot['gauges'] = dict()
+    for name, key, get_value in read:
+        snapshot['gauges'].setdefault(name, []).append([dict(key), get_value()])
+    return snapshot
+
+
+def add_rates(snapshot, last):
+    """
+    Adds per second rates of the counters since the last snapshot
+    :param snapshot: from get_snapshot
+    :param last: the snapshot before it (None for rates since the start)
+    :mutate snapshot: adds 'rates' {name: [[labels, float]]}
+    :return: snapshot
+    """
+    before = dict()
+    if last:
+        for name, series in last['counters'].items():
+            for labels, value in series:
+                before[(name, get_labels(labels))] = value
+    elapsed = snapshot['time'] - last['time'] if last else snapshot['uptime']
+    snapshot['rates'] = dict()
+    for name, series in snapshot['counters'].items():
+        snapshot['rates'][name] = [[labels, (value - before.get((name, get_labels(labels)), 0)) / max(elapsed, 1e-6)]
+                                   for labels, value in series]
+    return snapshot
+
+
+def format_labels(labels, extra=()):
+    """
+    Formats labels for the Prometheus text format
+    :param labels: dict of label name -> value
+    :param extra: more (name, value) pairs
+    :return: string like {host="www.imdb.com",code="200"} ('' for no labels)
+    """
+    pairs = sorted(labels.items()) + list(extra)
+    if not pairs:
+        return ''
+    escaped = [(k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in pairs]
+    return '{' + ','.join('{0}="{1}"'.format(k, v) for k, v in escaped) + '}'
+
+
+def render(snapshot):
+    """
+    Formats a snapshot in the Prometheus text exposition format
+    :param snapshot: from get_snapshot
+    :return: string
+    """
+    lines = []
+    for kind, section in [('counter', 'counters'), ('gauge', 'gauges')]:
+        for name, series in sorted(snapshot[section].items()):
+            lines.append('# HELP {0} {1}'.format(name, HELP.get(name, name)))
+            lines.append('# TYPE {0} {1}'.format(name, kind))
+            for labels, value in series:
+                lines.append('{0}{1} {2}'.format(name, format_labels(labels), value))
+    for name, series in sorted(snapshot['histograms'].items()):
+        lines.append('# HELP {0} {1}'.format(name, HELP.get(name, name)))
+        lines.append('# TYPE {0} histogram'.format(name))
+        for labels, h in series:
+            for bound, count in h['buckets']:
+                lines.append('{0}_bucket{1} {2}'.format(name, format_labels(labels, [('le', bound)]), count))
+            lines.append('{0}_bucket{1} {2}'.format(name, format_labels(labels, [('le', '+Inf')]), h['count']))
+            lines.append('{0}_sum{1} {2}'.format(name, format_labels(labels), h['sum']))
+            lines.append('{0}_count{1} {2}'.format(name, format_labels(labels), h['count']))
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """ Answers GET /metrics with the Prometheus text and GET /metrics.json with a JSON snapshot """
+
+    def do_GET(self):
+        if self.path == '/metrics':
+            body, content_type = render(get_snapshot()), 'text/plain; version=0.0.4'
+        elif self.path == '/metrics.json':
+            body, content_type = json.dumps(add_rates(get_snapshot(), None)), 'application/json'
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        # Scrapes aren't printed among the crawl's output
+        pass
+
+
+def write_snapshot(path, last):
+    """
+    Writes a JSON snapshot, replacing the file in one step so readers never see half of one
+    :param path: file to write
+    :param last: the snapshot written before (None for the first)
+    :return: the snapshot written
+    """
+    snapshot = add_rates(get_snapshot(), last)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(snapshot, f)
+    os.rename(path + '.tmp', path)
+    return snapshot
+
+
+def snapshot_loop(path, interval):
+    """
+    Writes a JSON snapshot every interval seconds until stopped
+    :param path: file to write
+    :param interval: seconds between snapshots
+    :return: Nothing
+    """
+    last = None
+    while not stopping.wait(interval):
+        try:
+            last = write_snapshot(path, last)
+        except (IOError, OSError) as e:
+            print "Failed to write metrics snapshot {0}: {1}".format(path, str(e))
+
+
+def start(port=METRICS_PORT, path=METRICS_SNAPSHOT_FILE, interval=METRICS_SNAPSHOT_INTERVAL):
+    """
+    Starts serving the metrics on localhost and writing JSON snapshots, each on a daemon thread
+    :param port: port for /metrics and /metrics.json (None to not serve them, they aren't served if it is taken)
+    :param path: file JSON snapshots are written to (None to not write them)
+    :param interval: seconds between snapshots
+    :mutate server: sets it
+    :mutate threads: adds every started thread
+    :return: Nothing
+    """
+    global server
+    stopping.clear()
+    if port is not None:
+        try:
+            server = HTTPServer(('127.0.0.1', port), MetricsHandler)
+        except socket.error as e:
+            # Another crawl (or fix_revenues) may be serving on it, this one runs without the endpoint
+            print "Failed to serve metrics on port {0}, continuing without them: {1}".format(port, str(e))
+        else:
+            threads.append(Thread(target=server.serve_forever))
+            print "Serving metrics on http://127.0.0.1:{0}/metrics".format(server.server_port)
+    if path is not None:
+        threads.append(Thread(target=snapshot_loop, args=(path, interval)))
+    for t in threads:
+        t.daemon = True
+        t.start()
+
+
+def stop():
+    """
+    Stops serving the metrics and writing snapshots, waiting for their threads to exit
+    :mutate server: sets it back to None
+    :mutate threads: removes every thread
+    :mutate stopping: set
+    :return: Nothing
+    """
+    global server
+    stopping.set()
+    if server:
+        server.shutdown()
+        server.server_close()
+        server = None
+    for t in threads:
+        t.join()
+    del threads[:]
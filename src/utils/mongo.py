@@ -0,0 +1,29 @@
+""" Shared MongoDB client - one connection pool for every thread of the process """
+import pymongo
+from threading import Lock
+from config.GLOBALS import MONGO_URL, MONGO_DB
+
+# Process wide client, created on first use
+client = None
+client_lock = Lock()
+
+
+def get_client():
+    """
+    Gets the shared client, creating it if needed (MongoClient is thread safe and pools its connections)
+    :mutate client: creates it on first call
+    :return: pymongo.MongoClient
+    """
+    global client
+    with client_lock:
+        if not client:
+            client = pymongo.MongoClient(MONGO_URL)
+    return client
+
+
+def get_db():
+    """
+    Gets the MONGO_DB database on the shared client
+    :return: pymongo.database.Database
+    """
+    return get_client()[MONGO_DB]
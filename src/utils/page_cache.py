@@ -0,0 +1,186 @@
+""" On-disk cache of fetched page bodies - zlib compressed, keyed by url hash, expired by url pattern and evicted LRU """
+import hashlib
+import json
+import os
+import re
+import tempfile
+import time
+import zlib
+from collections import OrderedDict
+from threading import Lock
+from config.GLOBALS import HTTP_CACHE_DIR, HTTP_CACHE_SIZE, HTTP_CACHE_TTLS
+
+# Suffix of the files holding cached pages
+CACHE_SUFFIX = '.page'
+
+
+class CachedResponse(object):
+    """ A page read back from the cache - has the fields the scrapers read from a requests.Response """
+
+    def __init__(self, url, status_code, content):
+        self.url = url
+        self.status_code = status_code
+        self.content = content
+
+
+class PageCache:
+    def __init__(self, directory, max_bytes, ttls):
+        # Directory pages are saved in (one sub-directory per first two hex digits of the key)
+        self.directory = directory
+        # Disk budget, least recently used pages are removed past it
+        self.max_bytes = max_bytes
+        # [(compiled url pattern, seconds a page stays fresh)], first match wins
+        self.ttls = [(re.compile(pattern), ttl) for pattern, ttl in ttls]
+        # path -> size in bytes, least recently used first (read from disk on first use)
+        self.entries = None
+        self.total_bytes = 0
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def get_key(url):
+        """
+        Gets the content address of a url
+        :param url: page url
+        :return: hex string
+        """
+        if isinstance(url, unicode):
+            url = url.encode('utf-8')
+        return hashlib.sha1(url).hexdigest()
+
+    def get_path(self, url):
+        """
+        Gets the file a url's page is saved in
+        :param url: page url
+        :return: string path
+        """
+        key = self.get_key(url)
+        return os.path.join(self.directory, key[:2], key + CACHE_SUFFIX)
+
+    def get_ttl(self, url):
+        """
+        Gets how long a url's page stays fresh
+        :param url: page url
+        :return: seconds (None if the page is never cached)
+        """
+        for pattern, ttl in self.ttls:
+            if pattern.search(url):
+                return ttl
+        return None
+
+    def load_entries(self):
+        """
+        Reads the pages already on disk, oldest access first (must hold lock)
+        :mutate entries: fills it
+        :mutate total_bytes: sums the page sizes
+        :return: Nothing
+        """
+        found = []
+        for root, dirs, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith(CACHE_SUFFIX):
+                    path = os.path.join(root, name)
+                    stat = os.stat(path)
+                    found.append((stat.st_mtime, path, stat.st_size))
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        for mtime, path, size in sorted(found):
+            self.entries[path] = size
+            self.total_bytes += size
+
+    def touch(self, path, size):
+        """
+        Marks a page as most recently used (must hold lock)
+        :param path: file of the page
+        :param size: bytes on disk (None to forget the page)
+        :mutate entries: moves the page to the end
+        :mutate total_bytes: updates for the page's size
+        :return: Nothing
+        """
+        if self.entries is None:
+            self.load_entries()
+        self.total_bytes -= self.entries.pop(path, 0)
+        if size is not None:
+            self.entries[path] = size
+            self.total_bytes += size
+
+    def evict(self):
+        """
+        Removes least recently used pages until the cache fits its budget (must hold lock)
+        :mutate entries: removes pages
+        :mutate total_bytes: drops their sizes
+        :return: Nothing
+        """
+        while self.total_bytes > self.max_bytes and self.entries:
+            path, size = self.entries.popitem(last=False)
+            self.total_bytes -= size
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def get(self, url):
+        """
+        Reads a fresh page from the cache
+        :param url: page url
+        :mutate hits, misses: counts the lookup
+        :return: CachedResponse or None if the page isn't cached or has expired
+        """
+        ttl = self.get_ttl(url)
+        path = self.get_path(url)
+        cached = None
+        if ttl is not None:
+            try:
+                with open(path, 'rb') as f:
+                    header, content = zlib.decompress(f.read()).split('\n', 1)
+                header = json.loads(header)
+                if time.time() - header['fetched'] <= ttl:
+                    cached = CachedResponse(url, header['status'], content)
+            except (IOError, OSError, ValueError, zlib.error):
+                cached = None
+        with self.lock:
+            if cached is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            # The modified time orders pages for eviction on the next run
+            try:
+                os.utime(path, None)
+                self.touch(path, os.path.getsize(path))
+            except OSError:
+                pass
+        return cached
+
+    def put(self, url, response):
+        """
+        Saves a fetched page to the cache
+        :param url: page url
+        :param response: requests.Response
+        :mutate entries: adds the page and evicts others past the budget
+        :return: Nothing
+        """
+        if self.get_ttl(url) is None:
+            return
+        header = json.dumps({'url': url, 'fetched': time.time(), 'status': response.status_code})
+        data = zlib.compress(header + '\n' + response.content)
+        path = self.get_path(url)
+        folder = os.path.dirname(path)
+        if not os.path.isdir(folder):
+            try:
+                os.makedirs(folder)
+            except OSError:
+                # Another thread made it first
+                pass
+        # Written to a temp file and renamed so readers never see half a page
+        fd, tmp_path = tempfile.mkstemp(dir=folder)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.rename(tmp_path, path)
+        with self.lock:
+            self.touch(path, len(data))
+            self.evict()
+
+
+# Process wide cache, None if HTTP_CACHE_DIR is not set
+cache = PageCache(HTTP_CACHE_DIR, HTTP_CACHE_SIZE, HTTP_CACHE_TTLS) if HTTP_CACHE_DIR else None
@@ -0,0 +1,132 @@
+""" Per-host token buckets shared by every fetch - the rate climbs while a host is healthy and backs off when it isn't """
+import time
+from email.utils import parsedate_tz, mktime_tz
+from threading import Lock
+from config.GLOBALS import HTTP_RATE_START, HTTP_RATE_MIN, HTTP_RATE_MAX, HTTP_RATE_STEP, HTTP_RATE_BACKOFF, \
+    HTTP_SLOW_LATENCY, HTTP_RETRY_DELAY
+
+# Status codes a host sends when it wants fewer requests
+THROTTLE_CODES = set([429, 503])
+
+
+def get_retry_after(response):
+    """
+    Reads the Retry-After header of a response
+    :param response: requests.Response
+    :return: seconds to wait (None if the header is missing or can't be read)
+    """
+    value = response.headers.get('Retry-After', '').strip()
+    if not value:
+        return None
+    if value.isdigit():
+        return float(value)
+    date = parsedate_tz(value)
+    if date is None:
+        return None
+    return max(0.0, mktime_tz(date) - time.time())
+
+
+class TokenBucket:
+    def __init__(self, host):
+        self.host = host
+        # Requests per second currently allowed
+        self.rate = HTTP_RATE_START
+        # Requests that can be sent right now (up to a second's worth)
+        self.tokens = 1.0
+        self.updated = time.time()
+        # No requests are sent before this time after a host throttled us
+        self.blocked_until = 0.0
+        # Last time the rate was lowered, it is lowered at most once a second
+        self.lowered = 0.0
+        self.lock = Lock()
+        self.throttled = 0
+
+    def refill(self, now):
+        """
+        Adds the tokens earned since the last refill (must hold lock)
+        :param now: current time
+        :mutate tokens: adds to it
+        :return: Nothing
+        """
+        self.tokens = min(max(1.0, self.rate), self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        """
+        Waits until a request can be sent to the host
+        :mutate tokens: takes one
+        :return: Nothing
+        """
+        while True:
+            with self.lock:
+                now = time.time()
+                self.refill(now)
+                if now < self.blocked_until:
+                    wait = self.blocked_until - now
+                elif self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                else:
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def lower(self, now):
+        """
+        Cuts the rate, once a second at most so a burst of bad responses counts once (must hold lock)
+        :param now: current time
+        :mutate rate: multiplies by HTTP_RATE_BACKOFF
+        :return: Nothing
+        """
+        if now - self.lowered >= 1:
+            self.rate = max(HTTP_RATE_MIN, self.rate * HTTP_RATE_BACKOFF)
+            self.lowered = now
+
+    def on_response(self, status_code, latency):
+        """
+        Adjusts the rate for a response that wasn't throttled
+        :param status_code: HTTP status (None if the request raised)
+        :param latency: seconds the request took
+        :mutate rate: raises it by about HTTP_RATE_STEP a second while healthy, lowers it otherwise
+        :return: Nothing
+        """
+        with self.lock:
+            if status_code is None or status_code >= 500 or latency > HTTP_SLOW_LATENCY:
+                self.lower(time.time())
+            else:
+                self.rate = min(HTTP_RATE_MAX, self.rate + HTTP_RATE_STEP / self.rate)
+
+    def on_throttle(self, retry_after, attempt):
+        """
+        Backs off after the host throttled a request
+        :param retry_after: seconds the host asked us to wait (None if it didn't say)
+        :param attempt: number of times the request was already retried
+        :mutate rate: lowers it
+        :mutate blocked_until: holds every request to the host until the wait is over
+        :return: seconds until the request can be retried
+        """
+        if retry_after is None:
+            retry_after = HTTP_RETRY_DELAY * 2 ** attempt
+        with self.lock:
+            now = time.time()
+            self.throttled += 1
+            self.lower(now)
+            self.blocked_until = max(self.blocked_until, now + retry_after)
+            return self.blocked_until - now
+
+
+# host -> TokenBucket
+buckets = dict()
+buckets_lock = Lock()
+
+
+def get_bucket(host):
+    """
+    Gets the token bucket of a host, creating it if needed
+    :param host: host name
+    :mutate buckets: adds a bucket for new hosts
+    :return: TokenBucket
+    """
+    with buckets_lock:
+        if host not in buckets:
+            buckets[host] = TokenBucket(host)
+        return buckets[host]
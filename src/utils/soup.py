@@ -0,0 +1,29 @@
+""" Parses pages with the fastest BeautifulSoup backend installed (lxml if it is, html.parser otherwise) """
+from bs4 import BeautifulSoup
+
+try:
+    import lxml
+    PARSER = 'lxml'
+except ImportError:
+    PARSER = 'html.parser'
+
+
+def make_soup(content):
+    """
+    Parses a page
+    :param content: HTML of the page
+    :return: BS'd HTML
+    """
+    return BeautifulSoup(content, PARSER)
+
+
+def release_soup(soup):
+    """
+    Frees a parsed page right away - its nodes reference each other, so a dropped tree otherwise waits on the garbage
+    collector
+    :param soup: BS'd HTML (or None)
+    :mutate soup: empties it
+    :return: Nothing
+    """
+    if soup is not None:
+        soup.decompose()